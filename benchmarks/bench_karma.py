@@ -0,0 +1,76 @@
+"""Benchmark /give throughput through the full handler pipeline.
+
+Usage: python -m benchmarks.bench_karma [--updates 20000] [--chats 10] [--users 2000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+# Placeholder settings so config imports without a real .env
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:bench")
+os.environ.setdefault("OPENWEATHER_API_KEY", "bench")
+os.environ.setdefault("GOOGLE_API_KEY", "bench")
+os.environ.setdefault("GOOGLE_SEARCH_ENGINE_ID", "bench")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", os.environ["TELEGRAM_TOKEN"])
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_karma.sqlite3")
+
+from telegram import Update  # noqa: E402
+
+from bot import create_bot  # noqa: E402
+from bot.karma import KarmaStore  # noqa: E402
+from bot.testing import FakeBotRequest, make_text_update  # noqa: E402
+
+
+def bench_store(n, chats, users):
+    """Raw KarmaStore increments and leaderboard reads per second."""
+    store = KarmaStore()
+    ops = [(random.randrange(chats), random.randrange(users)) for _ in range(n)]
+    start = time.perf_counter()
+    for chat_id, user_id in ops:
+        store.add(chat_id, user_id)
+        store.top(chat_id)
+    elapsed = time.perf_counter() - start
+    print(f"store: {n} add+top in {elapsed:.3f}s -> {n / elapsed:,.0f} ops/s")
+
+
+async def bench_pipeline(n, chats, users):
+    """Full /give updates per second through Application.process_update."""
+    application = create_bot(request=FakeBotRequest())
+    # Givers are spread out so the per-user give limit doesn't reject the run
+    application.bot_data["karma"].give_limit = n
+    payloads = [
+        make_text_update(
+            "/give", chat_id=-(1 + random.randrange(chats)),
+            user_id=1 + i % users, reply_to_user_id=users + 1 + random.randrange(users),
+        )
+        for i in range(n)
+    ]
+
+    async with application:
+        updates = [Update.de_json(payload, application.bot) for payload in payloads]
+        start = time.perf_counter()
+        await asyncio.gather(*(application.process_update(update) for update in updates))
+        elapsed = time.perf_counter() - start
+
+    total = sum(application.bot_data["karma"].get(-(1 + c), u) for c in range(chats)
+                for u in range(users + 1, 2 * users + 1))
+    print(f"pipeline: {n} /give updates in {elapsed:.3f}s -> {n / elapsed:,.0f} updates/s "
+          f"(karma total {total}, lost updates {n - total})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--users", type=int, default=2000)
+    args = parser.parse_args()
+
+    bench_store(args.updates, args.chats, args.users)
+    asyncio.run(bench_pipeline(args.updates, args.chats, args.users))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Benchmark response-pack matching cost against pack size.
+
+Builds synthetic packs from 100 up to --max-patterns patterns and reports the
+time to build the index, its memory, and the time to match a message.
+
+Usage: python -m benchmarks.bench_packs [--max-patterns 1000000] [--messages 20000]
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from bot.messages import ResponsePack
+
+CATEGORIES = 20
+
+
+def make_pack(patterns, vocabulary):
+    """A pack with the given number of one- to three-word patterns spread over CATEGORIES categories."""
+    categories = [{"name": f"c{i}", "patterns": [], "responses": [f"response {i}"]} for i in range(CATEGORIES)]
+    for i in range(patterns):
+        words = random.choices(vocabulary, k=random.randint(1, 3))
+        categories[i % CATEGORIES]["patterns"].append(" ".join(words))
+    return {"categories": categories, "unknown": ["?"]}
+
+
+def bench(patterns, messages, vocabulary):
+    data = make_pack(patterns, vocabulary)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    pack = ResponsePack("bench", data)
+    build = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    texts = [" ".join(random.choices(vocabulary, k=random.randint(3, 15))) for _ in range(messages)]
+    matched = 0
+    start = time.perf_counter()
+    for text in texts:
+        if pack.matcher.match(text) is not None:
+            matched += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(pack.matcher):>9,} patterns: build {build * 1000:8.1f}ms, index {memory / 1024 / 1024:7.1f}MiB, "
+          f"match {elapsed / messages * 1e6:6.2f}us/message ({matched / messages:.0%} matched)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-patterns", type=int, default=1_000_000)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--vocabulary", type=int, default=50000, help="distinct words to draw from")
+    args = parser.parse_args()
+
+    random.seed(1)
+    vocabulary = [f"w{i}" for i in range(args.vocabulary)]
+    size = 100
+    while size <= args.max_patterns:
+        bench(size, args.messages, vocabulary)
+        size *= 10
+
+
+if __name__ == "__main__":
+    main()
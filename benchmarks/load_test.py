@@ -0,0 +1,224 @@
+"""Replay synthetic or recorded Telegram update streams through the bot and report throughput.
+
+The Application comes from create_bot() with a fake token. The Bot API is
+replaced by FakeBotRequest and Google/OpenWeather by an httpx.MockTransport,
+each with configurable latency. Updates are injected open-loop at a fixed
+rate through the application's update processor, like the update fetcher
+does, and the results are written as JSON so CI can diff runs.
+
+Usage:
+    python -m benchmarks.load_test --updates 5000 --rate 500 --output bench.json
+    python -m benchmarks.load_test --replay updates.jsonl   # one Update JSON per line
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+# Placeholder settings so config imports without a real .env
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:bench")
+os.environ.setdefault("OPENWEATHER_API_KEY", "bench")
+os.environ.setdefault("GOOGLE_API_KEY", "bench")
+os.environ.setdefault("GOOGLE_SEARCH_ENGINE_ID", "bench")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/load_test.sqlite3")
+os.environ.setdefault("METRICS_PORT", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+if "--telegram-limits" not in sys.argv:
+    # Measure the bot, not Telegram's flood limits
+    for name in ("SEND_GLOBAL_RATE", "SEND_PRIVATE_RATE", "SEND_GROUP_RATE"):
+        os.environ.setdefault(name, "1000000")
+
+import httpx  # noqa: E402
+from telegram import Update  # noqa: E402
+
+from bot import create_bot  # noqa: E402
+from bot.http_client import HttpClient  # noqa: E402
+from bot.testing import FakeBotRequest, make_callback_update, make_text_update  # noqa: E402
+from bot.webhook import start_application, stop_application  # noqa: E402
+
+WORDS = ["cat", "dog", "london", "paris", "tokyo", "sunset", "pizza", "meme", "space", "car"]
+TEXTS = ["hello", "thanks man", "how are you", "bye", "what can you do", "random chatter here"]
+
+# Scenario weights for the synthetic mix
+MIX = {"command": 40, "text": 40, "poll": 10, "karma": 10}
+
+
+def upstream_stub(latency):
+    """Stand-in for Google Custom Search and OpenWeather."""
+    async def handler(request):
+        if latency:
+            await asyncio.sleep(latency)
+        if "openweathermap" in request.url.host:
+            return httpx.Response(200, json={
+                "main": {"temp": 18.5, "humidity": 60},
+                "weather": [{"description": "light rain"}],
+                "wind": {"speed": 3.2},
+            })
+        query = request.url.params.get("q", "")
+        return httpx.Response(200, json={
+            "items": [{"link": f"https://img.example/{query}/{i}.jpg"} for i in range(5)]
+        })
+    return httpx.MockTransport(handler)
+
+
+def synthetic_stream(n, chats, users):
+    """Yield (label, update payload) pairs for a mixed workload."""
+    scenarios = list(MIX)
+    weights = list(MIX.values())
+    produced = 0
+    while produced < n:
+        chat_id = random.randrange(1, chats + 1)
+        user_id = chat_id if chats == users else random.randrange(1, users + 1)
+        scenario = random.choices(scenarios, weights)[0]
+        if scenario == "command":
+            command = random.choice(["/start", "/help", "/weather", "/image", "/gif"])
+            text = command if command in ("/start", "/help") else f"{command} {random.choice(WORDS)}"
+            batch = [(command.lstrip("/"), make_text_update(text, chat_id, user_id))]
+        elif scenario == "text":
+            batch = [("text", make_text_update(random.choice(TEXTS), chat_id, user_id))]
+        elif scenario == "karma":
+            batch = [("give", make_text_update("/give", chat_id, user_id, reply_to_user_id=user_id + 1))]
+        else:
+            batch = [
+                ("poll", make_text_update("/poll", chat_id, user_id)),
+                ("poll_question", make_text_update("Lunch?", chat_id, user_id)),
+                ("poll_callback", make_callback_update("add_option", chat_id, user_id)),
+                ("poll_option", make_text_update(random.choice(WORDS), chat_id, user_id)),
+                ("poll_callback", make_callback_update("finish_poll", chat_id, user_id)),
+            ]
+        for item in batch:
+            yield item
+            produced += 1
+
+
+def replay_stream(path):
+    """Yield (label, update payload) pairs from a JSON-lines file of recorded updates."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            payload = json.loads(line)
+            text = (payload.get("message") or {}).get("text", "")
+            if "callback_query" in payload:
+                label = "callback"
+            elif text.startswith("/"):
+                label = text.split()[0].lstrip("/").split("@")[0]
+            else:
+                label = "text"
+            yield label, payload
+
+
+def rss_kb():
+    """Current resident set size in KiB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if len(samples) < 2:
+        value = samples[0] * 1000 if samples else 0.0
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50_ms": cuts[49] * 1000, "p95_ms": cuts[94] * 1000, "p99_ms": cuts[98] * 1000}
+
+
+async def run(args):
+    bot_api = FakeBotRequest(latency=args.bot_latency)
+    application = create_bot(token=os.environ["TELEGRAM_TOKEN"], request=bot_api)
+    application.bot_data["http"] = HttpClient(transport=upstream_stub(args.upstream_latency))
+
+    if args.replay:
+        stream = list(replay_stream(args.replay))
+    else:
+        stream = list(synthetic_stream(args.updates, args.chats, args.users))
+
+    latencies = {}
+    errors = 0
+
+    # The same startup as run_polling, so post_init's jobs and services are part of the run
+    await start_application(application)
+    try:
+        processor = application.update_processor
+        updates = [(label, Update.de_json(payload, application.bot)) for label, payload in stream]
+
+        async def handle(label, update):
+            nonlocal errors
+            start = time.perf_counter()
+            try:
+                await processor.process_update(update, application.process_update(update))
+            except Exception:
+                errors += 1
+            latencies.setdefault(label, []).append(time.perf_counter() - start)
+
+        rss_start = rss_kb()
+        started = time.perf_counter()
+        tasks = []
+        for i, (label, update) in enumerate(updates):
+            if args.rate:
+                delay = started + i / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(handle(label, update)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        rss_end = rss_kb()
+    finally:
+        await stop_application(application)
+
+    every = [sample for samples in latencies.values() for sample in samples]
+    return {
+        "updates": len(updates),
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "updates_per_s": len(updates) / elapsed if elapsed else 0.0,
+        "target_rate": args.rate,
+        "bot_latency_s": args.bot_latency,
+        "upstream_latency_s": args.upstream_latency,
+        "bot_api_calls": len(bot_api.calls),
+        "rss_start_kb": rss_start,
+        "rss_end_kb": rss_end,
+        "rss_growth_kb": rss_end - rss_start,
+        "overall": percentiles(every),
+        "handlers": {
+            label: {"count": len(samples), **percentiles(samples)}
+            for label, samples in sorted(latencies.items())
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=2000, help="number of synthetic updates")
+    parser.add_argument("--rate", type=float, default=0, help="updates/sec to inject (0 = as fast as possible)")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="seconds per fake Bot API call")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="seconds per Google/OpenWeather call")
+    parser.add_argument("--replay", help="JSON-lines file of recorded Update payloads")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--telegram-limits", action="store_true", help="keep the real send rate limits")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = asyncio.run(run(args))
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
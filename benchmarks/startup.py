@@ -0,0 +1,113 @@
+"""Measure cold-start time: from launching the interpreter to answering the first update.
+
+Each run starts a fresh Python process that imports the bot, builds it with
+create_bot() against FakeBotRequest, and starts it the way run_polling()
+does. The first getUpdates call returns one /start update; the run ends when
+the reply is sent. Timings are wall-clock from just before the process was
+spawned, so interpreter startup and imports are included.
+
+Usage:
+    python -m benchmarks.startup --runs 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PHASES = ["imported", "built", "initialized", "first_update"]
+
+
+def child(latency):
+    """Run inside the spawned process; prints phase timestamps as JSON."""
+    marks = {}
+    started = float(os.environ["STARTUP_T0"])
+
+    import asyncio
+
+    from bot import create_bot
+    from bot.testing import FakeBotRequest, make_text_update
+    marks["imported"] = time.time()
+
+    bot_api = FakeBotRequest(latency=latency)
+    bot_api.pending_updates.append(make_text_update("/start"))
+    application = create_bot(token=os.environ["TELEGRAM_TOKEN"], request=bot_api)
+    marks["built"] = time.time()
+
+    async def run():
+        # The same steps as Application.run_polling()
+        await application.initialize()
+        await application.post_init(application)
+        marks["initialized"] = time.time()
+        await application.updater.start_polling()
+        await application.start()
+        while not bot_api.sent("sendMessage"):
+            await asyncio.sleep(0.001)
+        marks["first_update"] = time.time()
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+    asyncio.run(run())
+    print(json.dumps({phase: (marks[phase] - started) * 1000 for phase in PHASES}))
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "min_ms": samples[0],
+        "median_ms": statistics.median(samples),
+        "max_ms": samples[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="seconds per fake Bot API call")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.bot_latency)
+        return
+
+    env = dict(os.environ)
+    # Placeholder settings so the bot starts without a real .env
+    env.setdefault("TELEGRAM_TOKEN", "123456:bench")
+    env.setdefault("OPENWEATHER_API_KEY", "bench")
+    env.setdefault("GOOGLE_API_KEY", "bench")
+    env.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/startup.sqlite3")
+    env.setdefault("METRICS_PORT", "0")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    env.setdefault("SEND_PRIVATE_RATE", "1000000")
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    runs = []
+    for _ in range(args.runs):
+        env["STARTUP_T0"] = repr(time.time())
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup", "--child", "--bot-latency", str(args.bot_latency)],
+            cwd=root, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    results = {
+        "runs": args.runs,
+        "bot_latency_s": args.bot_latency,
+        "phases": {phase: summarize([run[phase] for run in runs]) for phase in PHASES},
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
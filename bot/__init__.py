@@ -1,38 +1,237 @@
-import os
+import asyncio
+import logging
+import sys
+from telegram import Bot
 from telegram.ext import ApplicationBuilder
-from config import TELEGRAM_TOKEN
-from .handlers import register_handlers
+import config
+from config import (
+    TELEGRAM_TOKEN, WEATHER_API_KEY, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH,
+    WEBHOOK_HOST, WEBHOOK_PORT, METRICS_HOST, METRICS_PORT,
+    PACKS_RELOAD_INTERVAL, POLL_SWEEP_INTERVAL, ADMISSION_COMPACT_INTERVAL,
+    BOT_WORKERS, BOT_WORKER_INDEX, SHARED_STATE_PURGE_INTERVAL, TRACE_ENABLED,
+)
+from .handlers import register_handlers, search_images, fetch_forecast, format_forecast
+from .cache import LastGoodStore, ResponseCache
+from .karma import KarmaStore
+from .messages import ResponsePacks
+from .admission import AdmissionControl
+from .shared import open_shared_state, purge_job
+from . import tracing
+from .metrics import add_collector, start_metrics_server
+from .sender import SendScheduler
+from .concurrency import BackpressureQueue, ChatOrderedUpdateProcessor
 
 __all__ = ['TELEGRAM_TOKEN']
 
-def create_bot():
-    """Initialize and configure the bot application"""
+logger = logging.getLogger(__name__)
+
+def chat_filter():
+    """With sharded workers, the check for the chats this one handles; None otherwise."""
+    if BOT_WORKERS > 1:
+        from .workers import owns_chat
+        return owns_chat
+    return None
+
+async def post_init(application):
+    """Load state that handlers need before the first update"""
+    # With sharded workers, each one loads only the chats it handles
+    owns_chat = chat_filter()
+    await application.bot_data["karma"].load(owns_chat)
+    await application.bot_data["media"].load()
+    await application.bot_data["last_good"].load()
+    await application.bot_data["weather_subscriptions"].load(application.job_queue, owns_chat)
+    await application.bot_data["poll_votes"].load(application.job_queue, owns_chat)
+    if PACKS_RELOAD_INTERVAL:
+        application.job_queue.run_repeating(
+            application.bot_data["packs"].reload_job, interval=PACKS_RELOAD_INTERVAL, name="reload_packs"
+        )
+    if SHARED_STATE_PURGE_INTERVAL:
+        application.job_queue.run_repeating(purge_job, interval=SHARED_STATE_PURGE_INTERVAL, name="purge_shared_state")
+    if ADMISSION_COMPACT_INTERVAL:
+        application.job_queue.run_repeating(
+            application.bot_data["admission"].compact_job, interval=ADMISSION_COMPACT_INTERVAL,
+            name="compact_admission"
+        )
+    if POLL_SWEEP_INTERVAL:
+        application.job_queue.run_repeating(
+            application.bot_data["poll_sweeper"].sweep_job, interval=POLL_SWEEP_INTERVAL, name="sweep_polls"
+        )
+
+    # Tracing is off unless configured, and SIGUSR1 flips it without a restart
+    loop = asyncio.get_running_loop()
+    tracing.install_toggle(loop)
+    if TRACE_ENABLED:
+        tracing.enable(loop)
+
+    # Served on its own listener, never on the public webhook port
+    if METRICS_PORT:
+        # Sharded workers each serve their own port, counting up from METRICS_PORT
+        application.bot_data["metrics_server"] = await start_metrics_server(
+            METRICS_HOST, METRICS_PORT + BOT_WORKER_INDEX
+        )
+
+async def post_stop(application):
+    """Stage in-memory state for persistence before the application shuts down and flushes it"""
+    application.bot_data["poll_votes"].flush()
+
+async def post_shutdown(application):
+    """Release resources owned by the application"""
+    tracing.disable()
+
+    http = application.bot_data.pop("http", None)
+    if http:
+        await http.close()
+
+    metrics_server = application.bot_data.pop("metrics_server", None)
+    if metrics_server:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+
+    # /calc and /weather load these on first use
+    calc = sys.modules.get("bot.calc")
+    if calc:
+        calc.shutdown_executor()
+    cities = application.bot_data.pop("cities", None)
+    if cities:
+        cities.close()
+
+    shared = application.bot_data.pop("shared", None)
+    if shared:
+        await shared.close()
+
+def create_bot(token=TELEGRAM_TOKEN, request=None):
+    """Initialize and configure the bot application
+
+    :param token: The bot token
+    :param request: Optional telegram.request.BaseRequest used for Bot API calls,
+        e.g. bot.testing.FakeBotRequest in tests
+    """
+    # Imported here rather than with the package, so tools and tests that
+    # only need part of it don't load SQLAlchemy and every integration
+    from .http_client import HttpClient
+    from .imagepool import ImagePool
+    from .media import MediaCache
+    from .persistence import SQLPersistence
+    from .polls import PollSweeper, PollVotes
+    from .subscriptions import WeatherSubscriptions
+
     try:
         # Create the Application instance
-        application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+        update_queue = BackpressureQueue()
+        builder = (
+            ApplicationBuilder()
+            .token(token)
+            .persistence(SQLPersistence(owns_chat=chat_filter()))
+            .rate_limiter(SendScheduler())
+            .concurrent_updates(ChatOrderedUpdateProcessor(update_queue))
+            .update_queue(update_queue)
+            .post_init(post_init)
+            .post_stop(post_stop)
+            .post_shutdown(post_shutdown)
+        )
+        if request is not None:
+            builder = builder.request(request).get_updates_request(request)
+        application = builder.build()
+
+        # Counters and cached responses shared with the other worker processes
+        shared = application.bot_data["shared"] = open_shared_state()
+        add_collector("shared", lambda: {f"bot_shared_{name}": value for name, value in shared.stats().items()})
+        # Shared HTTP client for all outbound API calls
+        application.bot_data["http"] = HttpClient()
+        # Response cache for weather and image searches, falling back to the
+        # last good responses while an upstream is failing
+        last_good = application.bot_data["last_good"] = LastGoodStore(application.persistence)
+        cache = application.bot_data["cache"] = ResponseCache(
+            last_good=last_good, shared=shared if shared.cross_process else None
+        )
+        add_collector("cache", lambda: {
+            **{f"bot_cache_{name}": value for name, value in cache.stats().items()},
+            "bot_cache_last_good_entries": last_good.stats()["entries"],
+        })
+        # Per-query image/GIF result pools, paging through search results
+        bot_data = application.bot_data
+        images = application.bot_data["images"] = ImagePool(
+            lambda query, search_type, start, num: search_images(
+                bot_data["http"], bot_data["cache"], query, search_type, start, num
+            )
+        )
+        add_collector("images", lambda: {f"bot_image_{name}": value for name, value in images.stats().items()})
+        # file_ids of media already sent, so Telegram doesn't re-fetch URLs
+        media = application.bot_data["media"] = MediaCache(application.persistence)
+        add_collector("media", lambda: {f"bot_media_{name}": value for name, value in media.stats().items()})
+        # Karma counters, saved through the application's persistence; give limits in the shared state
+        karma = application.bot_data["karma"] = KarmaStore(application.persistence, shared)
+        add_collector("karma", lambda: {f"bot_karma_{name}": value for name, value in karma.stats().items()})
+        # Daily/hourly weather subscriptions, delivered by the job queue
+        async def fetch_report(city, city_id, hours):
+            data = await fetch_forecast(
+                bot_data["http"], bot_data["cache"], city, WEATHER_API_KEY, city_id
+            )
+            return format_forecast(city, data, hours)
+        subscriptions = application.bot_data["weather_subscriptions"] = WeatherSubscriptions(
+            fetch_report, application.persistence
+        )
+        add_collector("weather_subscriptions", lambda: {
+            f"bot_weather_{name}": value for name, value in subscriptions.stats().items()
+        })
+
+        # Chat responses, loaded from pack files
+        packs = application.bot_data["packs"] = ResponsePacks()
+        packs.load()
+        add_collector("packs", lambda: {f"bot_response_{name}": value for name, value in packs.stats().items()})
+
+        # Quotas for /image, /gif, /weather and /alert
+        admission = application.bot_data["admission"] = AdmissionControl(shared)
+        add_collector("admission", lambda: {
+            f"bot_admission_{name}": value for name, value in admission.stats().items()
+        })
 
         # Register all handlers
         register_handlers(application)
 
+        # Vote tallies and live results for finished polls
+        votes = application.bot_data["poll_votes"] = PollVotes(application.persistence)
+        add_collector("poll_votes", lambda: {f"bot_poll_{name}": value for name, value in votes.stats().items()})
+        # Evicts abandoned /poll drafts and conversations
+        sweeper = application.bot_data["poll_sweeper"] = PollSweeper(application)
+        add_collector("polls", lambda: {f"bot_poll_{name}": value for name, value in sweeper.stats().items()})
+
         return application
 
     except Exception as e:
         raise RuntimeError(f"Failed to initialize bot: {str(e)}")
 
+def run_webhook():
+    """Run the bot behind an ASGI server in webhook mode"""
+    import uvicorn
+    from .webhook import register_webhook
+
+    asyncio.run(register_webhook(Bot(TELEGRAM_TOKEN), WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH))
+    uvicorn.run(
+        "bot.webhook:create_app",
+        factory=True,
+        host=WEBHOOK_HOST,
+        port=WEBHOOK_PORT,
+    )
+
 def run_bot():
-    """Run the bot application"""
-    application = create_bot()
+    """Run the bot in the configured mode; the entry point for main.py and python -m bot"""
+    from .logger import setup_logging
 
+    setup_logging()
     try:
-        # Start the bot
-        application.run_polling()
-    except KeyboardInterrupt:
-        # Handle graceful shutdown on Ctrl+C
-        print("Bot is shutting down...")
+        config.validate()
+        logger.info("Starting bot...")
+        if BOT_MODE == "webhook":
+            run_webhook()
+        elif BOT_WORKERS > 1:
+            from .workers import run_sharded
+            run_sharded(BOT_WORKERS)
+        else:
+            create_bot().run_polling()
+        logger.info("Bot stopped gracefully")
+    except Exception as e:
+        logger.critical(f"Fatal error: {str(e)}", exc_info=True)
+        sys.exit(1)
     finally:
-        # Ensure the application stops gracefully
-        if application:
-            application.stop()
-
-if __name__ == "__main__":
-    run_bot()
\ No newline at end of file
+        logger.info("Bot process terminated")
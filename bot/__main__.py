@@ -0,0 +1,5 @@
+"""python -m bot"""
+from bot import run_bot
+
+if __name__ == "__main__":
+    run_bot()
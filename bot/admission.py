@@ -0,0 +1,105 @@
+"""Admission control for commands that call paid or rate-limited upstreams"""
+import logging
+import time
+
+from bot.metrics import ADMISSION_DECISIONS
+from config import (
+    ADMISSION_COSTS,
+    ADMISSION_WINDOW,
+    ADMISSION_USER_LIMIT,
+    ADMISSION_CHAT_LIMIT,
+    ADMISSION_COMMAND_LIMIT,
+    ADMISSION_NOTICE_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionControl:
+    """Per-user, per-chat and per-command quotas for expensive commands.
+
+    Each command has a cost, and a call is admitted only if it fits in the
+    caller's user quota, the chat's quota and the command's global quota over
+    the last ``window`` seconds. It is charged against all three first and the
+    charge is taken back if any is exceeded, so concurrent calls can't all pass
+    on the same reading of the counters.
+    Commands without a cost are never counted. Usage is approximated from two
+    fixed-window counters per key (this window's and the last, weighted by how
+    much of it still overlaps), so a check reads six counters rather than a
+    list of timestamps. The counters live in the shared state backend and
+    expire on their own, so every worker process sees the same quotas. A
+    limit of 0 disables that quota.
+    """
+
+    def __init__(self, state, costs=ADMISSION_COSTS, window=ADMISSION_WINDOW, user_limit=ADMISSION_USER_LIMIT,
+                 chat_limit=ADMISSION_CHAT_LIMIT, command_limit=ADMISSION_COMMAND_LIMIT,
+                 notice_interval=ADMISSION_NOTICE_INTERVAL):
+        self.state = state
+        self.costs = costs
+        self.window = window
+        self.limits = {"user": user_limit, "chat": chat_limit, "command": command_limit}
+        self.notice_interval = notice_interval
+        self._notified = {}  # user_id -> time of the last rejection notice
+        self._decisions = {
+            (command, outcome): ADMISSION_DECISIONS.labels(command, outcome)
+            for command in costs for outcome in ("admitted", "rejected")
+        }
+
+    async def admit(self, command, user_id, chat_id, now=None):
+        """Charge a command call to its quotas; return False if any quota is exhausted."""
+        cost = self.costs.get(command)
+        if not cost:
+            return True
+        # Wall-clock windows, so every process agrees on the bucket
+        now = time.time() if now is None else now
+        bucket, into = divmod(now, self.window)
+        overlap = 1 - into / self.window
+        scopes = [
+            (scope, ident) for scope, ident in (("user", user_id), ("chat", chat_id), ("command", command))
+            if self.limits[scope]
+        ]
+        keys = [f"admission:{scope}:{ident}:{int(bucket)}" for scope, ident in scopes]
+        previous_keys = [f"admission:{scope}:{ident}:{int(bucket) - 1}" for scope, ident in scopes]
+        previous = await self.state.mget(previous_keys)
+        # Each incrby is atomic in the backend, so the totals it returns include every concurrent charge
+        current = [await self.state.incrby(key, cost, ex=2 * self.window) for key in keys]
+
+        for i, (scope, ident) in enumerate(scopes):
+            usage = (previous[i] or 0) * overlap + current[i]
+            if usage > self.limits[scope]:
+                for key in keys:
+                    await self.state.incrby(key, -cost)
+                self._decisions[(command, "rejected")].inc()
+                logger.debug(f"/{command} from user {user_id} in chat {chat_id} rejected: {scope} quota")
+                return False
+        self._decisions[(command, "admitted")].inc()
+        return True
+
+    def should_notify(self, user_id, now=None):
+        """Whether a rejected user should be told; at most once per notice interval."""
+        now = time.monotonic() if now is None else now
+        last = self._notified.get(user_id)
+        if last is not None and now - last < self.notice_interval:
+            return False
+        self._notified[user_id] = now
+        return True
+
+    def compact(self, now=None):
+        """Drop notices that can no longer affect a decision; counters expire in the shared state."""
+        now = time.monotonic() if now is None else now
+        stale = [user_id for user_id, last in self._notified.items() if now - last >= self.notice_interval]
+        for user_id in stale:
+            del self._notified[user_id]
+        return len(stale)
+
+    async def compact_job(self, context):
+        """Job callback for periodic compaction"""
+        self.compact()
+
+    def stats(self):
+        return {"notified_users": len(self._notified)}
+
+
+def get_admission(context):
+    """Return the application's AdmissionControl."""
+    return context.bot_data["admission"]
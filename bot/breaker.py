@@ -0,0 +1,103 @@
+"""Per-upstream circuit breakers, so an outage fails fast instead of piling up requests"""
+import logging
+import time
+from collections import deque
+
+import httpx
+
+from bot.metrics import CIRCUIT_STATE, CIRCUIT_TRANSITIONS, CIRCUIT_REJECTED
+from config import (
+    BREAKER_WINDOW,
+    BREAKER_MIN_CALLS,
+    BREAKER_ERROR_RATE,
+    BREAKER_SLOW_CALL,
+    BREAKER_OPEN_SECONDS,
+    BREAKER_HALF_OPEN_PROBES,
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+# Gauge values for bot_circuit_state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over the outcomes of recent calls.
+
+    The last ``window`` outcomes are kept; a call fails if it raised, got a
+    retryable status, or took longer than ``slow_call`` seconds. Once at
+    least ``min_calls`` are recorded and the failed share reaches
+    ``error_rate``, the breaker opens and every call is rejected for
+    ``open_seconds``. After that up to ``probes`` calls are let through at a
+    time: one success closes the breaker, one failure opens it again.
+    """
+
+    def __init__(self, name, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS, error_rate=BREAKER_ERROR_RATE,
+                 slow_call=BREAKER_SLOW_CALL, open_seconds=BREAKER_OPEN_SECONDS, probes=BREAKER_HALF_OPEN_PROBES):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        self.opened_at = None
+        self._outcomes = deque(maxlen=window)  # True for each failed call
+        self._failures = 0
+        self._probes_in_flight = 0
+        self._gauge = CIRCUIT_STATE.labels(name)
+        self._rejected = CIRCUIT_REJECTED.labels(name)
+        self._gauge.set(STATE_VALUES[CLOSED])
+
+    def _transition(self, state, reason):
+        logger.warning(f"Circuit for {self.name} {self.state} -> {state}: {reason}")
+        self.state = state
+        self._gauge.set(STATE_VALUES[state])
+        CIRCUIT_TRANSITIONS.labels(self.name, state).inc()
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        else:
+            self._outcomes.clear()
+            self._failures = 0
+        self._probes_in_flight = 0
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpenError."""
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                self._rejected.inc()
+                raise CircuitOpenError(f"{self.name} is unavailable")
+            self._transition(HALF_OPEN, f"probing after {self.open_seconds:g}s")
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight >= self.probes:
+                self._rejected.inc()
+                raise CircuitOpenError(f"{self.name} is unavailable")
+            self._probes_in_flight += 1
+
+    def record(self, failed, elapsed=0.0):
+        """Record the outcome of an admitted call; failed=None means it was abandoned without a verdict."""
+        if failed is not None and elapsed > self.slow_call:
+            failed = True
+        if self.state == HALF_OPEN:
+            if failed is None:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            elif failed:
+                self._transition(OPEN, "probe failed")
+            else:
+                self._transition(CLOSED, "probe succeeded")
+            return
+        if self.state == OPEN or failed is None:
+            # Calls admitted before the breaker opened
+            return
+
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._failures -= self._outcomes[0]
+        self._outcomes.append(failed)
+        self._failures += failed
+        if len(self._outcomes) >= self.min_calls and self._failures / len(self._outcomes) >= self.error_rate:
+            self._transition(OPEN, f"{self._failures}/{len(self._outcomes)} recent calls failed or were slow")
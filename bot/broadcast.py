@@ -0,0 +1,62 @@
+"""Fan-out of one message to many chats, run from the job queue"""
+import asyncio
+import logging
+
+from telegram.error import TelegramError
+
+from bot.sender import PRIORITY_BROADCAST
+from config import BROADCAST_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+
+async def broadcast(bot, chat_ids, text, concurrency=BROADCAST_CONCURRENCY):
+    """Send text to every chat with bounded parallelism.
+
+    Uses the application's own bot, so sends share its connection pool and
+    go through the send scheduler in the broadcast lane.
+    :return: A dict of chat_id -> None on success or the error message on failure.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def deliver(chat_id):
+        async with semaphore:
+            try:
+                await bot.send_message(
+                    chat_id=chat_id, text=text, rate_limit_args={"priority": PRIORITY_BROADCAST}
+                )
+                return None
+            except TelegramError as e:
+                return str(e)
+
+    results = await asyncio.gather(*(deliver(chat_id) for chat_id in chat_ids))
+    return dict(zip(chat_ids, results))
+
+
+async def broadcast_job(context):
+    """Job callback: deliver a broadcast and report the outcome to whoever requested it."""
+    job_data = context.job.data
+    results = await broadcast(context.bot, job_data["chat_ids"], job_data["text"])
+
+    failed = {chat_id: error for chat_id, error in results.items() if error}
+    delivered = len(results) - len(failed)
+    logger.info(f"Broadcast delivered to {delivered}/{len(results)} chats")
+    for chat_id, error in failed.items():
+        logger.warning(f"Broadcast to chat {chat_id} failed: {error}")
+
+    report_chat_id = job_data.get("report_chat_id")
+    if report_chat_id is not None:
+        report = f"Alert delivered to {delivered}/{len(results)} chats."
+        if failed:
+            report += "\nFailed:\n" + "\n".join(f"{chat_id}: {error}" for chat_id, error in failed.items())
+        await context.bot.send_message(chat_id=report_chat_id, text=report)
+
+
+def schedule_broadcast(job_queue, chat_ids, text, report_chat_id=None):
+    """Queue a broadcast on the job queue and return immediately."""
+    return job_queue.run_once(
+        broadcast_job,
+        0,
+        data={"chat_ids": list(chat_ids), "text": text, "report_chat_id": report_chat_id},
+        name="broadcast",
+    )
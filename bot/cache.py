@@ -0,0 +1,200 @@
+"""Bounded in-process response cache for upstream API calls"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+import httpx
+
+from config import CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, STALE_MAX_ENTRIES, STALE_MAX_AGE
+
+NAMESPACE = "last_good"
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a user query so equivalent searches share a cache key."""
+    return " ".join(query.lower().split())
+
+
+def key_digest(key) -> str:
+    """Short, stable string for a cache key; keys hold free-text queries."""
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+def estimate_size(value) -> int:
+    """Cheap approximation of a cached value's memory footprint in bytes."""
+    return len(repr(value))
+
+
+class ResponseCache:
+    """TTL + LRU cache with request coalescing.
+
+    Entries expire after the TTL given when they are stored and the least
+    recently used entries are evicted once either the entry count or the
+    approximate byte size goes over its limit. Concurrent misses for the same
+    key share a single upstream call. With a shared state backend, a miss
+    checks it before calling the upstream and stores what it fetched there,
+    so worker processes share responses. With a LastGoodStore, every fetched
+    value is also recorded there, and a fetch that fails with an HTTP error
+    (including an open circuit breaker) is answered from it when it can be.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, last_good=None, shared=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.last_good = last_good
+        self.shared = shared
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._inflight = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.stale = 0
+        self.shared_hits = 0
+
+    def get(self, key, default=None):
+        """Return a fresh cached value, or default if missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, size, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl):
+        """Store a value for ttl seconds, evicting LRU entries as needed."""
+        if key in self._entries:
+            self._remove(key)
+        size = estimate_size(value)
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    async def get_or_fetch(self, key, ttl, fetch):
+        """Return the cached value for key, calling fetch() once on a miss.
+
+        Callers that miss while a fetch for the same key is already running
+        wait for that fetch instead of starting their own. Exceptions raised
+        by fetch are propagated to every waiter and nothing is cached.
+        """
+        marker = object()
+        value = self.get(key, marker)
+        if value is not marker:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(fetch() if self.shared is None else self._fetch_shared(key, ttl, fetch))
+            self._inflight[key] = task
+
+            def _store(done, key=key):
+                self._inflight.pop(key, None)
+                if not done.cancelled() and done.exception() is None:
+                    self.set(key, done.result(), ttl)
+                    if self.last_good is not None:
+                        self.last_good.put(key, done.result())
+
+            task.add_done_callback(_store)
+
+        try:
+            # Shield the shared fetch so one cancelled caller doesn't cancel it for everyone
+            return await asyncio.shield(task)
+        except httpx.HTTPError:
+            value = self.last_good.get(key) if self.last_good is not None else None
+            if value is None:
+                raise
+            self.stale += 1
+            return value
+
+    async def _fetch_shared(self, key, ttl, fetch):
+        shared_key = f"cache:{key_digest(key)}"
+        value = await self.shared.get(shared_key)
+        if value is not None:
+            self.shared_hits += 1
+            return value
+        value = await fetch()
+        await self.shared.set(shared_key, value, ex=ttl)
+        return value
+
+    def stats(self):
+        """Counters used to tune the cache sizes."""
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "stale": self.stale,
+            "shared_hits": self.shared_hits,
+        }
+
+
+class LastGoodStore:
+    """The last successful response per cache key, kept across restarts.
+
+    Only read when an upstream call fails, so a stale answer can be served
+    while the upstream is down (and its breaker is open). Entries are LRU
+    bounded, not served once older than ``max_age`` seconds, and saved
+    through the persistence kv store under a digest of the cache key.
+    """
+
+    def __init__(self, persistence=None, max_entries=STALE_MAX_ENTRIES, max_age=STALE_MAX_AGE):
+        self.persistence = persistence
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = OrderedDict()  # digest -> (stored_at, value)
+
+    async def load(self):
+        """Load saved responses from persistence."""
+        if self.persistence is None:
+            return
+        entries = await self.persistence.load_namespace(NAMESPACE)
+        for digest, entry in sorted(entries.items(), key=lambda item: item[1][0]):
+            self._entries[digest] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Return the last good value for key, or None if there's none recent enough."""
+        entry = self._entries.get(key_digest(key))
+        if entry is None or time.time() - entry[0] > self.max_age:
+            return None
+        return entry[1]
+
+    def put(self, key, value):
+        digest = key_digest(key)
+        entry = self._entries[digest] = (time.time(), value)
+        self._entries.move_to_end(digest)
+        self._save(digest, entry)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._save(evicted, None)
+
+    def _save(self, digest, entry):
+        if self.persistence is not None:
+            self.persistence.stage_kv(NAMESPACE, digest, entry)
+
+    def stats(self):
+        return {"entries": len(self._entries)}
+
+
+def get_cache(context):
+    """Return the application's shared ResponseCache."""
+    return context.bot_data["cache"]
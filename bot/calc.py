@@ -0,0 +1,236 @@
+"""Safe arithmetic evaluator for /calc"""
+import ast
+import asyncio
+import functools
+import math
+import multiprocessing
+import operator
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import (
+    CALC_MAX_LENGTH, CALC_MAX_DIGITS, CALC_MAX_STEPS, CALC_TIMEOUT, CALC_WORKERS, CALC_CACHE_SIZE,
+)
+
+# Largest integer allowed anywhere in an evaluation, in bits
+MAX_BITS = int(CALC_MAX_DIGITS * math.log2(10)) + 1
+MAX_FACTORIAL = 1000
+
+
+class CalcError(ValueError):
+    """An expression that can't or won't be evaluated; the message is shown to the user."""
+
+
+class _Budget:
+    __slots__ = ("steps",)
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def spend(self):
+        self.steps -= 1
+        if self.steps < 0:
+            raise CalcError("That calculation is too long.")
+
+
+def _check(value):
+    if isinstance(value, int):
+        if value.bit_length() > MAX_BITS:
+            raise CalcError("That number is too big.")
+    elif not math.isfinite(value):
+        raise CalcError("That number is too big.")
+    return value
+
+
+def _mul(a, b):
+    if isinstance(a, int) and isinstance(b, int) and a.bit_length() + b.bit_length() > MAX_BITS + 1:
+        raise CalcError("That number is too big.")
+    return a * b
+
+
+def _pow(a, b):
+    if isinstance(a, int) and isinstance(b, int) and b > 0 and abs(a) > 1:
+        # Estimate the size of the result before computing it: 9**9**9 never runs
+        if b * math.log2(abs(a)) > MAX_BITS:
+            raise CalcError("That number is too big.")
+    return a ** b
+
+
+def _factorial(n):
+    if not isinstance(n, int) or n < 0:
+        raise CalcError("factorial() needs a non-negative whole number.")
+    if n > MAX_FACTORIAL:
+        raise CalcError("That number is too big.")
+    return math.factorial(n)
+
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: _mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _pow,
+}
+
+UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+FUNCTIONS = {
+    "abs": abs,
+    "round": round,
+    "min": min,
+    "max": max,
+    "sqrt": math.sqrt,
+    "exp": math.exp,
+    "log": math.log,
+    "log10": math.log10,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "factorial": _factorial,
+}
+
+CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+
+# Things users type that Python spells differently
+REPLACEMENTS = {"^": "**", "×": "*", "÷": "/"}
+
+
+class CompiledExpression:
+    """A validated expression compiled to nested closures."""
+
+    __slots__ = ("evaluate", "heavy")
+
+    def __init__(self, evaluate, heavy):
+        self.evaluate = evaluate
+        # Powers and function calls can be expensive enough to run in the worker pool
+        self.heavy = heavy
+
+
+def _compile(node, flags):
+    """Compile one AST node, rejecting anything outside the whitelist."""
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        value = _check(node.value)
+        return lambda budget: value
+
+    if isinstance(node, ast.Name) and node.id in CONSTANTS:
+        value = CONSTANTS[node.id]
+        return lambda budget: value
+
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        op = BINARY_OPERATORS[type(node.op)]
+        left = _compile(node.left, flags)
+        right = _compile(node.right, flags)
+        if op is _pow:
+            flags.add("heavy")
+
+        def binary(budget):
+            budget.spend()
+            return _check(op(left(budget), right(budget)))
+        return binary
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        op = UNARY_OPERATORS[type(node.op)]
+        operand = _compile(node.operand, flags)
+
+        def unary(budget):
+            budget.spend()
+            return op(operand(budget))
+        return unary
+
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+            and node.func.id in FUNCTIONS and not node.keywords):
+        function = FUNCTIONS[node.func.id]
+        args = [_compile(arg, flags) for arg in node.args]
+        flags.add("heavy")
+
+        def call(budget):
+            budget.spend()
+            return _check(function(*(arg(budget) for arg in args)))
+        return call
+
+    raise CalcError(None)
+
+
+@functools.lru_cache(maxsize=CALC_CACHE_SIZE)
+def compile_expression(text):
+    """Parse and compile an expression; repeated expressions come from the cache."""
+    if len(text) > CALC_MAX_LENGTH:
+        raise CalcError("That expression is too long.")
+    for typed, python in REPLACEMENTS.items():
+        text = text.replace(typed, python)
+    try:
+        tree = ast.parse(text.strip(), mode="eval")
+    except (SyntaxError, ValueError):
+        raise CalcError(None)
+    flags = set()
+    return CompiledExpression(_compile(tree.body, flags), "heavy" in flags)
+
+
+def evaluate(text):
+    """Evaluate an expression synchronously. Raises CalcError on bad or oversized input."""
+    compiled = compile_expression(text)
+    try:
+        return compiled.evaluate(_Budget(CALC_MAX_STEPS))
+    except CalcError:
+        raise
+    except ZeroDivisionError:
+        raise CalcError("Can't divide by zero.")
+    except OverflowError:
+        raise CalcError("That number is too big.")
+    except (TypeError, ValueError):
+        raise CalcError(None)
+
+
+def format_result(value):
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return f"{value:.12g}"
+    return str(value)
+
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn: the bot process has threads (logging, persistence) that fork doesn't copy safely
+        _executor = ProcessPoolExecutor(max_workers=CALC_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+async def calculate(text):
+    """Evaluate an expression without blocking the event loop.
+
+    Cheap arithmetic runs inline; expressions with powers or function calls
+    run in a process pool and are abandoned after CALC_TIMEOUT seconds.
+    :return: The formatted result.
+    """
+    compiled = compile_expression(text)
+    if not compiled.heavy:
+        return format_result(evaluate(text))
+
+    loop = asyncio.get_running_loop()
+    try:
+        value = await asyncio.wait_for(loop.run_in_executor(_get_executor(), evaluate, text), CALC_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise CalcError("That calculation takes too long.")
+    except BrokenProcessPool:
+        # A worker died; start a fresh pool next time
+        shutdown_executor()
+        raise CalcError("That calculation failed, please try again.")
+    return format_result(value)
+
+
+def shutdown_executor():
+    """Stop the worker pool, if it was started."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
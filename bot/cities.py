@@ -0,0 +1,171 @@
+"""Local OpenWeather city-ID index, so /weather resolves names without a round trip"""
+import difflib
+import logging
+import mmap
+import re
+from collections import namedtuple
+
+from bot.cache import normalize_query
+from config import CITY_INDEX_PATH
+
+logger = logging.getLogger(__name__)
+
+City = namedtuple("City", "id name country")
+
+# Spelling variants considered for a name that isn't in the index
+MAX_SUGGESTIONS = 3
+SUGGESTION_CUTOFF = 0.8
+# Other countries named when a city name is ambiguous
+MAX_ALTERNATIVES = 5
+
+# "London, GB" or "London GB": a name and an ISO 3166 country code
+_QUALIFIED = re.compile(r"^(.+?)(?:\s*,\s*|\s+)([A-Za-z]{2})$")
+
+
+def split_country(text):
+    """Split an optional trailing country code off a city: "London, GB" -> ("London", "GB").
+
+    :return: (name, country code or None)
+    """
+    match = _QUALIFIED.match(text.strip())
+    if match is None:
+        return text.strip(), None
+    return match.group(1), match.group(2).upper()
+
+
+def split_cities(text):
+    """Split a comma-separated list of cities, keeping country codes with their city.
+
+    "London, GB, Paris" -> ["London, GB", "Paris"]
+    """
+    cities = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if cities and len(part) == 2 and part.isalpha() and split_country(cities[-1])[1] is None:
+            cities[-1] = f"{cities[-1]}, {part.upper()}"
+        else:
+            cities.append(part)
+    return cities
+
+
+class CityIndex:
+    """Lookups in a sorted, tab-separated city file that is memory-mapped on first use.
+
+    Each line is ``key<TAB>id<TAB>name<TAB>country`` where ``key`` is the
+    normalized name, and lines are sorted by the UTF-8 bytes of the key (see
+    scripts/build_city_index.py). Cities that share a name each have a line,
+    the preferred one first. Exact lookups are a binary search over the
+    mapping, so nothing is parsed up front and the OS pages in only what is
+    touched. Misspellings are matched against names with the same first
+    letter and a similar length.
+    """
+
+    def __init__(self, path=CITY_INDEX_PATH):
+        self.path = path
+        self._file = None
+        self._map = None
+        self._loaded = False
+
+    @property
+    def available(self):
+        self._load()
+        return self._map is not None
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path:
+            return
+        try:
+            self._file = open(self.path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            # ValueError: mmap of an empty file
+            logger.warning(f"City index {self.path} not loaded: {e}")
+            if self._file:
+                self._file.close()
+            self._file = None
+
+    def _seek(self, target):
+        """Offset of the first line whose key is >= target."""
+        data = self._map
+        lo, hi = 0, len(data)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = data.rfind(b"\n", 0, mid) + 1
+            end = data.find(b"\n", start)
+            if end == -1:
+                end = len(data)
+            if data[start:end].split(b"\t", 1)[0] < target:
+                lo = end + 1
+            else:
+                hi = start
+        return lo
+
+    def _lines(self, prefix):
+        """Yield the split lines whose key starts with prefix."""
+        data = self._map
+        offset = self._seek(prefix)
+        while offset < len(data):
+            end = data.find(b"\n", offset)
+            if end == -1:
+                end = len(data)
+            fields = data[offset:end].split(b"\t")
+            if not fields[0].startswith(prefix):
+                return
+            yield fields
+            offset = end + 1
+
+    @staticmethod
+    def _city(fields):
+        return City(int(fields[1]), fields[2].decode(), fields[3].decode() if len(fields) > 3 else "")
+
+    def lookup(self, name, country=None):
+        """Return every City with an exact (normalized) name, preferred first; [] if none.
+
+        :param country: Only return cities in this ISO 3166 country code
+        """
+        if not self.available:
+            return []
+        key = normalize_query(name).encode()
+        cities = []
+        for fields in self._lines(key):
+            if fields[0] != key:
+                break
+            city = self._city(fields)
+            if country is None or city.country == country.upper():
+                cities.append(city)
+        return cities
+
+    def suggest(self, name):
+        """Return up to MAX_SUGGESTIONS close spellings of a name that isn't in the index."""
+        if not self.available:
+            return []
+        key = normalize_query(name)
+        if not key:
+            return []
+        names = {}
+        for fields in self._lines(key[0].encode()):
+            candidate = fields[0].decode()
+            if abs(len(candidate) - len(key)) <= 2:
+                names.setdefault(candidate, fields[2].decode())
+        matches = difflib.get_close_matches(key, names, n=MAX_SUGGESTIONS, cutoff=SUGGESTION_CUTOFF)
+        return [names[match] for match in matches]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self._map = self._file = None
+        self._loaded = False
+
+
+def get_city_index(context):
+    """Return the application's CityIndex, creating it on first use."""
+    index = context.bot_data.get("cities")
+    if index is None:
+        index = context.bot_data["cities"] = CityIndex()
+    return index
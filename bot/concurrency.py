@@ -0,0 +1,203 @@
+"""Concurrent update processing that keeps each chat's updates in order"""
+import asyncio
+import contextlib
+import contextvars
+import logging
+import sys
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from bot import tracing
+from bot.metrics import UPDATES_DROPPED
+from config import UPDATE_CONCURRENCY, UPDATE_MAX_IN_FLIGHT, UPDATE_MAX_PER_CHAT, UPDATE_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# The handler slot held by the update running in this task, if any
+_current_slot = contextvars.ContextVar("update_slot", default=None)
+
+
+def ordering_key(update):
+    """Updates with the same key run one at a time, in arrival order."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        # Poll answers and inline queries have a user but no chat
+        return ("user", update.effective_user.id)
+    return None
+
+
+class _Slot:
+    """One of the processor's handler slots, as held by a running update."""
+
+    __slots__ = ("semaphore", "held")
+
+    def __init__(self, semaphore):
+        self.semaphore = semaphore
+        self.held = False
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        self.held = True
+
+    async def __aexit__(self, *exc_info):
+        if self.held:
+            self.held = False
+            self.semaphore.release()
+
+
+@contextlib.asynccontextmanager
+async def slot_released():
+    """Give the current update's handler slot to another chat while this one waits.
+
+    For waits that don't need a handler slot, like the send rate limit.
+    Outside an update, or if the slot is already given up, this does nothing.
+    """
+    slot = _current_slot.get()
+    if slot is None or not slot.held:
+        yield
+        return
+    slot.held = False
+    slot.semaphore.release()
+    try:
+        yield
+    finally:
+        await slot.semaphore.acquire()
+        slot.held = True
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Run updates from different chats in parallel, updates within a chat in order.
+
+    Each chat gets a FIFO lock that is held for the whole of one update, so
+    a conversation sees its messages in the order Telegram sent them. Only
+    updates that hold their chat's lock compete for the ``concurrency``
+    handler slots, and they hand the slot back while they wait on the send
+    rate limit (see slot_released), so one busy chat can't starve the rest.
+
+    Updates waiting behind their chat's lock don't count as in flight on a
+    BackpressureQueue, and a chat can only have ``max_per_chat`` updates
+    running or waiting: anything past that is dropped.
+    """
+
+    def __init__(self, queue=None, concurrency=UPDATE_CONCURRENCY, max_per_chat=UPDATE_MAX_PER_CHAT):
+        # The base semaphore never blocks: the limits are the handler slots
+        # here, the per-chat cap and the queue's in-flight count
+        super().__init__(max_concurrent_updates=sys.maxsize)
+        self.queue = queue
+        self.concurrency = concurrency
+        self.max_per_chat = max_per_chat
+        self._slots = asyncio.Semaphore(concurrency)
+        # key -> [lock, number of updates holding or waiting, number dropped]
+        self._chat_locks = {}
+
+    @property
+    def waiting_chats(self):
+        """Number of chats with an update running or queued."""
+        return len(self._chat_locks)
+
+    async def do_process_update(self, update, coroutine):
+        key = ordering_key(update)
+        if tracing.active and isinstance(update, Update):
+            # The wait for the chat lock and a slot is part of the trace
+            chat = update.effective_chat
+            coroutine = tracing.trace_update(
+                update.update_id, chat.id if chat else None, time.perf_counter(), coroutine
+            )
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0, 0]
+        elif entry[1] >= self.max_per_chat:
+            coroutine.close()
+            UPDATES_DROPPED.labels().inc()
+            if not entry[2]:
+                logger.warning(f"Chat {key} has {entry[1]} updates waiting, dropping new ones until it catches up")
+            entry[2] += 1
+            return
+        entry[1] += 1
+        try:
+            lock = entry[0]
+            if lock.locked() and isinstance(self.queue, BackpressureQueue):
+                # Waiting on its own chat isn't work in flight, so don't let it hold up other chats
+                self.queue.park()
+                try:
+                    await lock.acquire()
+                finally:
+                    self.queue.unpark()
+            else:
+                await lock.acquire()
+            try:
+                await self._run(coroutine)
+            finally:
+                lock.release()
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[key]
+                if entry[2]:
+                    logger.warning(f"Chat {key} caught up after {entry[2]} updates were dropped")
+
+    async def _run(self, coroutine):
+        slot = _Slot(self._slots)
+        token = _current_slot.set(slot)
+        try:
+            async with slot:
+                await coroutine
+        finally:
+            _current_slot.reset(token)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class BackpressureQueue(asyncio.Queue):
+    """Update queue that stops handing out updates while too many are in flight.
+
+    The application marks each update done with task_done() once it has been
+    processed, so ``in_flight`` counts updates taken but not yet finished.
+    While it is at ``max_in_flight``, get() waits, the queue fills up to its
+    maxsize, and producers feel it: the polling Updater blocks on put() and
+    the webhook answers 503 so Telegram redelivers later.
+    """
+
+    def __init__(self, max_in_flight=UPDATE_MAX_IN_FLIGHT, maxsize=UPDATE_QUEUE_SIZE):
+        super().__init__(maxsize)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._drained = asyncio.Event()
+
+    async def get(self):
+        while self.in_flight >= self.max_in_flight:
+            self._drained.clear()
+            await self._drained.wait()
+        item = await super().get()
+        self.in_flight += 1
+        return item
+
+    def park(self):
+        """Stop counting a taken update as in flight while it waits behind its chat."""
+        self.in_flight -= 1
+        if self.in_flight < self.max_in_flight:
+            self._drained.set()
+
+    def unpark(self):
+        """Count a parked update as in flight again, now it's at the front of its chat."""
+        self.in_flight += 1
+
+    def task_done(self):
+        super().task_done()
+        # Clamp: on shutdown the application drains leftovers with get_nowait()
+        self.in_flight = max(0, self.in_flight - 1)
+        if self.in_flight < self.max_in_flight:
+            self._drained.set()
@@ -1,61 +1,50 @@
-import os
-import requests
+import asyncio
 import logging
-import telegram
-from dotenv import load_dotenv
+import time
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton, Update
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     ConversationHandler,
+    ApplicationHandlerStop,
     CallbackQueryHandler,
+    PollAnswerHandler,
+    TypeHandler,
     filters,
     ContextTypes
 )
-from bot.logger import log_command
-from config import WELCOME_MESSAGE, HELP_MESSAGE, ERROR_MESSAGE
-from bot.messages import get_response_for_text
+from bot.admission import get_admission
+from bot.logger import log_message
+from bot.cache import get_cache, normalize_query
+from bot.karma import get_karma_store
+from bot.metrics import instrument_handlers
+from bot.shared import get_shared_state
+from config import WELCOME_MESSAGE, HELP_MESSAGE, ERROR_MESSAGE, WEATHER_CACHE_TTL, IMAGE_CACHE_TTL
+from config import INVALID_EXPRESSION, WEATHER_USAGE, WEATHER_MAX_CITIES, WEATHER_UNAVAILABLE, WEATHER_STALE_AFTER
+from config import SEARCH_UNAVAILABLE
+from config import GOOGLE_API_KEY, GOOGLE_SEARCH_ENGINE_ID, WEATHER_API_KEY
+from config import ALERT_CHAT_IDS, FRIEND_USERNAME, POLL_TIMEOUT, POLL_TALLY_TTL, ADMISSION_REJECT_MESSAGE
+from bot.messages import get_response_packs
 
-# Load environment variables
-load_dotenv()
-
-# Environment variables
-TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-GOOGLE_SEARCH_ENGINE_ID = os.getenv("GOOGLE_SEARCH_ENGINE_ID", "f67799191a4754602")
-GROUP_CHAT_ID = os.getenv("GROUP_CHAT_ID")
-FRIEND_USERNAME = os.getenv("FRIEND_USERNAME")
-
-if not GOOGLE_API_KEY or not GOOGLE_SEARCH_ENGINE_ID:
-    raise ValueError("Google API key or Search Engine ID is missing.")
-
-# Logging setup
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def send_telegram_message():
-    try:
-        # Create the message with the friend's username
-        message = f"@{FRIEND_USERNAME}, Leon is playing on your account!"
-
-        # Initialize the bot
-        bot = telegram.Bot(token=TELEGRAM_TOKEN)
+# HTTP, image search, media, broadcasts, polls and subscriptions are imported
+# by the handlers that use them, so importing this module stays cheap
 
-        # Send the message to the group
-        bot.send_message(chat_id=GROUP_CHAT_ID, text=message)
-        logger.info("Message sent successfully!")
-    except telegram.error.TelegramError as e:
-        logger.error(f"Failed to send message: {e}")
-    except Exception as e:
-        logger.error(f"An unexpected error occurred: {e}")
 # Utility function to search for images/GIFs using Google Custom Search API
-def search_images(query, search_type="image"):
+async def search_images(http, cache, query, search_type="image", start=1, num=5):
     """
     Search for images or GIFs using the Google Custom Search API.
+    :param http: The shared HttpClient
+    :param cache: The shared ResponseCache
     :param query: The search query (e.g., "cat")
     :param search_type: The type of search ("image" or "gif")
-    :return: A list of image URLs or an empty list if no results are found.
+    :param start: Index of the first result, for paging (1-based)
+    :param num: Number of results to return (at most 10)
+    :return: A list of image URLs, empty if there are no results.
+    :raises httpx.HTTPError: If the search failed, so callers don't mistake it for no results.
     """
     url = "https://www.googleapis.com/customsearch/v1"
     params = {
@@ -63,23 +52,190 @@ def search_images(query, search_type="image"):
         "cx": GOOGLE_SEARCH_ENGINE_ID,
         "q": query,
         "searchType": search_type,
-        "num": 5,  # Number of results to return
+        "num": num,
+        "start": start,
     }
 
+    async def fetch():
+        data = await http.get_json(url, params=params)
+        # Extract image URLs from the response
+        return [item["link"] for item in data.get("items", []) if "link" in item]
+
+    key = ("google", normalize_query(query), search_type, start, num)
+    return await cache.get_or_fetch(key, IMAGE_CACHE_TTL, fetch)
+
+# Utility function to fetch current weather from the OpenWeatherMap API
+async def fetch_weather(http, cache, city, api_key, city_id=None):
+    """
+    Fetch the current weather for a city.
+    :param http: The shared HttpClient
+    :param cache: The shared ResponseCache
+    :param city: The city name (e.g., "London")
+    :param api_key: The OpenWeatherMap API key
+    :param city_id: OpenWeatherMap city ID; looked up instead of the name when given
+    :return: The decoded JSON response.
+    """
+    url = "http://api.openweathermap.org/data/2.5/weather"
+    if city_id is not None:
+        params = {"id": city_id, "appid": api_key, "units": "metric"}
+        key = ("weather", city_id)
+    else:
+        params = {"q": city, "appid": api_key, "units": "metric"}
+        key = ("weather", normalize_query(city))
+    return await cache.get_or_fetch(key, WEATHER_CACHE_TTL, lambda: http.get_json(url, params=params))
+
+# Utility function to fetch the 3-hourly forecast from the OpenWeatherMap API
+async def fetch_forecast(http, cache, city, api_key, city_id=None):
+    """
+    Fetch the 5 day / 3 hour forecast for a city.
+    :param http: The shared HttpClient
+    :param cache: The shared ResponseCache
+    :param city: The city name (e.g., "London")
+    :param api_key: The OpenWeatherMap API key
+    :param city_id: OpenWeatherMap city ID; looked up instead of the name when given
+    :return: The decoded JSON response.
+    """
+    url = "http://api.openweathermap.org/data/2.5/forecast"
+    if city_id is not None:
+        params = {"id": city_id, "appid": api_key, "units": "metric"}
+        key = ("forecast", city_id)
+    else:
+        params = {"q": city, "appid": api_key, "units": "metric"}
+        key = ("forecast", normalize_query(city))
+    return await cache.get_or_fetch(key, WEATHER_CACHE_TTL, lambda: http.get_json(url, params=params))
+
+def format_forecast(city, data, hours=24):
+    """Format an OpenWeatherMap forecast response: one line per 3-hour step over the next hours"""
+    lines = [f"Forecast for {city}:"]
+    for step in data.get("list", [])[:max(1, hours // 3)]:
+        when = time.strftime("%a %H:%M UTC", time.gmtime(step["dt"]))
+        lines.append(f"{when}: {step['main']['temp']}°C, {step['weather'][0]['description']}")
+    return "\n".join(lines)
+
+def format_weather(city, data):
+    """Format an OpenWeatherMap response for one city"""
+    text = (
+        f"Weather in {city}:\n"
+        f"Temperature: {data['main']['temp']}°C\n"
+        f"Condition: {data['weather'][0]['description'].capitalize()}\n"
+        f"Humidity: {data['main']['humidity']}%\n"
+        f"Wind Speed: {data['wind']['speed']} m/s"
+    )
+    # Say when the observation is old, e.g. served from the last good response during an outage
+    observed = data.get("dt")
+    if observed and time.time() - observed > WEATHER_STALE_AFTER:
+        text += f"\n(Last updated {time.strftime('%H:%M UTC', time.gmtime(observed))})"
+    return text
+
+async def resolve_city(context, city):
+    """Resolve a city name, optionally with a country code ("London, GB"), through the local index.
+    :return: (display name, city ID or None, error text or None,
+        note naming other countries with a city of that name, or None)
+    """
+    # Imported on first use so startup doesn't pay for it
+    from bot.cities import MAX_ALTERNATIVES, get_city_index, split_country
+
+    name, country = split_country(city)
+    index = get_city_index(context)
+    if not index.available:
+        # OpenWeather understands the same qualifier as "London,GB"
+        return (f"{name},{country}" if country else city), None, None, None
+    matches = index.lookup(name, country) if country else index.lookup(city)
+    if not matches and country:
+        # A name that just ends in a two-letter word
+        matches = index.lookup(city)
+    if not matches:
+        if country and index.lookup(name):
+            return city, None, f"I don't know a city called {name} in {country}.", None
+        # Unknown names are answered locally instead of costing a 404 from the API
+        suggestions = await asyncio.to_thread(index.suggest, name)
+        hint = f" Did you mean {', '.join(suggestions)}?" if suggestions else ""
+        return city, None, f"I don't know a city called {city}.{hint}", None
+
+    match = matches[0]
+    note = None
+    if country is None:
+        others = list(dict.fromkeys(
+            other.country for other in matches[1:] if other.country and other.country != match.country
+        ))
+        if others:
+            note = (f"There's also a {match.name} in {', '.join(others[:MAX_ALTERNATIVES])}; "
+                    f"add the country code to pick one, e.g. {match.name}, {others[0]}")
+    return (f"{match.name}, {match.country}" if match.country else match.name), match.id, None, note
+
+async def weather_report(context, city, api_key):
+    """Return the weather report text for one city"""
+    import httpx
+    from bot.http_client import get_http_client
+
+    city, city_id, error, note = await resolve_city(context, city)
+    if error:
+        return error
+
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
+        data = await fetch_weather(get_http_client(context), get_cache(context), city, api_key, city_id)
+        report = format_weather(city, data)
+        return f"{report}\n{note}" if note else report
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            return f"I don't know a city called {city}."
+        logger.error(f"Weather request for {city} failed: {e}")
+        return WEATHER_UNAVAILABLE.format(city=city)
+    except httpx.HTTPError as e:
+        # Includes CircuitOpenError while OpenWeather is marked down
+        logger.error(f"Weather request for {city} failed: {e!r}")
+        return WEATHER_UNAVAILABLE.format(city=city)
+    except Exception as e:
+        logger.error(f"Error fetching weather data for {city}: {e}")
+        return WEATHER_UNAVAILABLE.format(city=city)
+
+async def weather_subscription_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /weather subscribe <city> <HH:MM|hourly>, /weather unsubscribe <city> and /weather subscriptions"""
+    from bot.subscriptions import HOURLY, get_weather_subscriptions, parse_slot
+
+    action, args = context.args[0].lower(), context.args[1:]
+    subscriptions = get_weather_subscriptions(context)
+    chat_id = update.effective_chat.id
+
+    if action == "subscriptions":
+        current = subscriptions.for_chat(chat_id)
+        if not current:
+            await update.message.reply_text("No weather subscriptions in this chat.")
+            return
+        lines = [f"{city}: {'every hour' if slot == HOURLY else f'daily at {slot} UTC'}" for slot, city in current]
+        await update.message.reply_text("Weather subscriptions:\n" + "\n".join(lines))
+        return
 
-        # Extract image URLs from the response
-        image_urls = [item["link"] for item in data.get("items", []) if "link" in item]
-        return image_urls
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching images: {e}")
-        return []
+    if action == "unsubscribe":
+        if not args:
+            await update.message.reply_text("Usage: /weather unsubscribe <city>")
+            return
+        city, city_id, error, _ = await resolve_city(context, " ".join(args))
+        if error:
+            await update.message.reply_text(error)
+            return
+        removed = subscriptions.unsubscribe(chat_id, city, city_id)
+        await update.message.reply_text(
+            f"Unsubscribed from {city}." if removed else f"This chat isn't subscribed to {city}."
+        )
+        return
+
+    slot = parse_slot(args[-1]) if len(args) >= 2 else None
+    if slot is None:
+        await update.message.reply_text("Usage: /weather subscribe <city> <HH:MM (UTC)|hourly>")
+        return
+    city, city_id, error, note = await resolve_city(context, " ".join(args[:-1]))
+    if error:
+        await update.message.reply_text(error)
+        return
+    if not subscriptions.subscribe(chat_id, slot, city, city_id):
+        await update.message.reply_text(f"This chat already has {subscriptions.max_per_chat} weather subscriptions.")
+        return
+    when = "every hour" if slot == HOURLY else f"every day at {slot} UTC"
+    reply = f"Subscribed to the forecast for {city} {when}."
+    await update.message.reply_text(f"{reply}\n{note}" if note else reply)
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    log_command(update, "start")
     """Handle the /start command"""
     await update.message.reply_text(WELCOME_MESSAGE)
 
@@ -91,176 +247,258 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /cancel command"""
     await update.message.reply_text("Operation cancelled.")
 
-async def weather_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle the /weather command"""
+async def calc_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /calc command"""
+    # Imported on first use so startup doesn't pay for the worker pool machinery
+    from bot.calc import CalcError, calculate
+
     if not context.args:
-        await update.message.reply_text("Please provide a city name (e.g., /weather London)")
+        await update.message.reply_text(INVALID_EXPRESSION)
         return
 
-    city = " ".join(context.args)
-    weather_api_key = os.getenv("OPENWEATHER_API_KEY")
-    if not weather_api_key:
-        await update.message.reply_text("Weather API key is not set.")
+    try:
+        result = await calculate(" ".join(context.args))
+    except CalcError as e:
+        await update.message.reply_text(str(e) if e.args[0] else INVALID_EXPRESSION)
         return
 
-    # Build the URL for the OpenWeatherMap API.
-    url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={weather_api_key}&units=metric"
+    await update.message.reply_text(f"= {result}")
 
-    try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an error for bad responses.
-        data = response.json()
-
-        # Extract useful data
-        temp = data["main"]["temp"]
-        description = data["weather"][0]["description"]
-        humidity = data["main"]["humidity"]
-        wind_speed = data["wind"]["speed"]
-
-        # Format the reply message.
-        reply_text = (
-            f"Weather in {city}:\n"
-            f"Temperature: {temp}°C\n"
-            f"Condition: {description.capitalize()}\n"
-            f"Humidity: {humidity}%\n"
-            f"Wind Speed: {wind_speed} m/s"
-        )
-    except requests.exceptions.HTTPError as http_err:
-        reply_text = f"HTTP error occurred: {http_err}"
-    except Exception as e:
-        reply_text = f"Error fetching weather data: {e}"
+async def weather_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /weather command, e.g. /weather London, GB, Paris, Tokyo"""
+    from bot.cities import split_cities
 
-    await update.message.reply_text(reply_text)
+    if context.args and context.args[0].lower() in ("subscribe", "unsubscribe", "subscriptions"):
+        await weather_subscription_command(update, context)
+        return
+
+    cities = []
+    for city in split_cities(" ".join(context.args or [])):
+        if normalize_query(city) not in map(normalize_query, cities):
+            cities.append(city)
+    if not cities:
+        await update.message.reply_text(WEATHER_USAGE)
+        return
+
+    if not WEATHER_API_KEY:
+        await update.message.reply_text("Weather API key is not set.")
+        return
+
+    if len(cities) > WEATHER_MAX_CITIES:
+        await update.message.reply_text(f"Please ask for at most {WEATHER_MAX_CITIES} cities at a time.")
+        return
+
+    # Look all the cities up at once and answer in one message
+    reports = await asyncio.gather(*(weather_report(context, city, WEATHER_API_KEY) for city in cities))
+    await update.message.reply_text("\n\n".join(reports))
 
 async def image_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /image command"""
+    import httpx
+    from bot.imagepool import get_image_pool
+    from bot.media import get_media_cache, reply_media
+
     if not context.args:
         await update.message.reply_text("Please provide a search term (e.g., /image cat)")
         return
 
     query = " ".join(context.args)
-    image_urls = search_images(query, search_type="image")
-
-    if not image_urls:
-        await update.message.reply_text("No images found. Try another search term.")
+    # Send the next result for this query, reusing Telegram's file_id when we have one
+    try:
+        sent = await reply_media(update.message, get_media_cache(context), get_image_pool(context), query, "image")
+    except httpx.HTTPError:
+        await update.message.reply_text(SEARCH_UNAVAILABLE)
         return
 
-    # Send the first image
-    await update.message.reply_photo(image_urls[0])
+    if not sent:
+        await update.message.reply_text("No images found. Try another search term.")
 
 async def gif_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /gif command"""
+    import httpx
+    from bot.imagepool import get_image_pool
+    from bot.media import get_media_cache, reply_media
+
     if not context.args:
         await update.message.reply_text("Please provide a search term (e.g., /gif cat)")
         return
 
     query = " ".join(context.args)
-    image_urls = search_images(query, search_type="gif")
-
-    if not image_urls:
-        await update.message.reply_text("No GIFs found. Try another search term.")
+    # Send the next result for this query, reusing Telegram's file_id when we have one
+    try:
+        sent = await reply_media(update.message, get_media_cache(context), get_image_pool(context), query, "gif")
+    except httpx.HTTPError:
+        await update.message.reply_text(SEARCH_UNAVAILABLE)
         return
 
-    # Send the first GIF
-    await update.message.reply_animation(image_urls[0])
+    if not sent:
+        await update.message.reply_text("No GIFs found. Try another search term.")
 
 
 POLL_QUESTION, POLL_OPTIONS, ADD_OPTION = range(3)
 
+# Buttons shown while a poll is being built
+POLL_BUILDER_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Add Option", callback_data="add_option")],
+    [InlineKeyboardButton("Finish Poll", callback_data="finish_poll")]
+])
+
+def describe_draft(poll):
+    """Summary of a poll draft for the builder message"""
+    text = f"Poll Question: {poll.question}"
+    if poll.options:
+        text += "\nOptions:\n" + "\n".join(f"{i+1}. {opt}" for i, opt in enumerate(poll.options))
+    return text
+
+async def show_draft(update: Update, context: ContextTypes.DEFAULT_TYPE, poll, text, reply_markup=None):
+    """Edit the poll's builder message in place, or post a new one if it can't be edited."""
+    chat_id = update.effective_chat.id
+    if poll.message_id is not None:
+        try:
+            await context.bot.edit_message_text(
+                chat_id=chat_id, message_id=poll.message_id, text=text, reply_markup=reply_markup
+            )
+            return
+        except BadRequest as e:
+            if "not modified" in str(e):
+                return
+            logger.warning(f"Couldn't edit poll builder message in chat {chat_id}: {e}")
+    message = await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+    poll.message_id = message.message_id
+
 async def poll_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start poll creation conversation."""
-    # Initialize poll data in user_data
-    context.user_data['poll'] = {"question": None, "options": []}
-    await update.message.reply_text("Please send the poll question:")
+    from bot.polls import DRAFT_KEY, PollDraft
+
+    poll = context.user_data[DRAFT_KEY] = PollDraft()
+    message = await update.message.reply_text("Please send the poll question:")
+    poll.message_id = message.message_id
     return POLL_QUESTION
 
 async def poll_question_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the poll question input."""
-    poll = context.user_data.get('poll', {})
-    poll['question'] = update.message.text
-    context.user_data['poll'] = poll
+    from bot.polls import DRAFT_KEY, PollDraft, get_draft
 
-    # Show inline keyboard to add options or finish poll
-    keyboard = [
-        [InlineKeyboardButton("Add Option", callback_data="add_option")],
-        [InlineKeyboardButton("Finish Poll", callback_data="finish_poll")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(
-        f"Poll Question: {poll['question']}\n"
+    poll = get_draft(context.user_data) or PollDraft()
+    poll.set_question(update.message.text)
+    context.user_data[DRAFT_KEY] = poll
+
+    await show_draft(
+        update, context, poll,
+        f"{describe_draft(poll)}\n"
         "Now, click 'Add Option' to add an option, or 'Finish Poll' if you're done.",
-        reply_markup=reply_markup
+        POLL_BUILDER_KEYBOARD,
     )
     return POLL_OPTIONS
 
 async def poll_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle inline keyboard callbacks for poll creation."""
+    from bot.polls import DRAFT_KEY, get_draft, get_poll_votes, poll_chat_key
+
     query = update.callback_query
-    await query.answer()  # Acknowledge the callback
     data = query.data
+    poll = get_draft(context.user_data)
+    if poll is None:
+        await query.answer("This poll draft has expired. Send /poll to start again.")
+        return ConversationHandler.END
 
     if data == "add_option":
+        await query.answer()
         # Prompt user to send a new option as text
-        await query.message.reply_text("Please send the new poll option:")
+        await show_draft(update, context, poll, f"{describe_draft(poll)}\n\nPlease send the new poll option:")
         return ADD_OPTION
 
     elif data == "finish_poll":
-        # Finalize poll creation and show the poll summary
-        poll = context.user_data.get('poll', {})
-        question = poll.get('question', 'No question')
-        options = poll.get('options', [])
-        if not options:
-            await query.message.reply_text("You need to add at least one option.")
+        # Telegram polls need at least two options
+        if len(poll.options) < 2:
+            await query.answer("You need to add at least two options.", show_alert=True)
             return POLL_OPTIONS
-        options_list = "\n".join(f"{i+1}. {opt}" for i, opt in enumerate(options))
-        await query.message.reply_text(
-            f"Poll created!\nQuestion: {question}\nOptions:\n{options_list}"
+        await query.answer()
+
+        chat_id = update.effective_chat.id
+        sent = await context.bot.send_poll(
+            chat_id=chat_id, question=poll.question or "Poll", options=poll.options, is_anonymous=False
         )
+        # The builder message becomes the live results, with buttons as a second way to vote.
+        # show_draft may post a new message instead, so tally the one it actually left.
+        votes = get_poll_votes(context)
+        question = poll.question or "Poll"
+        text, keyboard = votes.initial_results(question, poll.options)
+        await show_draft(update, context, poll, text, keyboard)
+        votes.start(chat_id, poll.message_id, question, poll.options, sent.poll.id)
+        # Lets a sharded poller route answers to the worker that holds the tally
+        await get_shared_state(context).set(poll_chat_key(sent.poll.id), chat_id, ex=POLL_TALLY_TTL)
+        context.user_data.pop(DRAFT_KEY, None)
         return ConversationHandler.END
 
 async def add_option_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Receive new poll option and update the poll summary."""
-    new_option = update.message.text
-    poll = context.user_data.get('poll', {})
-    poll.setdefault('options', []).append(new_option)
-    context.user_data['poll'] = poll
+    from bot.polls import DRAFT_KEY, MAX_OPTIONS, PollDraft, get_draft
 
-    # Build a summary of the poll
-    options_list = "\n".join(f"{i+1}. {opt}" for i, opt in enumerate(poll['options']))
-    keyboard = [
-        [InlineKeyboardButton("Add Option", callback_data="add_option")],
-        [InlineKeyboardButton("Finish Poll", callback_data="finish_poll")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(
-        f"Poll Question: {poll.get('question')}\n"
-        f"Options:\n{options_list}\n\n"
-        "Click 'Add Option' to add more or 'Finish Poll' to complete.",
-        reply_markup=reply_markup
-    )
+    poll = get_draft(context.user_data) or PollDraft()
+    context.user_data[DRAFT_KEY] = poll
+    prompt = "Click 'Add Option' to add more or 'Finish Poll' to complete."
+    if not poll.add_option(update.message.text):
+        prompt = f"A poll can have at most {MAX_OPTIONS} options. Click 'Finish Poll' to complete."
+
+    await show_draft(update, context, poll, f"{describe_draft(poll)}\n\n{prompt}", POLL_BUILDER_KEYBOARD)
     return POLL_OPTIONS
 
 async def cancel_poll(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel the poll creation process."""
+    from bot.polls import DRAFT_KEY
+
+    context.user_data.pop(DRAFT_KEY, None)
     await update.message.reply_text("Poll creation cancelled.")
     return ConversationHandler.END
 
+async def poll_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop the draft of a /poll conversation that went quiet."""
+    from bot.polls import DRAFT_KEY
+
+    context.user_data.pop(DRAFT_KEY, None)
+    if update.effective_message:
+        await update.effective_message.reply_text("Poll creation timed out. Send /poll to start again.")
+
 def get_poll_conversation_handler():
     """Return the ConversationHandler for poll creation."""
     return ConversationHandler(
+        name="poll",
+        persistent=True,
         entry_points=[CommandHandler("poll", poll_command)],
         states={
             POLL_QUESTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, poll_question_handler)],
-            POLL_OPTIONS: [CallbackQueryHandler(poll_callback_handler)],
-            ADD_OPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_option_handler)]
+            POLL_OPTIONS: [CallbackQueryHandler(poll_callback_handler, pattern="^(add_option|finish_poll)$")],
+            ADD_OPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_option_handler)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, poll_timeout)],
         },
-        fallbacks=[CommandHandler("cancel", cancel_poll)]
+        fallbacks=[CommandHandler("cancel", cancel_poll)],
+        conversation_timeout=POLL_TIMEOUT,
     )
 
 async def handle_vote(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle vote callbacks"""
+    """Handle vote button presses on a poll's live results message"""
+    from bot.polls import get_poll_votes
+
     query = update.callback_query
-    await query.answer("Vote registered!")
+    votes = get_poll_votes(context)
+    key = (query.message.chat.id, query.message.message_id)
+    option = int(query.data.removeprefix("vote_"))
+
+    # Pressing the option you already chose takes the vote back
+    choice = () if votes.current_vote(key, query.from_user.id) == (option,) else (option,)
+    if not votes.vote(key, query.from_user.id, choice):
+        await query.answer("This poll is closed.")
+        return
+    await query.answer("Vote registered!" if choice else "Vote removed.")
+
+async def handle_poll_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Count an answer to one of the bot's native polls"""
+    from bot.polls import get_poll_votes
+
+    answer = update.poll_answer
+    voter = answer.user or answer.voter_chat
+    get_poll_votes(context).vote_native(answer.poll_id, voter.id, answer.option_ids)
 
 async def handle_preference_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle callbacks from the preferences menu."""
@@ -296,8 +534,9 @@ async def preferences_command(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle general messages using our response system"""
+    log_message(update)
     text = update.message.text
-    response = get_response_for_text(text)
+    response = get_response_packs(context).respond(text, update.effective_chat.id)
     await update.message.reply_text(response)
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -309,22 +548,95 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         pass
 async def alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    send_telegram_message()  # Call the function
-    await update.message.reply_text("Alert sent!")
+    """Handle the /alert command: broadcast the alert in the background"""
+    from bot.broadcast import schedule_broadcast
+
+    if not ALERT_CHAT_IDS:
+        await update.message.reply_text("No alert chats are configured.")
+        return
+
+    message = f"@{FRIEND_USERNAME}, Leon is playing on your account!"
+    schedule_broadcast(context.job_queue, ALERT_CHAT_IDS, message, report_chat_id=update.effective_chat.id)
+    await update.message.reply_text("Alert queued!")
+
+async def karma_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /karma command: show the user's karma and the chat leaderboard"""
+    store = get_karma_store(context)
+    chat_id = update.effective_chat.id
+    user = update.effective_user
+
+    lines = [f"Your karma: {store.get(chat_id, user.id)}"]
+    top = store.top(chat_id)
+    if top:
+        lines.append("\nTop karma:")
+        lines.extend(
+            f"{i+1}. {name or user_id} - {score}" for i, (user_id, name, score) in enumerate(top)
+        )
+    await update.message.reply_text("\n".join(lines))
+
+async def give_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /give command: give karma to the author of the replied-to message"""
+    reply = update.message.reply_to_message
+    if not reply or not reply.from_user:
+        await update.message.reply_text("Reply to someone's message with /give to give them karma.")
+        return
 
+    giver = update.effective_user
+    receiver = reply.from_user
+    if receiver.id == giver.id or receiver.is_bot:
+        await update.message.reply_text("Nice try.")
+        return
+
+    store = get_karma_store(context)
+    if not await store.allow_give(giver.id):
+        await update.message.reply_text("Slow down, you're giving karma too fast.")
+        return
 
+    name = receiver.username or receiver.first_name
+    score = store.add(update.effective_chat.id, receiver.id, name=name)
+    await update.message.reply_text(f"{name} now has {score} karma.")
+
+
+
+async def admission_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stop an expensive command before its handler runs if the caller is over quota"""
+    message = update.effective_message
+    command, _, target = message.text.split(maxsplit=1)[0][1:].partition("@")
+    if target and target.lower() != (context.bot.username or "").lower():
+        # Addressed to another bot in the group; our handlers ignore it too
+        return
+    command = command.lower()
+    admission = get_admission(context)
+    if update.edited_message:
+        # Editing a command isn't a new request: expensive ones are neither charged nor run again
+        if admission.costs.get(command):
+            raise ApplicationHandlerStop
+        return
+    user = update.effective_user
+    if await admission.admit(command, user.id if user else 0, update.effective_chat.id):
+        return
+    # One canned reply per user per notice interval; further rejections are dropped silently
+    if user and admission.should_notify(user.id):
+        await message.reply_text(ADMISSION_REJECT_MESSAGE)
+    raise ApplicationHandlerStop
 
 def register_handlers(application):
     """Register all handlers with the application"""
+    # Quotas for expensive commands, checked before any other handler
+    application.add_handler(MessageHandler(filters.COMMAND, admission_check), group=-1)
+
     # Command handlers
     application.add_handler(CommandHandler("start", start_command))  # Handles the /start command
     application.add_handler(CommandHandler("help", help_command))  # Handles the /help command
     application.add_handler(CommandHandler("cancel", cancel_command))  # Handles the /cancel command
     application.add_handler(CommandHandler("preferences", preferences_command))  # Handles the /preferences command
+    application.add_handler(CommandHandler("calc", calc_command))  # Handles the /calc command
     application.add_handler(CommandHandler("weather", weather_command))  # Handles the /weather command
     application.add_handler(CommandHandler("gif", gif_command))  # Handles the /gif command
     application.add_handler(CommandHandler("image", image_command))  # Handles the /image command
     application.add_handler(CommandHandler("alert", alert_command))
+    application.add_handler(CommandHandler("karma", karma_command))  # Handles the /karma command
+    application.add_handler(CommandHandler("give", give_command))  # Handles the /give command
     # Add the poll conversation handler for a more interactive poll creation process
     application.add_handler(get_poll_conversation_handler())
 
@@ -332,8 +644,12 @@ def register_handlers(application):
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
     # Callback query handlers
-    application.add_handler(CallbackQueryHandler(handle_vote, pattern="^vote_"))  # Handles vote callbacks
+    application.add_handler(CallbackQueryHandler(handle_vote, pattern="^vote_[0-9]+$"))  # Handles vote callbacks
+    application.add_handler(PollAnswerHandler(handle_poll_answer))  # Handles answers to native polls
     application.add_handler(CallbackQueryHandler(handle_preference_callback, pattern="^pref_"))  # Handles preference callbacks
 
     # Error handler
     application.add_error_handler(error_handler)  # Handles errors
+
+    # Latency, in-flight and error metrics for every handler above
+    instrument_handlers(application)
@@ -0,0 +1,163 @@
+"""Shared async HTTP client for all outbound API calls"""
+import asyncio
+import logging
+import random
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+from bot import tracing
+from bot.breaker import CircuitBreaker
+from bot.metrics import UPSTREAM_LATENCY, UPSTREAM_ERRORS
+from config import HTTP_TIMEOUT, HTTP_MAX_RETRIES, HTTP_PER_HOST_LIMIT, HTTP_BACKOFF, HTTP_MAX_RETRY_AFTER
+
+logger = logging.getLogger(__name__)
+
+# Metric labels for known upstreams; anything else is labelled by host
+UPSTREAM_NAMES = {
+    "www.googleapis.com": "google",
+    "api.openweathermap.org": "openweather",
+}
+
+# Status codes worth retrying; everything else is returned or raised right away
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpClient:
+    """Keep one pooled keep-alive session per upstream host.
+
+    Every request to a host goes through that host's session and a semaphore
+    that caps how many requests may be in flight to it at once. Connection
+    errors and retryable status codes are retried with exponential backoff,
+    or after the server's Retry-After; a Retry-After longer than
+    ``max_retry_after`` fails the request at once rather than holding the
+    caller for that long.
+    Each upstream also has a CircuitBreaker: while it is open, requests and
+    retries fail at once with CircuitOpenError instead of queueing on the
+    semaphore behind an outage.
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT, max_retries=HTTP_MAX_RETRIES,
+                 per_host_limit=HTTP_PER_HOST_LIMIT, backoff=HTTP_BACKOFF, max_retry_after=HTTP_MAX_RETRY_AFTER,
+                 transport=None):
+        """
+        :param transport: Optional httpx transport for every session, e.g. an
+            httpx.MockTransport that stands in for the upstream APIs in benchmarks
+        """
+        self.transport = transport
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.per_host_limit = per_host_limit
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self._sessions = {}
+        self._semaphores = {}
+        self._breakers = {}
+
+    def _session_for(self, host):
+        """Return the (session, semaphore) pair for a host, creating it on first use."""
+        session = self._sessions.get(host)
+        if session is None:
+            session = httpx.AsyncClient(
+                transport=self.transport,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.per_host_limit,
+                    max_keepalive_connections=self.per_host_limit,
+                ),
+            )
+            self._sessions[host] = session
+            self._semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return session, self._semaphores[host]
+
+    def breaker_for(self, upstream):
+        """Return the CircuitBreaker for an upstream, creating it on first use."""
+        breaker = self._breakers.get(upstream)
+        if breaker is None:
+            breaker = self._breakers[upstream] = CircuitBreaker(upstream)
+        return breaker
+
+    def _retry_delay(self, attempt, response=None):
+        """Backoff for the given attempt, honouring Retry-After when the server sends it.
+
+        Returns None when Retry-After is longer than max_retry_after.
+        """
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                retry_after = float(retry_after)
+                return retry_after if retry_after <= self.max_retry_after else None
+        return self.backoff * (2 ** attempt) * (1 + random.random())
+
+    async def request(self, method, url, **kwargs):
+        """Send a request, retrying transient failures.
+
+        Raises httpx.HTTPError on failure, including CircuitOpenError when the
+        upstream's breaker is open.
+        """
+        host = urlsplit(url).netloc
+        session, semaphore = self._session_for(host)
+        upstream = UPSTREAM_NAMES.get(host, host)
+        latency = UPSTREAM_LATENCY.labels(upstream)
+        errors = UPSTREAM_ERRORS.labels(upstream)
+        breaker = self.breaker_for(upstream)
+
+        attempt = 0
+        while True:
+            response = None
+            breaker.before_call()
+            try:
+                response, elapsed = await self._send(session, semaphore, latency, method, url, kwargs)
+            except httpx.TransportError as e:
+                breaker.record(True)
+                errors.inc()
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"Request to {host} failed ({e!r}), retrying")
+            except BaseException:
+                # Cancelled: no verdict on the upstream, but free a half-open probe slot
+                breaker.record(None)
+                raise
+            else:
+                breaker.record(response.status_code in RETRY_STATUSES, elapsed)
+                if response.is_error:
+                    errors.inc()
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    return response
+
+            delay = self._retry_delay(attempt, response)
+            if delay is None:
+                logger.warning(f"{host} asked to retry after {response.headers['Retry-After']}s, giving up")
+                response.raise_for_status()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _send(session, semaphore, latency, method, url, kwargs):
+        """One attempt; returns the response and its duration in seconds."""
+        with tracing.span("http", urlsplit(url).netloc):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    return await session.request(method, url, **kwargs), time.perf_counter() - start
+                finally:
+                    latency.observe(time.perf_counter() - start)
+
+    async def get_json(self, url, params=None):
+        """GET a URL and decode the JSON body."""
+        response = await self.request("GET", url, params=params)
+        return response.json()
+
+    async def close(self):
+        """Close every pooled session."""
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        self._semaphores.clear()
+        await asyncio.gather(*(session.aclose() for session in sessions))
+
+
+def get_http_client(context):
+    """Return the application's shared HttpClient."""
+    return context.bot_data["http"]
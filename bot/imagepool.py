@@ -0,0 +1,136 @@
+"""Per-query pools of image/GIF results so repeated searches get new pictures"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from bot.cache import normalize_query
+from config import IMAGE_PAGE_SIZE, IMAGE_POOL_LOW_WATER, IMAGE_POOL_TTL, IMAGE_POOL_MAX
+
+logger = logging.getLogger(__name__)
+
+# The Custom Search API won't page past 100 results
+MAX_START = 91
+
+
+class _Pool:
+    __slots__ = ("unseen", "served", "next_start", "exhausted", "expires_at", "refill", "error")
+
+    def __init__(self, ttl):
+        self.unseen = deque()
+        self.served = []
+        self.next_start = 1
+        self.exhausted = False
+        self.expires_at = time.monotonic() + ttl
+        self.refill = None
+        self.error = None  # Why the last fetch failed, if it did
+
+
+class ImagePool:
+    """Serve the next unseen result for a query on each request.
+
+    Each query keeps a queue of result URLs. When it runs low, the next page
+    of results (the API's ``start`` offset) is fetched in the background, so
+    most requests are answered without an upstream call. Once the API has no
+    more pages, the pool cycles through what it has already served. A failed
+    fetch is not the end of the results: the same page is tried again on the
+    next request, and a query with nothing to serve isn't kept. Pools
+    expire after ``ttl`` seconds and the least recently used are dropped
+    beyond ``max_pools``.
+    """
+
+    def __init__(self, fetch_page, page_size=IMAGE_PAGE_SIZE, low_water=IMAGE_POOL_LOW_WATER,
+                 ttl=IMAGE_POOL_TTL, max_pools=IMAGE_POOL_MAX):
+        """
+        :param fetch_page: async (query, search_type, start, num) -> list of URLs; raises on failure
+        """
+        self.fetch_page = fetch_page
+        self.page_size = page_size
+        self.low_water = low_water
+        self.ttl = ttl
+        self.max_pools = max_pools
+        self._pools = OrderedDict()
+
+    def _pool(self, key):
+        pool = self._pools.get(key)
+        if pool is None or pool.expires_at <= time.monotonic():
+            if pool is not None and pool.refill:
+                pool.refill.cancel()
+            pool = self._pools[key] = _Pool(self.ttl)
+            while len(self._pools) > self.max_pools:
+                _, evicted = self._pools.popitem(last=False)
+                if evicted.refill:
+                    evicted.refill.cancel()
+        self._pools.move_to_end(key)
+        return pool
+
+    async def _fill(self, pool, query, search_type):
+        start = pool.next_start
+        urls = await self.fetch_page(query, search_type, start, self.page_size)
+        pool.error = None
+        known = set(pool.served).union(pool.unseen)
+        fresh = [url for url in urls if url not in known]
+        pool.unseen.extend(fresh)
+        pool.next_start = start + self.page_size
+        if not fresh or len(urls) < self.page_size or pool.next_start > MAX_START:
+            pool.exhausted = True
+
+    def _start_refill(self, pool, query, search_type):
+        async def refill():
+            try:
+                await self._fill(pool, query, search_type)
+            except Exception as e:
+                # Leave the pool open, so the page is fetched again next time
+                logger.error(f"Refilling image pool for {query!r} failed: {e!r}")
+                pool.error = e
+            finally:
+                pool.refill = None
+
+        pool.refill = asyncio.create_task(refill())
+
+    async def next_url(self, query, search_type="image"):
+        """Return the next result URL for the query, or None if there are no results.
+
+        Raises the fetch error if the search failed and there is nothing to serve.
+        """
+        query = normalize_query(query)
+        key = (search_type, query)
+        pool = self._pool(key)
+
+        if not pool.unseen and not pool.exhausted:
+            if pool.refill is None:
+                self._start_refill(pool, query, search_type)
+            await asyncio.shield(pool.refill)
+
+        if not pool.unseen:
+            if not pool.served:
+                # Don't keep an empty pool; the next request searches again
+                if self._pools.get(key) is pool and pool.refill is None:
+                    del self._pools[key]
+                if pool.error is not None:
+                    raise pool.error
+                return None
+            # Nothing new upstream: go round again
+            pool.unseen.extend(pool.served)
+            pool.served.clear()
+
+        url = pool.unseen.popleft()
+        pool.served.append(url)
+
+        if len(pool.unseen) <= self.low_water and not pool.exhausted and pool.refill is None:
+            self._start_refill(pool, query, search_type)
+        return url
+
+    def forget(self, query, search_type, url):
+        """Drop a URL that turned out to be unusable so it isn't served again."""
+        pool = self._pools.get((search_type, normalize_query(query)))
+        if pool is not None and url in pool.served:
+            pool.served.remove(url)
+
+    def stats(self):
+        return {"pools": len(self._pools), "urls": sum(len(p.unseen) + len(p.served) for p in self._pools.values())}
+
+
+def get_image_pool(context):
+    """Return the application's shared ImagePool."""
+    return context.bot_data["images"]
@@ -0,0 +1,92 @@
+"""Karma counters with per-chat leaderboards"""
+import time
+from bisect import bisect_left, insort
+
+from bot.shared import LocalState
+from config import KARMA_GIVE_LIMIT, KARMA_GIVE_WINDOW
+
+NAMESPACE = "karma"
+
+
+class KarmaStore:
+    """Per-chat karma counters with incrementally maintained leaderboards.
+
+    Every mutation runs without awaiting, so on the event loop an increment
+    is atomic and concurrent handlers can't lose updates. Each chat keeps a
+    sorted list of (-score, user_id) that is patched on every change, so the
+    top N is a slice rather than a scan. Changes are staged with the
+    persistence layer and written in the background. The give limit is
+    counted in the shared state backend, like admission quotas, because a
+    giver's chats can be spread over several worker processes.
+    """
+
+    def __init__(self, persistence=None, state=None, give_limit=KARMA_GIVE_LIMIT, give_window=KARMA_GIVE_WINDOW):
+        self.persistence = persistence
+        self.state = state if state is not None else LocalState()
+        self.give_limit = give_limit
+        self.give_window = give_window
+        self._scores = {}  # chat_id -> {user_id: score}
+        self._names = {}  # (chat_id, user_id) -> display name
+        self._boards = {}  # chat_id -> sorted [(-score, user_id)]
+
+    async def load(self, owns_chat=None):
+        """Load saved counters from persistence; only for the chats owns_chat accepts, if given."""
+        if self.persistence is None:
+            return
+        for key, (score, name) in (await self.persistence.load_namespace(NAMESPACE)).items():
+            chat_id, user_id = map(int, key.split(":"))
+            if owns_chat is None or owns_chat(chat_id):
+                self._set(chat_id, user_id, score, name)
+
+    def _set(self, chat_id, user_id, score, name=None):
+        scores = self._scores.setdefault(chat_id, {})
+        board = self._boards.setdefault(chat_id, [])
+        old = scores.get(user_id)
+        if old is not None:
+            del board[bisect_left(board, (-old, user_id))]
+        scores[user_id] = score
+        insort(board, (-score, user_id))
+        if name:
+            self._names[(chat_id, user_id)] = name
+
+    def add(self, chat_id, user_id, delta=1, name=None):
+        """Add delta to a user's karma in a chat and return the new score."""
+        score = self._scores.get(chat_id, {}).get(user_id, 0) + delta
+        self._set(chat_id, user_id, score, name)
+        if self.persistence is not None:
+            self.persistence.stage_kv(
+                NAMESPACE, f"{chat_id}:{user_id}", (score, self._names.get((chat_id, user_id)))
+            )
+        return score
+
+    def get(self, chat_id, user_id):
+        """Return a user's karma in a chat."""
+        return self._scores.get(chat_id, {}).get(user_id, 0)
+
+    def top(self, chat_id, n=10):
+        """Return the chat's top n as (user_id, name, score), highest first."""
+        return [
+            (user_id, self._names.get((chat_id, user_id)), -neg_score)
+            for neg_score, user_id in self._boards.get(chat_id, [])[:n]
+        ]
+
+    async def allow_give(self, giver_id, now=None):
+        """Record a give attempt; return False if the giver is over their limit."""
+        # Same sliding-window approximation as AdmissionControl.admit: charge, then take it back if over
+        now = time.time() if now is None else now
+        bucket, into = divmod(now, self.give_window)
+        key = f"karma:give:{giver_id}:{int(bucket)}"
+        previous = await self.state.get(f"karma:give:{giver_id}:{int(bucket) - 1}") or 0
+        current = await self.state.incrby(key, 1, ex=2 * self.give_window)
+        if previous * (1 - into / self.give_window) + current > self.give_limit:
+            await self.state.incrby(key, -1)
+            return False
+        return True
+
+    def stats(self):
+        return {"chats": len(self._scores)}
+
+
+def get_karma_store(context):
+    """Return the application's KarmaStore."""
+    return context.bot_data["karma"]
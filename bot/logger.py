@@ -1,41 +1,124 @@
+import atexit
 import logging
+import logging.handlers
+import queue
+import random
 from telegram import Update
+from config import (
+    LOG_LEVEL, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATE_WHEN, LOG_MESSAGE_SAMPLE_RATE,
+)
 
-def log_command(update: Update, command: str):
-    """Log command usage with additional context."""
+logger = logging.getLogger("bot")
+
+# Structured fields attached to records through `extra`, rendered as key=value
+FIELDS = ("user_id", "username", "chat_id", "chat_type", "command", "latency_ms", "text")
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener = None  # (path, QueueListener) once setup_logging has run in this process
+
+
+class StructuredFormatter(logging.Formatter):
+    """Append any structured fields present on the record to the formatted line."""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = " ".join(
+            f"{name}={getattr(record, name)!r}" for name in FIELDS if hasattr(record, name)
+        )
+        return f"{line} {fields}" if fields else line
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread.
+
+    The stock QueueHandler formats the message in the calling thread so the
+    record can be pickled; records here never leave the process, so they are
+    queued untouched and the event loop only pays for the enqueue.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=LOG_LEVEL, path=LOG_FILE):
+    """Route all logging through a queue drained by a background thread.
+
+    Console and file handlers (the file rotating by size, or by time when
+    LOG_ROTATE_WHEN is set) run on the QueueListener thread, so logging never
+    blocks the event loop on disk or terminal I/O. Calling it again for the
+    same file is a no-op, so every entry point can call it.
+    """
+    global _listener
+    if _listener is not None:
+        if _listener[0] == path:
+            return _listener[1]
+        _listener[1].stop()
+
+    formatter = StructuredFormatter(LOG_FORMAT)
+
+    if LOG_ROTATE_WHEN:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    console_handler = logging.StreamHandler()
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, console_handler, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    _listener = (path, listener)
+
+    root = logging.getLogger()
+    root.handlers[:] = [LazyQueueHandler(log_queue)]
+    root.setLevel(level)
+
+    # httpx logs full request URLs, which carry API keys
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return listener
+
+
+def _context_fields(update: Update):
     user = update.effective_user
     chat = update.effective_chat
-
     if not user or not chat:
-        logging.warning("Invalid update: user or chat not found.")
+        return None
+    return {"user_id": user.id, "username": user.username, "chat_id": chat.id, "chat_type": str(chat.type)}
+
+
+def log_command(update: Update, command: str, latency: float = None):
+    """Log command usage with additional context."""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    fields = _context_fields(update)
+    if fields is None:
+        logger.warning("Invalid update: user or chat not found.")
         return
 
-    logging.info(
-        f"Command /{command} used by user {user.id} ({user.username or 'no username'}) "
-        f"in chat {chat.id} (type: {chat.type})."
-    )
+    fields["command"] = command
+    if latency is not None:
+        fields["latency_ms"] = round(latency * 1000, 1)
+    logger.info("command", extra=fields)
 
 def log_message(update: Update):
-    """Log received messages with additional context."""
-    user = update.effective_user
-    chat = update.effective_chat
-    message = update.message.text if update.message else "No message content"
-
-    if not user or not chat:
-        logging.warning("Invalid update: user or chat not found.")
+    """Log received messages with additional context, sampled by LOG_MESSAGE_SAMPLE_RATE."""
+    if random.random() >= LOG_MESSAGE_SAMPLE_RATE or not logger.isEnabledFor(logging.INFO):
+        return
+    fields = _context_fields(update)
+    if fields is None:
+        logger.warning("Invalid update: user or chat not found.")
         return
 
-    logging.info(
-        f"Message received from user {user.id} ({user.username or 'no username'}) "
-        f"in chat {chat.id} (type: {chat.type}): {message}"
-    )
+    fields["text"] = update.message.text if update.message else "No message content"
+    logger.info("message", extra=fields)
 
 def log_error(update: Update, error: str):
     """Log errors with context."""
-    user = update.effective_user if update else None
-    chat = update.effective_chat if update else None
-
-    logging.error(
-        f"Error occurred for user {user.id if user else 'unknown'} "
-        f"in chat {chat.id if chat else 'unknown'}: {error}"
-    )
\ No newline at end of file
+    fields = (_context_fields(update) if update else None) or {}
+    logger.error("Error occurred: %s", error, extra=fields)
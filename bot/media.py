@@ -0,0 +1,124 @@
+"""Reuse Telegram file_ids for media the bot has already sent"""
+import logging
+from collections import OrderedDict
+
+from telegram.error import BadRequest
+
+from bot.cache import key_digest
+from config import MEDIA_CACHE_MAX, MEDIA_SEND_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = "file_ids"
+
+
+class MediaCache:
+    """Persistent, size-bounded map of media URL -> Telegram file_id.
+
+    Once Telegram has fetched a URL it hands back a file_id; sending that
+    file_id again is served from Telegram's CDN without re-fetching the
+    remote URL. Entries are kept in LRU order, capped at ``max_entries``, and
+    saved through the persistence kv store under a digest of the URL, since
+    URLs can be longer than a kv key.
+    """
+
+    def __init__(self, persistence=None, max_entries=MEDIA_CACHE_MAX):
+        self.persistence = persistence
+        self.max_entries = max_entries
+        self._file_ids = OrderedDict()  # URL digest -> file_id
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self):
+        """Load saved file_ids from persistence."""
+        if self.persistence is None:
+            return
+        for key, file_id in (await self.persistence.load_namespace(NAMESPACE)).items():
+            if "://" in key:
+                # Saved under the URL itself by older versions
+                self.persistence.stage_kv(NAMESPACE, key, None)
+                key = key_digest(key)
+                self.persistence.stage_kv(NAMESPACE, key, file_id)
+            self._file_ids[key] = file_id
+        while len(self._file_ids) > self.max_entries:
+            self._file_ids.popitem(last=False)
+
+    def get(self, url):
+        digest = key_digest(url)
+        file_id = self._file_ids.get(digest)
+        if file_id is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._file_ids.move_to_end(digest)
+        return file_id
+
+    def put(self, url, file_id):
+        digest = key_digest(url)
+        self._file_ids[digest] = file_id
+        self._file_ids.move_to_end(digest)
+        self._save(digest, file_id)
+        while len(self._file_ids) > self.max_entries:
+            evicted, _ = self._file_ids.popitem(last=False)
+            self._save(evicted, None)
+
+    def discard(self, url):
+        digest = key_digest(url)
+        if self._file_ids.pop(digest, None) is not None:
+            self._save(digest, None)
+
+    def _save(self, digest, file_id):
+        if self.persistence is not None:
+            self.persistence.stage_kv(NAMESPACE, digest, file_id)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._file_ids),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+async def reply_media(message, media_cache, image_pool, query, search_type, attempts=MEDIA_SEND_ATTEMPTS):
+    """Reply with the next photo ("image") or animation ("gif") for a query.
+
+    Uses the cached file_id when the URL has been sent before; if Telegram
+    rejects a stale file_id, the URL itself is sent instead. If Telegram
+    can't fetch a URL, the next result from the pool is tried instead.
+    :return: True if something was sent, False if there were no usable results.
+    """
+    send = message.reply_photo if search_type == "image" else message.reply_animation
+    for _ in range(attempts):
+        url = await image_pool.next_url(query, search_type)
+        if not url:
+            return False
+
+        file_id = media_cache.get(url)
+        if file_id is not None:
+            try:
+                await send(file_id)
+                return True
+            except BadRequest as e:
+                # Only the file_id is bad; the URL may well still work
+                logger.warning(f"Telegram rejected the cached {search_type} for {url}: {e}")
+                media_cache.discard(url)
+
+        try:
+            sent = await send(url)
+        except BadRequest as e:
+            logger.warning(f"Telegram rejected {search_type} {url}: {e}")
+            image_pool.forget(query, search_type, url)
+            continue
+
+        media = sent.photo[-1] if search_type == "image" and sent.photo else (sent.animation or sent.document)
+        if media:
+            media_cache.put(url, media.file_id)
+        return True
+    return False
+
+
+def get_media_cache(context):
+    """Return the application's MediaCache."""
+    return context.bot_data["media"]
@@ -1,142 +1,208 @@
-"""Message patterns and responses for the bot"""
+"""Message patterns and responses for the bot, loaded from response pack files"""
+import asyncio
+import json
+import logging
+import os
 import random
-
-# Greeting patterns and responses
-GREETING_PATTERNS = [
-    'hi', 'hello', 'hey', 'lee', 'nigga', 'morning', 'evening', 'lee lr',
-    'sup', 'yo', 'koko', 'good morning', 'good evening', 'min phane loe'
-]
-
-GREETING_RESPONSES = [
-    "yo nigga whats up",
-    "lee lr br ll phin loe ml",
-    "hey baby girl how you doing ",
-    "u make me bricked whats up ",
-    "br ll chou 1v1 ",
-    "hi what do u want",
-]
-
-# Goodbye patterns and responses
-GOODBYE_PATTERNS = [
-    'bye', 'goodbye', 'see you', 'cya', 'good night', 'night', 'farewell',
-    'have to go', 'gtg', 'time to sleep man', 'see ya'
-]
-
-GOODBYE_RESPONSES = [
-    "fine bye bye leave me",
-    "i hope u slip and die",
-    "leave just like your dad",
-    "alright man no one cares",
-    "fuck off",
-    "k",
-]
-
-# Thank you patterns and responses
-THANKS_PATTERNS = [
-    'thanks', 'thank you', 'thx', 'thank u', 'appreciated', 'chit tl', 'ty'
-]
-
-THANKS_RESPONSES = [
-    "u owe me one suck(pod) 😊",
-    "give me money now or ill leak ur ip",
-    "i know ur cheating on me",
-    "thanks man",
-    "no worries",
-    "chit lr chit yin p yw",
-]
-
-# How are you patterns and responses
-HOW_ARE_YOU_PATTERNS = [
-    'how are you', 'how r u', 'how\'re you', 'how you doing', 'whats up',
-    'what\'s up', 'sup', 'how do you do', 'you good', 'yo'
-]
-
-HOW_ARE_YOU_RESPONSES = [
-    "oh im actually good im just suicidal",
-    "no one loves me im gonna die alone",
-    "i think im having a mental breakdown",
-    "ok bro no one cares",
-    "i wanna kill myself",
-    "eat shit",
-    "do u think things are good u dumb fuck",
-    "depressed gimme ways to get out"
-]
-
-# What can you do patterns and responses
-CAPABILITIES_PATTERNS = [
-    'yo leon', 'bro what can leon do', 'help me', 'your abilities',
-    'what are you capable of', 'what are your features', 'commands',
-    'what can i do', 'how to use', 'show me'
-]
-
-CAPABILITIES_RESPONSES = [
-    """some shit i can do for ur lazy ass
-
-/start - be nice to u
-/help - list my entire command shit
-/joke - get an ai unfunny joke
-/quote - quotes to be less depressed
-/fact - u never know what u will find
-/roll - gamble it out
-/calc - math bro ew
-/weather - will it rain or will it be a tsunami
-
-u can chat with me too im your friendly depressed ai""",
-    """im leon this is some of the things i can do for u
-
-• u want me to tell a joke? (/joke)
-• dumbass quotes (/quote)
-• weird facts (/fact)
-• gamble (/roll)
-• help ur dumbass with maths (/calc)
-• will it rain? who knows (/weather)
-
-i dont love chatting but i love slavary""",
-    """make me yours
-
-hee hee haa haa
-• /joke - yee pay ya ma lr
-• /quote - always give up
-• /fact - pig cant look up
-• /roll - bet your house
-
-cool shit:
-• /calc - maths answer generator
-• /weather - moe tay ywar tine min ko lwan tl
-
-cum baby"""
-]
-
-# Unknown message responses
-UNKNOWN_MESSAGE_RESPONSES = [
-    "aww hote lr phin loe pay ya ma lr ae tot",
-    "wow so interesting omg omoshiroi im so happy for u",
-    "nigga shut up",
-    "bro i made this bot when i was drunk man",
-    "so what bro do i look like i care"
-    "get out of ur country first lmfao"
-    "try making something like this first u fuck",
-    "lets have sough rex"
-]
-
-def get_response_for_text(text: str) -> str:
-    """Get appropriate response based on the input text"""
-    text = text.lower().strip()
-
-    if any(pattern in text for pattern in GREETING_PATTERNS):
-        return random.choice(GREETING_RESPONSES)
-
-    if any(pattern in text for pattern in GOODBYE_PATTERNS):
-        return random.choice(GOODBYE_RESPONSES)
-
-    if any(pattern in text for pattern in THANKS_PATTERNS):
-        return random.choice(THANKS_RESPONSES)
-
-    if any(pattern in text for pattern in HOW_ARE_YOU_PATTERNS):
-        return random.choice(HOW_ARE_YOU_RESPONSES)
-
-    if any(pattern in text for pattern in CAPABILITIES_PATTERNS):
-        return random.choice(CAPABILITIES_RESPONSES)
-
-    # Instead of returning None for unknown messages, return a friendly response
-    return random.choice(UNKNOWN_MESSAGE_RESPONSES)
\ No newline at end of file
+import re
+import sys
+
+try:
+    import yaml
+except ImportError:  # YAML packs are optional
+    yaml = None
+
+from config import PACKS_DIR
+
+logger = logging.getLogger(__name__)
+
+PACK_EXTENSIONS = (".json", ".yaml", ".yml")
+DEFAULT_PACK = "default"
+
+# Words are runs of letters/digits, keeping apostrophes so "what's" stays one token
+TOKEN_RE = re.compile(r"[\w']+")
+
+
+def tokenize(text: str) -> tuple:
+    """Split text into lowercase word tokens"""
+    return tuple(TOKEN_RE.findall(text.lower()))
+
+
+def _intern_tokens(text: str) -> tuple:
+    # Packs repeat the same words across many patterns; share one copy of each
+    return tuple(sys.intern(token) for token in tokenize(text))
+
+
+class PatternMatcher:
+    """Match text against prioritized pattern categories in a single scan.
+
+    Patterns are indexed as word n-grams in one dict, so a message is matched
+    by looking up each n-gram that starts at each word. The cost depends on
+    the message length and the longest pattern, not on how many patterns
+    there are, and patterns only match on whole words ('yo' won't match 'you').
+    When several categories match, the one listed first wins.
+    """
+
+    def __init__(self, categories):
+        """
+        :param categories: Ordered (name, patterns) pairs, highest priority first.
+        """
+        self.names = []
+        self._phrases = {}
+        self._lengths = set()
+        for priority, (name, patterns) in enumerate(categories):
+            self.names.append(name)
+            for pattern in patterns:
+                tokens = _intern_tokens(pattern)
+                if not tokens:
+                    continue
+                # Keep the highest-priority category when a pattern is listed twice
+                self._phrases.setdefault(tokens, priority)
+                self._lengths.add(len(tokens))
+        self._lengths = sorted(self._lengths)
+
+    def __len__(self):
+        """Number of distinct patterns indexed"""
+        return len(self._phrases)
+
+    def match(self, text: str):
+        """Return the name of the highest-priority matching category, or None"""
+        tokens = tokenize(text)
+        phrases = self._phrases
+        best = len(self.names)
+        for start in range(len(tokens)):
+            for length in self._lengths:
+                end = start + length
+                if end > len(tokens):
+                    break
+                priority = phrases.get(tokens[start:end])
+                if priority is not None and priority < best:
+                    if priority == 0:
+                        return self.names[0]
+                    best = priority
+        return self.names[best] if best < len(self.names) else None
+
+
+class ResponsePack:
+    """A set of prioritized categories, each with patterns and responses.
+
+    Pack files look like bot/packs/default.json: an ordered "categories"
+    list of {"name", "patterns", "responses"}, an optional "unknown" list for
+    messages nothing matched, and, except for the default pack, the "chats"
+    it applies to.
+    """
+
+    __slots__ = ("name", "matcher", "responses", "unknown", "chats")
+
+    def __init__(self, name, data):
+        categories = data.get("categories", [])
+        self.name = name
+        self.matcher = PatternMatcher((c["name"], c.get("patterns", [])) for c in categories)
+        self.responses = {c["name"]: tuple(c.get("responses", ())) for c in categories}
+        self.unknown = tuple(data.get("unknown", ()))
+        self.chats = frozenset(int(chat_id) for chat_id in data.get("chats", ()))
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a pack from a JSON or YAML file"""
+        name, extension = os.path.splitext(os.path.basename(path))
+        with open(path, encoding="utf-8") as f:
+            if extension == ".json":
+                data = json.load(f)
+            elif yaml is None:
+                raise RuntimeError(f"{path}: install PyYAML to use YAML response packs")
+            else:
+                data = yaml.safe_load(f)
+        return cls(name, data)
+
+    def respond(self, text: str):
+        """Return a response for the text, or None if no category matched"""
+        category = self.matcher.match(text)
+        responses = self.responses.get(category)
+        return random.choice(responses) if responses else None
+
+
+class ResponsePacks:
+    """The default pack plus per-chat packs from a directory, reloaded when the files change.
+
+    Packs are parsed and indexed off the event loop, then swapped in with a
+    single assignment, so a handler sees either the old set or the new one.
+    A pack that fails to load leaves the previous set in place.
+    """
+
+    def __init__(self, directory=PACKS_DIR):
+        self.directory = directory
+        self._packs = (None, {})  # (default pack, {chat_id: pack})
+        self._mtimes = {}
+
+    def _scan(self):
+        """Return {path: mtime} for the pack files in the directory"""
+        mtimes = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(PACK_EXTENSIONS):
+                mtimes[entry.path] = entry.stat().st_mtime_ns
+        return mtimes
+
+    def _build(self, paths):
+        default, by_chat = None, {}
+        for path in sorted(paths):
+            pack = ResponsePack.from_file(path)
+            if pack.name == DEFAULT_PACK:
+                default = pack
+            elif not pack.chats:
+                logger.warning(f"Response pack {path} lists no chats, ignoring it")
+            for chat_id in pack.chats:
+                by_chat[chat_id] = pack
+        if default is None or not default.unknown:
+            raise RuntimeError(f"No {DEFAULT_PACK} response pack with \"unknown\" responses in {self.directory}")
+        return default, by_chat
+
+    def load(self):
+        """Load every pack now, blocking; used once at startup"""
+        mtimes = self._scan()
+        self._packs = self._build(mtimes)
+        self._mtimes = mtimes
+
+    async def reload(self):
+        """Rebuild the packs in a worker thread if any file was added, changed or removed"""
+        mtimes = await asyncio.to_thread(self._scan)
+        if mtimes == self._mtimes:
+            return False
+        try:
+            packs = await asyncio.to_thread(self._build, mtimes)
+        except Exception as e:
+            logger.error(f"Reloading response packs failed, keeping the current ones: {e}")
+        else:
+            self._packs = packs
+            logger.info(f"Reloaded response packs: {self.stats()}")
+        # Don't retry a broken file until it changes again
+        self._mtimes = mtimes
+        return True
+
+    async def reload_job(self, context):
+        """Job callback for periodic reloads"""
+        await self.reload()
+
+    def respond(self, text: str, chat_id=None) -> str:
+        """Get a response for the text, from the chat's pack first and then the default"""
+        default, by_chat = self._packs
+        pack = by_chat.get(chat_id)
+        response = (pack and pack.respond(text)) or default.respond(text)
+        if response is not None:
+            return response
+        # Instead of returning None for unknown messages, return a friendly response
+        return random.choice((pack and pack.unknown) or default.unknown)
+
+    def stats(self):
+        default, by_chat = self._packs
+        packs = {id(default): default, **{id(pack): pack for pack in by_chat.values()}}
+        return {
+            "packs": len(packs),
+            "chats": len(by_chat),
+            "patterns": sum(len(pack.matcher) for pack in packs.values()),
+        }
+
+
+def get_response_packs(context):
+    """Return the application's ResponsePacks."""
+    return context.bot_data["packs"]
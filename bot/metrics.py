@@ -0,0 +1,241 @@
+"""Lightweight in-process metrics with a Prometheus text endpoint"""
+import asyncio
+import functools
+import logging
+import os
+import resource
+import time
+from bisect import bisect_left
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+
+from bot import tracing
+from bot.logger import log_command
+from config import METRICS_READ_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from fast replies up to slow upstream calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+_collectors = {}
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = labels
+        self._children = {}
+        _metrics.append(self)
+
+    def labels(self, *values):
+        """Return the child for one label combination; keep it around on hot paths."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _label_text(self, values, extra=""):
+        pairs = [f'{name}="{value}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{self._label_text(values)} {child.value}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        super().__init__(name, description, labels)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else bound
+            le_label = f'le="{le}"'
+            lines.append(f"{self.name}_bucket{self._label_text(values, le_label)} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(values)} {child.sum}")
+        lines.append(f"{self.name}_count{self._label_text(values)} {cumulative}")
+        return lines
+
+
+HANDLER_LATENCY = Histogram("bot_handler_latency_seconds", "Handler run time", ("handler",))
+HANDLER_IN_FLIGHT = Gauge("bot_handler_in_flight", "Handler calls currently running", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Handler calls that raised", ("handler",))
+UPSTREAM_LATENCY = Histogram("bot_upstream_latency_seconds", "Outbound HTTP request time", ("upstream",))
+CIRCUIT_STATE = Gauge("bot_circuit_state", "Upstream circuit breaker: 0 closed, 1 half-open, 2 open", ("upstream",))
+CIRCUIT_TRANSITIONS = Counter(
+    "bot_circuit_transitions_total", "Upstream circuit breaker state changes", ("upstream", "state")
+)
+CIRCUIT_REJECTED = Counter("bot_circuit_rejected_total", "Requests failed fast by an open breaker", ("upstream",))
+LOOP_STALLS = Counter("bot_loop_stalls_total", "Event loop stalls seen while tracing is on")
+ADMISSION_DECISIONS = Counter(
+    "bot_admission_total", "Expensive commands admitted or rejected by quota", ("command", "outcome")
+)
+UPDATES_DROPPED = Counter("bot_updates_dropped_total", "Updates dropped because their chat had too many waiting")
+UPSTREAM_ERRORS = Counter("bot_upstream_errors_total", "Outbound HTTP requests that failed", ("upstream",))
+
+
+def add_collector(name, collect):
+    """Register (or replace) a callable returning {metric_name: value}, read at scrape time."""
+    _collectors[name] = collect
+
+
+def _process_stats():
+    try:
+        with open("/proc/self/statm") as f:
+            resident = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current RSS where /proc is unavailable
+        resident = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {"bot_process_resident_bytes": resident}
+
+
+add_collector("process", _process_stats)
+
+
+def render():
+    """Render every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector, collect in _collectors.items():
+        for name, value in collect().items():
+            # Collectors only report a number, not whether it's a counter or a gauge
+            lines.extend((f"# HELP {name} Read from the {collector} collector", f"# TYPE {name} untyped"))
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def instrument(callback, name=None):
+    """Wrap a handler callback to record its latency, in-flight count and errors.
+
+    Each call on a user's update is also logged as a structured ``command``
+    record with its latency.
+    """
+    name = name or callback.__name__
+    latency = HANDLER_LATENCY.labels(name)
+    in_flight = HANDLER_IN_FLIGHT.labels(name)
+    errors = HANDLER_ERRORS.labels(name)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            with tracing.span("handler", name):
+                return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            latency.observe(elapsed)
+            in_flight.dec()
+            if isinstance(update, Update) and update.effective_user and update.effective_chat:
+                log_command(update, name, elapsed)
+
+    return wrapper
+
+
+def instrument_handlers(application):
+    """Instrument every registered handler, including those inside conversations."""
+    def wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for child in handler.entry_points + handler.fallbacks:
+                wrap(child)
+            for state_handlers in handler.states.values():
+                for child in state_handlers:
+                    wrap(child)
+        elif not getattr(handler.callback, "__wrapped__", None):
+            handler.callback = instrument(handler.callback)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            wrap(handler)
+
+
+async def _serve_metrics(reader, writer):
+    try:
+        # A client that never finishes its request mustn't hold the connection open
+        await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), METRICS_READ_TIMEOUT)
+        body = render().encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host, port):
+    """Serve /metrics on a small asyncio server; returns the server to close on shutdown."""
+    server = await asyncio.start_server(_serve_metrics, host, port)
+    logger.info(f"Serving metrics on {host}:{port}")
+    return server
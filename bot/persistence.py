@@ -0,0 +1,382 @@
+"""SQL-backed, write-behind persistence for user_data, chat_data and conversations"""
+import asyncio
+import json
+import logging
+import pickle
+
+from sqlalchemy import (
+    BigInteger, Column, LargeBinary, MetaData, String, Table, create_engine, event, select, tuple_,
+)
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import (
+    DATABASE_URL, PERSISTENCE_UPDATE_INTERVAL, PERSISTENCE_WRITE_DELAY, PERSISTENCE_RETRY_DELAY,
+    PERSISTENCE_MAX_ATTEMPTS, PERSISTENCE_BUSY_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+user_data_table = Table(
+    "user_data", metadata,
+    Column("user_id", BigInteger, primary_key=True),
+    Column("data", LargeBinary, nullable=False),
+)
+
+chat_data_table = Table(
+    "chat_data", metadata,
+    Column("chat_id", BigInteger, primary_key=True),
+    Column("data", LargeBinary, nullable=False),
+)
+
+conversations_table = Table(
+    "conversations", metadata,
+    Column("name", String(64), primary_key=True),
+    Column("key", String(128), primary_key=True),
+    Column("state", LargeBinary, nullable=False),
+)
+
+# Generic store for feature data that doesn't belong to one user or chat (karma, caches, ...)
+kv_table = Table(
+    "kv", metadata,
+    Column("namespace", String(64), primary_key=True),
+    Column("key", String(255), primary_key=True),
+    Column("value", LargeBinary, nullable=False),
+)
+
+TABLES = {
+    "user_data": (user_data_table, ("user_id",)),
+    "chat_data": (chat_data_table, ("chat_id",)),
+    "conversations": (conversations_table, ("name", "key")),
+    "kv": (kv_table, ("namespace", "key")),
+}
+
+
+class SQLPersistence(BasePersistence):
+    """BasePersistence on SQLite or Postgres through SQLAlchemy.
+
+    Writes never touch the database on the event loop: update_* calls only
+    stage serialized rows in memory, and a background task writes the staged
+    rows in one transaction per batch from a worker thread. If a batch fails,
+    its rows are written one by one so a single bad row can't hold back the
+    rest; rows that keep failing are retried every ``retry_delay`` seconds
+    and dropped after ``max_attempts``. Reads are lazy:
+    a user's or chat's data is loaded the first time an update refers to it,
+    except for users with a conversation in progress, which are loaded at
+    startup so resumed conversations find their data.
+
+    user_data and chat_data rows are only written when they changed since
+    they were read or last written. PTB hands over a user's data after every
+    update they send, and with sharded workers a user active in chats on two
+    workers would otherwise have each worker overwrite the other's copy.
+    SQLite databases run in WAL mode with a busy timeout, since every worker
+    process writes to the same file. A worker passes ``owns_chat`` so it
+    only resumes conversations in the chats it handles.
+    """
+
+    def __init__(self, url=DATABASE_URL, update_interval=PERSISTENCE_UPDATE_INTERVAL,
+                 write_delay=PERSISTENCE_WRITE_DELAY, retry_delay=PERSISTENCE_RETRY_DELAY,
+                 max_attempts=PERSISTENCE_MAX_ATTEMPTS, owns_chat=None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        connect_args = {}
+        if url.startswith("sqlite"):
+            connect_args = {"check_same_thread": False, "timeout": PERSISTENCE_BUSY_TIMEOUT}
+        self.engine = create_engine(url, connect_args=connect_args)
+        if url.startswith("sqlite"):
+            event.listen(self.engine, "connect", _use_wal)
+        self.write_delay = write_delay
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.owns_chat = owns_chat
+        self._schema_ready = False
+        self._pending = {}  # (table, key) -> row values, or None to delete
+        self._writing = {}  # The batch being written right now
+        self._attempts = {}  # (table, key) -> failed writes so far
+        self._saved = {}  # (table, key) -> serialized user/chat data as last read or staged
+        self._wakeup = asyncio.Event()
+        self._writer_task = None
+        self._closing = asyncio.Event()
+        self._loaded_users = set()
+        self._loaded_chats = set()
+        self._loading = {}  # ("user_data" | "chat_data", id) -> task reading it in
+        self._preloaded_users = {}
+
+    # Database access, run in worker threads
+
+    def _ensure_schema(self):
+        if not self._schema_ready:
+            metadata.create_all(self.engine)
+            self._schema_ready = True
+
+    def _select(self, statement):
+        self._ensure_schema()
+        with self.engine.connect() as conn:
+            return conn.execute(statement).all()
+
+    def _write_batch(self, batch):
+        """Apply staged rows: delete every touched key, then re-insert the live ones."""
+        self._ensure_schema()
+        grouped = {}
+        for (table_name, key), values in batch.items():
+            deletes, inserts = grouped.setdefault(table_name, ([], []))
+            deletes.append(key)
+            if values is not None:
+                inserts.append(values)
+
+        with self.engine.begin() as conn:
+            for table_name, (deletes, inserts) in grouped.items():
+                table, pk = TABLES[table_name]
+                columns = [table.c[name] for name in pk]
+                if len(columns) == 1:
+                    conn.execute(table.delete().where(columns[0].in_([key[0] for key in deletes])))
+                else:
+                    conn.execute(table.delete().where(tuple_(*columns).in_(deletes)))
+                if inserts:
+                    conn.execute(table.insert(), inserts)
+
+    def _write_isolated(self, batch):
+        """Write a batch; if it fails, write each row on its own. Returns {(table, key): error} for failed rows."""
+        try:
+            self._write_batch(batch)
+            return {}
+        except Exception as e:
+            if len(batch) == 1:
+                return {key: e for key in batch}
+        failed = {}
+        for key, values in batch.items():
+            try:
+                self._write_batch({key: values})
+            except Exception as e:
+                failed[key] = e
+        return failed
+
+    # Write-behind queue
+
+    def _stage(self, table_name, key, values):
+        self._pending[(table_name, key)] = values
+        self._wakeup.set()
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._writer())
+
+    async def _writer(self):
+        while True:
+            await self._wakeup.wait()
+            if not self._closing.is_set():
+                # Give related updates a moment to land in the same batch; flush() cuts this short
+                try:
+                    await asyncio.wait_for(self._closing.wait(), self.write_delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            retry = await self._write_pending()
+            if self._closing.is_set():
+                return
+            if retry:
+                # Don't wait for the next update to stage something
+                asyncio.get_running_loop().call_later(self.retry_delay, self._wakeup.set)
+
+    async def _write_pending(self):
+        """Write the staged rows; returns True if some failed and were staged again."""
+        if not self._pending:
+            return False
+        batch, self._pending = self._pending, {}
+        self._writing = batch
+        try:
+            failed = await asyncio.to_thread(self._write_isolated, batch)
+        except Exception as e:
+            # Not even the row-by-row fallback ran
+            failed = {key: e for key in batch}
+        finally:
+            self._writing = {}
+
+        if self._attempts:
+            for key in batch.keys() - failed.keys():
+                self._attempts.pop(key, None)
+        retry = False
+        for key, error in failed.items():
+            attempts = self._attempts[key] = self._attempts.get(key, 0) + 1
+            if attempts >= self.max_attempts:
+                del self._attempts[key]
+                self._saved.pop(key, None)
+                logger.error(f"Dropping {key[0]} row {key[1]} after {attempts} failed writes: {error}")
+            else:
+                # A row staged since the batch was taken is newer; keep that one
+                self._pending.setdefault(key, batch[key])
+                retry = True
+        if failed:
+            logger.error(f"Failed to persist {len(failed)} of {len(batch)} rows: {next(iter(failed.values()))}")
+        return retry
+
+    def stage_kv(self, namespace, key, value):
+        """Queue a kv write; value None deletes the key."""
+        row = None if value is None else {"namespace": namespace, "key": str(key), "value": pickle.dumps(value)}
+        self._stage("kv", (namespace, str(key)), row)
+
+    async def load_namespace(self, namespace):
+        """Load every kv entry in a namespace as a dict of key -> value."""
+        rows = await asyncio.to_thread(
+            self._select, select(kv_table.c.key, kv_table.c.value).where(kv_table.c.namespace == namespace)
+        )
+        return {key: pickle.loads(value) for key, value in rows}
+
+    # BasePersistence interface
+
+    async def get_user_data(self):
+        # Only users with a conversation in progress are loaded up front
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = await asyncio.to_thread(
+            self._select,
+            select(conversations_table.c.key, conversations_table.c.state).where(conversations_table.c.name == name),
+        )
+        conversations = {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+        if self.owns_chat is not None:
+            # Keys of per_chat handlers start with the chat id
+            conversations = {key: state for key, state in conversations.items() if key and self.owns_chat(key[0])}
+
+        # Conversation keys end with the user id for per_user handlers
+        user_ids = {key[-1] for key in conversations if key} - self._loaded_users
+        if user_ids:
+            user_rows = await asyncio.to_thread(
+                self._select, select(user_data_table).where(user_data_table.c.user_id.in_(user_ids))
+            )
+            self._preloaded_users.update((user_id, pickle.loads(data)) for user_id, data in user_rows)
+        return conversations
+
+    async def update_conversation(self, name, key, new_state):
+        encoded_key = json.dumps(list(key))
+        row = None if new_state is None else {"name": name, "key": encoded_key, "state": pickle.dumps(new_state)}
+        self._stage("conversations", (name, encoded_key), row)
+
+    def _stage_data(self, table_name, key, row, data):
+        """Stage a user_data or chat_data row, unless it's unchanged since it was read or last staged."""
+        encoded = pickle.dumps(data)
+        if self._saved.get((table_name, key)) == encoded:
+            return
+        self._saved[(table_name, key)] = encoded
+        self._stage(table_name, key, {**row, "data": encoded})
+
+    async def update_user_data(self, user_id, data):
+        self._loaded_users.add(user_id)
+        self._stage_data("user_data", (user_id,), {"user_id": user_id}, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._loaded_chats.add(chat_id)
+        self._stage_data("chat_data", (chat_id,), {"chat_id": chat_id}, data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._saved.pop(("user_data", (user_id,)), None)
+        self._stage("user_data", (user_id,), None)
+        # Read it back if the user returns, so the loaded set doesn't grow forever
+        self._loaded_users.discard(user_id)
+
+    async def drop_chat_data(self, chat_id):
+        self._saved.pop(("chat_data", (chat_id,)), None)
+        self._stage("chat_data", (chat_id,), None)
+        self._loaded_chats.discard(chat_id)
+
+    def _staged_data(self, table_name, key):
+        """The not-yet-written data for a row: a dict, {} if it's being deleted, or None if nothing is staged."""
+        for staged in (self._pending, self._writing):
+            if (table_name, key) in staged:
+                row = staged[(table_name, key)]
+                return {} if row is None else pickle.loads(row["data"])
+        return None
+
+    def peek_user_data(self, user_id):
+        """A user's stored data without a database read, if it was preloaded or is staged; else None."""
+        stored = self._preloaded_users.get(user_id)
+        if stored is None:
+            stored = self._staged_data("user_data", (user_id,))
+        return stored
+
+    async def _load_once(self, loaded, table_name, key, load):
+        """Run load() the first time a user or chat is seen; concurrent updates wait for the same read."""
+        if key in loaded:
+            return
+        task = self._loading.get((table_name, key))
+        if task is None:
+            task = self._loading[(table_name, key)] = asyncio.ensure_future(load())
+            task.add_done_callback(lambda _: self._loading.pop((table_name, key), None))
+        # Shielded so one cancelled update doesn't abort the read the others are waiting on
+        await asyncio.shield(task)
+        # Marked only once the data is in, so nobody sees the user or chat half-loaded
+        loaded.add(key)
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._load_once(self._loaded_users, "user_data", user_id, lambda: self._load_user_data(user_id, user_data))
+
+    async def _load_user_data(self, user_id, user_data):
+        stored = self._preloaded_users.pop(user_id, None)
+        if stored is None:
+            stored = self._staged_data("user_data", (user_id,))
+        if stored is None:
+            rows = await asyncio.to_thread(
+                self._select, select(user_data_table.c.data).where(user_data_table.c.user_id == user_id)
+            )
+            stored = pickle.loads(rows[0][0]) if rows else {}
+        for key, value in stored.items():
+            user_data.setdefault(key, value)
+        self._saved[("user_data", (user_id,))] = pickle.dumps(user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._load_once(self._loaded_chats, "chat_data", chat_id, lambda: self._load_chat_data(chat_id, chat_data))
+
+    async def _load_chat_data(self, chat_id, chat_data):
+        stored = self._staged_data("chat_data", (chat_id,))
+        if stored is None:
+            rows = await asyncio.to_thread(
+                self._select, select(chat_data_table.c.data).where(chat_data_table.c.chat_id == chat_id)
+            )
+            stored = pickle.loads(rows[0][0]) if rows else {}
+        for key, value in stored.items():
+            chat_data.setdefault(key, value)
+        self._saved[("chat_data", (chat_id,))] = pickle.dumps(chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Write everything still staged and release the engine (called on shutdown)."""
+        self._closing.set()
+        if self._writer_task is not None:
+            self._wakeup.set()
+            await self._writer_task
+            self._writer_task = None
+        await self._write_pending()
+        if self._pending:
+            logger.error(f"Dropping {len(self._pending)} unsaved rows on shutdown")
+        self.engine.dispose()
+
+
+def _use_wal(dbapi_connection, connection_record):
+    """WAL lets readers run while a worker process writes."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def get_persistence(context):
+    """Return the application's SQLPersistence."""
+    return context.application.persistence
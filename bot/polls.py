@@ -0,0 +1,352 @@
+"""Poll drafts built by the /poll conversation, eviction of abandoned ones, and vote tallies"""
+import logging
+import sys
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import ConversationHandler
+
+from config import POLL_DRAFT_TTL, POLL_RESULTS_DEBOUNCE, POLL_TALLY_FLUSH_INTERVAL, POLL_TALLY_TTL
+
+logger = logging.getLogger(__name__)
+
+# Key in user_data holding the draft
+DRAFT_KEY = "poll"
+
+# Telegram's limits for native polls
+MAX_QUESTION_LENGTH = 300
+MAX_OPTION_LENGTH = 100
+MAX_OPTIONS = 10
+
+
+class PollDraft:
+    """A poll being built: the question, its options and when it was last touched."""
+
+    __slots__ = ("question", "options", "updated_at", "message_id")
+
+    def __init__(self, question=None, options=()):
+        self.question = question
+        self.options = list(options)
+        # The bot message that is edited in place as the poll is built
+        self.message_id = None
+        self.touch()
+
+    def touch(self):
+        # Wall-clock time, since drafts are persisted across restarts
+        self.updated_at = time.time()
+
+    def set_question(self, text):
+        self.question = text[:MAX_QUESTION_LENGTH]
+        self.touch()
+
+    def add_option(self, text):
+        """Add an option; return False if the poll already has the maximum."""
+        if len(self.options) >= MAX_OPTIONS:
+            return False
+        self.options.append(text[:MAX_OPTION_LENGTH])
+        self.touch()
+        return True
+
+    def size(self):
+        """Approximate memory held by the draft, in bytes."""
+        return (
+            sys.getsizeof(self) + sys.getsizeof(self.question or "") + sys.getsizeof(self.options)
+            + sum(sys.getsizeof(option) for option in self.options)
+        )
+
+
+def get_draft(user_data):
+    """Return the user's draft, converting one saved in the old dict format."""
+    draft = user_data.get(DRAFT_KEY)
+    if isinstance(draft, dict):
+        draft = user_data[DRAFT_KEY] = PollDraft(draft.get("question"), draft.get("options", ()))
+    return draft
+
+
+class PollSweeper:
+    """Periodically evict abandoned poll drafts, their conversations, and empty per-user/chat data.
+
+    Conversation timeouts end idle conversations while the process is up;
+    the sweeper also catches conversations restored from persistence, whose
+    timeouts were lost on restart, and the empty user_data/chat_data dicts
+    the application creates for everyone who sends an update. An empty dict
+    is only dropped if it was already empty at the previous sweep, so a
+    handler that is still running never writes into a dict that was dropped
+    from under it. User data is loaded lazily, so after a restart a user
+    whose conversation was restored may not be loaded yet; their draft is
+    read from what persistence preloaded for them.
+    """
+
+    def __init__(self, application, conversation_name="poll", ttl=POLL_DRAFT_TTL):
+        self.application = application
+        self.conversation_name = conversation_name
+        self.ttl = ttl
+        self._conversation = None
+        self._empty_users = set()
+        self._empty_chats = set()
+
+    @property
+    def conversation(self):
+        if self._conversation is None:
+            self._conversation = next(
+                handler for group in self.application.handlers.values() for handler in group
+                if isinstance(handler, ConversationHandler) and handler.name == self.conversation_name
+            )
+        return self._conversation
+
+    def sweep(self, now=None):
+        """Run one sweep and return counts of what was evicted."""
+        application = self.application
+        cutoff = (time.time() if now is None else now) - self.ttl
+        evicted = {"conversations": 0, "drafts": 0, "user_data": 0, "chat_data": 0}
+
+        # ConversationHandler has no public API for dropping a key. Deleting from
+        # its tracking dict is also what marks the key for the persistence update.
+        conversations = self.conversation._conversations
+        for key in list(conversations):
+            draft = get_draft(self._user_data(key[-1]))
+            if draft is None or draft.updated_at < cutoff:
+                del conversations[key]
+                job = self.conversation.timeout_jobs.pop(key, None)
+                if job is not None:
+                    job.schedule_removal()
+                evicted["conversations"] += 1
+
+        empty_users = set()
+        for user_id, user_data in list(application.user_data.items()):
+            draft = get_draft(user_data)
+            if draft is not None and draft.updated_at < cutoff:
+                del user_data[DRAFT_KEY]
+                application.mark_data_for_update_persistence(user_ids=user_id)
+                evicted["drafts"] += 1
+            if not user_data:
+                if user_id in self._empty_users:
+                    application.drop_user_data(user_id)
+                    evicted["user_data"] += 1
+                else:
+                    empty_users.add(user_id)
+        self._empty_users = empty_users
+
+        empty_chats = set()
+        for chat_id, chat_data in list(application.chat_data.items()):
+            if not chat_data:
+                if chat_id in self._empty_chats:
+                    application.drop_chat_data(chat_id)
+                    evicted["chat_data"] += 1
+                else:
+                    empty_chats.add(chat_id)
+        self._empty_chats = empty_chats
+
+        if any(evicted.values()):
+            logger.info(f"Poll sweep evicted {evicted}")
+        return evicted
+
+    def _user_data(self, user_id):
+        user_data = self.application.user_data.get(user_id)
+        if user_data is None:
+            # Not loaded since the restart: look at what persistence is holding for the user
+            peek = getattr(self.application.persistence, "peek_user_data", None)
+            user_data = peek(user_id) if peek else None
+        return user_data or {}
+
+    async def sweep_job(self, context):
+        """Job callback for periodic sweeps"""
+        self.sweep()
+
+    def stats(self):
+        """Live poll conversations and the memory their drafts hold."""
+        drafts = [get_draft(user_data) for user_data in self.application.user_data.values()]
+        drafts = [draft for draft in drafts if draft is not None]
+        return {
+            "conversations": len(self.conversation._conversations),
+            "drafts": len(drafts),
+            "draft_bytes": sum(draft.size() for draft in drafts),
+            "user_data_entries": len(self.application.user_data),
+            "chat_data_entries": len(self.application.chat_data),
+        }
+
+
+class _Tally:
+    __slots__ = ("question", "options", "counts", "votes", "poll_id", "created_at", "rendered")
+
+    def __init__(self, question, options, poll_id=None, counts=None, votes=None, created_at=None):
+        self.question = question
+        self.options = tuple(options)
+        self.counts = counts or [0] * len(self.options)
+        self.votes = votes or {}  # voter id -> tuple of option indexes
+        self.poll_id = poll_id
+        self.created_at = created_at or time.time()
+        self.rendered = None
+
+    def vote(self, voter_id, option_ids):
+        """Replace a voter's choice; an empty choice retracts the vote."""
+        for option in self.votes.pop(voter_id, ()):
+            self.counts[option] -= 1
+        option_ids = tuple(i for i in option_ids if 0 <= i < len(self.options))
+        if option_ids:
+            self.votes[voter_id] = option_ids
+            for option in option_ids:
+                self.counts[option] += 1
+
+    def state(self):
+        return self.question, self.options, self.poll_id, self.counts, self.votes, self.created_at
+
+
+def render_results(tally):
+    """Text and vote buttons for a poll's live results message."""
+    total = len(tally.votes)
+    lines = [f"📊 {tally.question}"]
+    for option, count in zip(tally.options, tally.counts):
+        share = f" ({count * 100 // total}%)" if total else ""
+        lines.append(f"{option}: {count}{share}")
+    lines.append(f"{total} vote{'s' if total != 1 else ''}")
+    keyboard = InlineKeyboardMarkup(
+        [[InlineKeyboardButton(option, callback_data=f"vote_{i}")] for i, option in enumerate(tally.options)]
+    )
+    return "\n".join(lines), keyboard
+
+
+class PollVotes:
+    """In-memory vote tallies for finished polls, with debounced results edits.
+
+    Each poll is keyed by its live results message (chat_id, message_id).
+    Votes arrive as native poll answers (matched by poll id) or as vote_
+    button presses on the results message, and each voter has one current
+    choice across both. A vote only updates counters; the results message is
+    re-rendered at most once per ``debounce`` seconds and edited only if the
+    text changed, so a burst of votes costs a handful of edits. Changed
+    tallies are staged with the persistence kv store every ``flush_interval``
+    seconds, and polls older than ``ttl`` are dropped.
+    """
+
+    NAMESPACE = "poll_tallies"
+
+    def __init__(self, persistence=None, debounce=POLL_RESULTS_DEBOUNCE,
+                 flush_interval=POLL_TALLY_FLUSH_INTERVAL, ttl=POLL_TALLY_TTL):
+        self.persistence = persistence
+        self.debounce = debounce
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.job_queue = None
+        self._tallies = {}  # (chat_id, message_id) -> _Tally
+        self._poll_ids = {}  # native poll id -> (chat_id, message_id)
+        self._dirty = set()
+        self._refresh_pending = set()
+
+    async def load(self, job_queue, owns_chat=None):
+        """Load saved tallies (only owned chats' if owns_chat is given) and start the periodic flush."""
+        self.job_queue = job_queue
+        if self.persistence is not None:
+            for key, state in (await self.persistence.load_namespace(self.NAMESPACE)).items():
+                try:
+                    chat_id, message_id = map(int, key.split(":"))
+                    question, options, poll_id, counts, votes, created_at = state
+                except (TypeError, ValueError):
+                    logger.warning(f"Dropping malformed poll tally {key!r}")
+                    self.persistence.stage_kv(self.NAMESPACE, key, None)
+                    continue
+                if owns_chat is not None and not owns_chat(chat_id):
+                    continue
+                self._add((chat_id, message_id), _Tally(question, options, poll_id, counts, votes, created_at))
+        if job_queue is not None and self.flush_interval:
+            job_queue.run_repeating(self._flush_job, interval=self.flush_interval, name="flush_poll_tallies")
+
+    def _add(self, key, tally):
+        self._tallies[key] = tally
+        if tally.poll_id:
+            self._poll_ids[tally.poll_id] = key
+
+    @staticmethod
+    def initial_results(question, options):
+        """Text and buttons of a new poll's results message, to post before calling start()."""
+        return render_results(_Tally(question, options))
+
+    def start(self, chat_id, message_id, question, options, poll_id=None):
+        """Start tallying a poll whose results message, showing initial_results(), is message_id."""
+        key = (chat_id, message_id)
+        tally = _Tally(question, options, poll_id)
+        self._add(key, tally)
+        self._dirty.add(key)
+        tally.rendered = render_results(tally)[0]
+
+    def vote(self, key, voter_id, option_ids):
+        """Record a vote; return False if the poll isn't known (expired or never tallied)."""
+        tally = self._tallies.get(key)
+        if tally is None:
+            return False
+        tally.vote(voter_id, option_ids)
+        self._dirty.add(key)
+        self._schedule_refresh(key)
+        return True
+
+    def vote_native(self, poll_id, voter_id, option_ids):
+        """Record a native poll answer."""
+        key = self._poll_ids.get(poll_id)
+        return key is not None and self.vote(key, voter_id, option_ids)
+
+    def current_vote(self, key, voter_id):
+        tally = self._tallies.get(key)
+        return tally.votes.get(voter_id, ()) if tally else ()
+
+    def _schedule_refresh(self, key):
+        if key in self._refresh_pending or self.job_queue is None:
+            return
+        self._refresh_pending.add(key)
+        self.job_queue.run_once(self._refresh_job, self.debounce, data=key, name=f"poll_results:{key[0]}:{key[1]}")
+
+    async def _refresh_job(self, context):
+        key = context.job.data
+        self._refresh_pending.discard(key)
+        tally = self._tallies.get(key)
+        if tally is None:
+            return
+        text, keyboard = render_results(tally)
+        if text == tally.rendered:
+            return
+        try:
+            await context.bot.edit_message_text(
+                chat_id=key[0], message_id=key[1], text=text, reply_markup=keyboard
+            )
+            tally.rendered = text
+        except BadRequest as e:
+            if "not modified" in str(e):
+                tally.rendered = text
+            else:
+                logger.warning(f"Updating poll results in chat {key[0]} failed: {e}")
+        except TelegramError as e:
+            logger.warning(f"Updating poll results in chat {key[0]} failed: {e}")
+
+    def flush(self, now=None):
+        """Stage changed tallies for persistence and drop expired ones."""
+        cutoff = (time.time() if now is None else now) - self.ttl
+        for key, tally in list(self._tallies.items()):
+            if tally.created_at < cutoff:
+                del self._tallies[key]
+                self._poll_ids.pop(tally.poll_id, None)
+                self._dirty.add(key)
+        if self.persistence is not None:
+            for key in self._dirty:
+                tally = self._tallies.get(key)
+                self.persistence.stage_kv(self.NAMESPACE, f"{key[0]}:{key[1]}", tally.state() if tally else None)
+        self._dirty.clear()
+
+    async def _flush_job(self, context):
+        self.flush()
+
+    def stats(self):
+        return {
+            "tallies": len(self._tallies),
+            "votes": sum(len(tally.votes) for tally in self._tallies.values()),
+            "pending_refreshes": len(self._refresh_pending),
+        }
+
+
+def poll_chat_key(poll_id):
+    """Shared state key naming the chat a native poll was sent to."""
+    return f"poll_chat:{poll_id}"
+
+
+def get_poll_votes(context):
+    """Return the application's PollVotes."""
+    return context.bot_data["poll_votes"]
@@ -0,0 +1,172 @@
+"""Outbound send scheduler that keeps the bot inside Telegram's flood limits"""
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from bot import tracing
+from bot.concurrency import slot_released
+from config import (
+    SEND_GLOBAL_RATE, SEND_PRIVATE_RATE, SEND_GROUP_RATE, SEND_GROUP_BURST, SEND_MAX_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, lower goes first. Pass as rate_limit_args={"priority": ...} on bot calls.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BROADCAST = 10
+
+# Drop per-chat buckets that have been idle this long
+IDLE_BUCKET_SECONDS = 300
+
+
+class TokenBucket:
+    """Token bucket where callers reserve a token up front and wait out any deficit.
+
+    Tokens may go negative; each reservation returns how long the caller must
+    wait, so callers are served in the order they reserved.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now=None):
+        """Take one token and return the seconds to wait before using it."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds, now=None):
+        """Hold back all tokens for the given time, e.g. after a flood-wait error."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class SendScheduler(BaseRateLimiter):
+    """Rate limiter for all Bot API calls that target a chat.
+
+    Each call first waits on its chat's bucket (one per second for private
+    chats, SEND_GROUP_RATE for groups) and then on the global bucket. The
+    global bucket serves waiters by priority lane, so interactive replies go
+    ahead of queued broadcasts. RetryAfter errors pause the chat and the call
+    is retried automatically.
+    """
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, private_rate=SEND_PRIVATE_RATE,
+                 group_rate=SEND_GROUP_RATE, group_burst=SEND_GROUP_BURST, max_retries=SEND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+        self._last_prune = time.monotonic()
+
+    async def initialize(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for _, _, future in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self.private_rate, 1)
+            else:
+                # Groups, channels and @usernames
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune(self, now):
+        if now - self._last_prune < IDLE_BUCKET_SECONDS:
+            return
+        self._last_prune = now
+        idle = [chat_id for chat_id, bucket in self._chat_buckets.items()
+                if now - bucket.updated > IDLE_BUCKET_SECONDS]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+
+    async def _dispatch(self):
+        """Hand out global tokens to waiters, highest priority first."""
+        while True:
+            while not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            delay = self.global_bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            if not future.done():
+                future.set_result(None)
+
+    async def _acquire_global(self, priority):
+        if self._dispatcher is None:
+            await self.initialize()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._wakeup.set()
+        await future
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        # Includes time spent waiting for a send slot
+        with tracing.span("bot_api", endpoint):
+            return await self._process_request(callback, args, kwargs, endpoint, data, rate_limit_args)
+
+    async def _process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            # Not a chat-scoped call (getMe, answerCallbackQuery, ...)
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_INTERACTIVE)
+        self._prune(time.monotonic())
+        bucket = self._chat_bucket(chat_id)
+        attempt = 0
+        while True:
+            delay = bucket.reserve()
+            # Other chats' updates can use the handler slot while this one waits its turn
+            async with slot_released():
+                if delay:
+                    await asyncio.sleep(delay)
+                await self._acquire_global(priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                retry_after = e.retry_after
+                if isinstance(retry_after, datetime.timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Flood limit hit on {endpoint} for chat {chat_id}, retrying in {retry_after}s")
+                bucket.pause(retry_after)
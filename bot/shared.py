@@ -0,0 +1,188 @@
+"""State shared between worker processes: cached responses and rate-limit counters"""
+import asyncio
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+
+from config import SHARED_STATE_URL
+
+logger = logging.getLogger(__name__)
+
+
+class LocalState:
+    """In-process backend, for a single worker.
+
+    Both backends speak the same small, Redis-like command set: get, mget,
+    set with an expiry, incrby and delete. Counters set by incrby read back
+    as numbers; anything else round-trips as the Python object. Expired keys
+    read as missing and are removed by purge_expired().
+    """
+
+    # Nothing is visible to other processes, so callers keep their own caches instead
+    cross_process = False
+
+    def __init__(self):
+        self._data = {}  # key -> (value, expires_at or None)
+
+    def _get(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry[0]
+
+    async def get(self, key):
+        return self._get(key, time.time())
+
+    async def mget(self, keys):
+        now = time.time()
+        return [self._get(key, now) for key in keys]
+
+    async def set(self, key, value, ex=None):
+        """Store a value, for ex seconds if given."""
+        self._data[key] = (value, time.time() + ex if ex else None)
+
+    async def incrby(self, key, amount=1, ex=None):
+        """Add to a counter and return the new value; ex applies when the counter is created."""
+        now = time.time()
+        current = self._get(key, now)
+        if current is None:
+            value = amount
+            expires_at = now + ex if ex else None
+        else:
+            value = current + amount
+            expires_at = self._data[key][1]
+        self._data[key] = (value, expires_at)
+        return value
+
+    async def delete(self, key):
+        self._data.pop(key, None)
+
+    async def purge_expired(self):
+        """Drop expired keys; returns how many were dropped."""
+        now = time.time()
+        expired = [key for key, (_, expires_at) in self._data.items() if expires_at is not None and expires_at <= now]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    async def close(self):
+        self._data.clear()
+
+    def stats(self):
+        return {"keys": len(self._data)}
+
+
+class SQLiteState:
+    """Backend on a local SQLite file, shared by every worker process on the host.
+
+    The database runs in WAL mode so readers don't block the writer, and
+    every command is one short transaction run in a worker thread. Counters
+    are stored as numbers and everything else as pickles in the same column,
+    so an incrby is a single upsert. The key count for metrics is taken by
+    purge_expired(), so a scrape never queries the database on the event loop.
+    """
+
+    cross_process = True
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._keys = 0
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_state (key TEXT PRIMARY KEY, value, expires_at REAL)"
+        )
+
+    def _run(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _decode(value):
+        return pickle.loads(value) if isinstance(value, bytes) else value
+
+    def _mget(self, keys):
+        placeholders = ",".join("?" * len(keys))
+        rows = self._run(
+            f"SELECT key, value FROM shared_state WHERE key IN ({placeholders})"
+            " AND (expires_at IS NULL OR expires_at > ?)",
+            (*keys, time.time()),
+        )
+        found = {key: self._decode(value) for key, value in rows}
+        return [found.get(key) for key in keys]
+
+    async def get(self, key):
+        return (await self.mget([key]))[0]
+
+    async def mget(self, keys):
+        return await asyncio.to_thread(self._mget, keys)
+
+    async def set(self, key, value, ex=None):
+        """Store a value, for ex seconds if given."""
+        await asyncio.to_thread(
+            self._run,
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, pickle.dumps(value), time.time() + ex if ex else None),
+        )
+
+    async def incrby(self, key, amount=1, ex=None):
+        """Add to a counter and return the new value; ex applies when the counter is created."""
+        now = time.time()
+        rows = await asyncio.to_thread(
+            self._run,
+            "INSERT INTO shared_state (key, value, expires_at) VALUES (?1, ?2, ?3) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "value = CASE WHEN expires_at IS NOT NULL AND expires_at <= ?4 THEN ?2 ELSE value + ?2 END, "
+            "expires_at = CASE WHEN expires_at IS NOT NULL AND expires_at <= ?4 THEN ?3 ELSE expires_at END "
+            "RETURNING value",
+            (key, amount, now + ex if ex else None, now),
+        )
+        return rows[0][0]
+
+    async def delete(self, key):
+        await asyncio.to_thread(self._run, "DELETE FROM shared_state WHERE key = ?", (key,))
+
+    def _purge_expired(self):
+        purged = len(self._run("DELETE FROM shared_state WHERE expires_at <= ? RETURNING key", (time.time(),)))
+        self._keys = self._run("SELECT COUNT(*) FROM shared_state")[0][0]
+        return purged
+
+    async def purge_expired(self):
+        """Drop expired keys; returns how many were dropped."""
+        return await asyncio.to_thread(self._purge_expired)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self):
+        """Key count as of the last purge."""
+        return {"keys": self._keys}
+
+
+def open_shared_state(url=SHARED_STATE_URL):
+    """Backend for a SHARED_STATE_URL: "local" (the default) or "sqlite:///path/to/file"."""
+    if not url or url == "local":
+        return LocalState()
+    if url.startswith("sqlite:///"):
+        return SQLiteState(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+
+async def purge_job(context):
+    """Job callback that drops expired shared keys"""
+    purged = await get_shared_state(context).purge_expired()
+    if purged:
+        logger.debug(f"Purged {purged} expired shared keys")
+
+
+def get_shared_state(context):
+    """Return the application's shared state backend."""
+    return context.bot_data["shared"]
@@ -0,0 +1,187 @@
+"""Daily and hourly /weather forecast subscriptions delivered by the job queue"""
+import datetime
+import logging
+import re
+import zlib
+
+from bot.broadcast import broadcast
+from bot.cache import normalize_query
+from config import WEATHER_SUBSCRIPTION_SPREAD, WEATHER_MAX_SUBSCRIPTIONS
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = "weather_subscriptions"
+HOURLY = "hourly"
+TIME_RE = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
+
+# Hours of forecast in each delivery: the day ahead, or the next few hours for hourly slots
+DAILY_FORECAST_HOURS = 24
+HOURLY_FORECAST_HOURS = 6
+
+
+def parse_slot(text):
+    """Return the slot for "hourly" or a daily "HH:MM" (UTC), or None if it's neither."""
+    text = text.strip().lower()
+    if text == HOURLY:
+        return HOURLY
+    match = TIME_RE.match(text)
+    if not match:
+        return None
+    return f"{int(match.group(1)):02d}:{match.group(2)}"
+
+
+class _CitySubscribers:
+    __slots__ = ("city", "city_id", "chat_ids")
+
+    def __init__(self, city, city_id):
+        self.city = city
+        self.city_id = city_id
+        self.chat_ids = set()
+
+
+class WeatherSubscriptions:
+    """Subscriptions grouped by time slot and city.
+
+    Each slot has one repeating job. When it fires, every city in the slot
+    gets a one-off delivery job at a stable offset within
+    ``spread`` seconds, so a busy slot doesn't hit OpenWeather all at once.
+    A delivery fetches the city's forecast once and sends it to every
+    subscribed chat. Subscriptions are saved through the persistence kv
+    store and rescheduled on startup.
+    """
+
+    def __init__(self, fetch_report, persistence=None, spread=WEATHER_SUBSCRIPTION_SPREAD,
+                 max_per_chat=WEATHER_MAX_SUBSCRIPTIONS):
+        """
+        :param fetch_report: async (city, city_id, hours) -> forecast text for the next hours
+        """
+        self.fetch_report = fetch_report
+        self.persistence = persistence
+        self.spread = spread
+        self.max_per_chat = max_per_chat
+        self.job_queue = None
+        self._slots = {}  # slot -> {city key: _CitySubscribers}
+
+    async def load(self, job_queue, owns_chat=None):
+        """Load saved subscriptions and schedule their slots.
+
+        :param owns_chat: Optional chat_id -> bool; with sharded workers each
+            loads only its own chats' subscriptions, so each is delivered once
+        """
+        self.job_queue = job_queue
+        if self.persistence is not None:
+            for key, (city, city_id) in (await self.persistence.load_namespace(NAMESPACE)).items():
+                chat_id, slot, _ = key.split("|", 2)
+                if owns_chat is None or owns_chat(int(chat_id)):
+                    self._add(int(chat_id), slot, city, city_id)
+        for slot in self._slots:
+            self._schedule(slot)
+
+    @staticmethod
+    def _city_key(city, city_id):
+        return str(city_id) if city_id is not None else normalize_query(city)
+
+    def _add(self, chat_id, slot, city, city_id):
+        key = self._city_key(city, city_id)
+        cities = self._slots.setdefault(slot, {})
+        entry = cities.get(key)
+        if entry is None:
+            entry = cities[key] = _CitySubscribers(city, city_id)
+        entry.chat_ids.add(chat_id)
+        return key
+
+    def _save(self, chat_id, slot, key, value):
+        if self.persistence is not None:
+            self.persistence.stage_kv(NAMESPACE, f"{chat_id}|{slot}|{key}", value)
+
+    def for_chat(self, chat_id):
+        """Return the chat's subscriptions as sorted (slot, city) pairs."""
+        return sorted(
+            (slot, entry.city)
+            for slot, cities in self._slots.items()
+            for entry in cities.values()
+            if chat_id in entry.chat_ids
+        )
+
+    def subscribe(self, chat_id, slot, city, city_id=None):
+        """Subscribe a chat to a city's weather; return False if the chat is at its limit."""
+        if len(self.for_chat(chat_id)) >= self.max_per_chat:
+            return False
+        key = self._add(chat_id, slot, city, city_id)
+        self._save(chat_id, slot, key, (city, city_id))
+        self._schedule(slot)
+        return True
+
+    def unsubscribe(self, chat_id, city, city_id=None):
+        """Remove a chat's subscriptions to a city in every slot; return how many were removed."""
+        key = self._city_key(city, city_id)
+        removed = 0
+        for slot in list(self._slots):
+            cities = self._slots[slot]
+            entry = cities.get(key)
+            if entry is None or chat_id not in entry.chat_ids:
+                continue
+            entry.chat_ids.discard(chat_id)
+            self._save(chat_id, slot, key, None)
+            removed += 1
+            if not entry.chat_ids:
+                del cities[key]
+            if not cities:
+                del self._slots[slot]
+                self._unschedule(slot)
+        return removed
+
+    def _schedule(self, slot):
+        name = f"weather_slot:{slot}"
+        if self.job_queue is None or self.job_queue.get_jobs_by_name(name):
+            return
+        if slot == HOURLY:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            next_hour = now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+            self.job_queue.run_repeating(self._slot_job, interval=3600, first=next_hour, data=slot, name=name)
+        else:
+            hour, minute = map(int, slot.split(":"))
+            at = datetime.time(hour, minute, tzinfo=datetime.timezone.utc)
+            self.job_queue.run_daily(self._slot_job, at, data=slot, name=name)
+
+    def _unschedule(self, slot):
+        if self.job_queue is None:
+            return
+        for job in self.job_queue.get_jobs_by_name(f"weather_slot:{slot}"):
+            job.schedule_removal()
+
+    async def _slot_job(self, context):
+        slot = context.job.data
+        for key in self._slots.get(slot, {}):
+            # Same city, same offset every time: spread out but predictable
+            delay = zlib.crc32(key.encode()) % self.spread if self.spread else 0
+            context.job_queue.run_once(self._deliver_job, delay, data=(slot, key), name=f"weather:{slot}:{key}")
+
+    async def _deliver_job(self, context):
+        slot, key = context.job.data
+        entry = self._slots.get(slot, {}).get(key)
+        if entry is None or not entry.chat_ids:
+            return
+        try:
+            hours = HOURLY_FORECAST_HOURS if slot == HOURLY else DAILY_FORECAST_HOURS
+            text = await self.fetch_report(entry.city, entry.city_id, hours)
+        except Exception as e:
+            logger.error(f"Weather subscription fetch for {entry.city} ({slot}) failed: {e}")
+            return
+
+        results = await broadcast(context.bot, sorted(entry.chat_ids), text)
+        for chat_id, error in results.items():
+            if error:
+                logger.warning(f"Weather subscription for {entry.city} to chat {chat_id} failed: {error}")
+
+    def stats(self):
+        return {
+            "slots": len(self._slots),
+            "cities": sum(len(cities) for cities in self._slots.values()),
+            "subscriptions": sum(len(e.chat_ids) for cities in self._slots.values() for e in cities.values()),
+        }
+
+
+def get_weather_subscriptions(context):
+    """Return the application's WeatherSubscriptions."""
+    return context.bot_data["weather_subscriptions"]
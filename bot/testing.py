@@ -0,0 +1,238 @@
+"""Local stand-ins for Telegram used in tests and benchmarks"""
+import asyncio
+import itertools
+import json
+import time
+
+from telegram.request import BaseRequest
+
+from config import WEBHOOK_PATH
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Leon", "username": "leon_bot"}
+
+_update_ids = itertools.count(1)
+
+
+def make_user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+
+def make_chat(chat_id):
+    return {"id": chat_id, "type": "private" if chat_id > 0 else "group"}
+
+
+def make_message(text, chat_id=1, user_id=1, message_id=1):
+    """Build a Message payload, tagging a leading /command like Telegram does."""
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": make_chat(chat_id),
+        "from": make_user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return message
+
+
+def make_text_update(text, chat_id=1, user_id=1, reply_to_user_id=None):
+    """Build an Update payload for a text message or command, optionally replying to another user."""
+    update_id = next(_update_ids)
+    message = make_message(text, chat_id, user_id, update_id)
+    if reply_to_user_id is not None:
+        message["reply_to_message"] = make_message("...", chat_id, reply_to_user_id, update_id)
+    return {"update_id": update_id, "message": message}
+
+
+def make_callback_update(data, chat_id=1, user_id=1, message_id=1):
+    """Build an Update payload for an inline keyboard button press."""
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": make_user(user_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": make_message("menu", chat_id, BOT_USER["id"], message_id),
+        },
+    }
+
+
+def make_poll_answer_update(poll_id, user_id=1, option_ids=(0,)):
+    """Build an Update payload for an answer to a non-anonymous poll."""
+    return {
+        "update_id": next(_update_ids),
+        "poll_answer": {
+            "poll_id": poll_id,
+            "user": make_user(user_id),
+            "option_ids": list(option_ids),
+            "option_persistent_ids": [str(i) for i in option_ids],
+        },
+    }
+
+
+class FakeBotRequest(BaseRequest):
+    """In-memory Bot API: answers every call locally and records it.
+
+    Pass an instance as ``create_bot(request=...)``. Each call is appended to
+    ``calls`` as ``(method, parameters)`` and each message sent or edited to
+    ``messages``; ``latency`` adds a delay to every
+    call to imitate the network. Payloads in ``pending_updates`` are handed
+    out by the next getUpdates call, so the bot can also be run with polling.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+        self.messages = []
+        self.pending_updates = []
+        self._message_ids = itertools.count(1000)
+        self._floods = {}  # chat_id -> retry_after for the next send to that chat
+        self.bad_media = set()  # URLs the fake Telegram "can't fetch"
+        self.deleted_messages = set()  # Message ids that can no longer be edited
+
+    def flood(self, chat_id, retry_after=1):
+        """Answer the next call for chat_id with a 429 flood-wait error, like Telegram does."""
+        self._floods[chat_id] = retry_after
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((endpoint, params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if endpoint == "getUpdates" and not self.pending_updates:
+            # Stand-in for long polling, so an idle poller doesn't spin
+            await asyncio.sleep(0.01)
+        media = params.get("photo") or params.get("animation")
+        if media in self.bad_media:
+            return 400, json.dumps({
+                "ok": False, "error_code": 400, "description": "Bad Request: failed to get HTTP URL content",
+            }).encode()
+        if endpoint.startswith("edit") and params.get("message_id") in self.deleted_messages:
+            return 400, json.dumps({
+                "ok": False, "error_code": 400, "description": "Bad Request: message to edit not found",
+            }).encode()
+        retry_after = self._floods.pop(params.get("chat_id"), None)
+        if retry_after is not None:
+            return 429, json.dumps({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }).encode()
+        return 200, json.dumps({"ok": True, "result": self.result_for(endpoint, params)}).encode()
+
+    def result_for(self, endpoint, params):
+        """The Bot API result for one call."""
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint == "getUpdates":
+            updates, self.pending_updates = self.pending_updates, []
+            return updates
+        if endpoint.startswith("send") or endpoint.startswith("edit"):
+            message = {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": make_chat(int(params.get("chat_id", 1))),
+                "from": BOT_USER,
+            }
+            if "text" in params:
+                message["text"] = params["text"]
+            if endpoint == "sendPoll":
+                message["poll"] = {
+                    "id": f"poll{message['message_id']}",
+                    "question": params["question"],
+                    "options": [
+                        {
+                            "text": option["text"] if isinstance(option, dict) else option,
+                            "voter_count": 0,
+                            "persistent_id": str(i),
+                        }
+                        for i, option in enumerate(params["options"])
+                    ],
+                    "total_voter_count": 0,
+                    "is_closed": False,
+                    "is_anonymous": params.get("is_anonymous", True),
+                    "type": "regular",
+                    "allows_multiple_answers": False,
+                    "allows_revoting": True,
+                    "members_only": False,
+                }
+            if endpoint == "sendPhoto":
+                file_id = f"photo:{params['photo']}"
+                message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}]
+            elif endpoint == "sendAnimation":
+                file_id = f"animation:{params['animation']}"
+                message["animation"] = {
+                    "file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1, "duration": 1,
+                }
+            self.messages.append(message)
+            return message
+        return True
+
+    def sent(self, endpoint=None):
+        """Parameters of recorded calls, optionally filtered by endpoint."""
+        return [params for name, params in self.calls if endpoint is None or name == endpoint]
+
+
+class FakeTelegram:
+    """Posts updates to a webhook ASGI app the way Telegram's servers do.
+
+    Use as an async context manager to run the app's lifespan around the test.
+    """
+
+    def __init__(self, app, secret=None, path=WEBHOOK_PATH):
+        self.app = app
+        self.secret = secret
+        self.path = path
+        self._lifespan_task = None
+        self._lifespan_in = asyncio.Queue()
+        self._lifespan_out = asyncio.Queue()
+
+    async def __aenter__(self):
+        scope = {"type": "lifespan"}
+        self._lifespan_task = asyncio.create_task(
+            self.app(scope, self._lifespan_in.get, self._lifespan_out.put)
+        )
+        await self._lifespan_in.put({"type": "lifespan.startup"})
+        message = await self._lifespan_out.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(message.get("message", "Webhook app failed to start"))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._lifespan_in.put({"type": "lifespan.shutdown"})
+        await self._lifespan_out.get()
+        await self._lifespan_task
+
+    async def post_update(self, update):
+        """Deliver one Update payload and return the HTTP status code."""
+        headers = [(b"content-type", b"application/json")]
+        if self.secret:
+            headers.append((b"x-telegram-bot-api-secret-token", self.secret.encode()))
+        scope = {"type": "http", "method": "POST", "path": self.path, "headers": headers}
+        body = json.dumps(update).encode()
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        await self.app(scope, receive, send)
+        return sent[0]["status"]
@@ -0,0 +1,285 @@
+"""Opt-in tracing: per-update spans, event-loop stall detection and a sampling profiler.
+
+Everything here is off until enable() is called (TRACE_ENABLED, or SIGUSR1
+at runtime, which toggles it). While off, no trace is created, so span()
+returns a shared no-op, and no monitor or writer thread runs.
+"""
+import collections
+import contextvars
+import json
+import logging
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import traceback
+
+from bot import metrics
+from config import (
+    TRACE_DIR,
+    TRACE_SLOW_UPDATE,
+    TRACE_STALL_THRESHOLD,
+    TRACE_SAMPLE_INTERVAL,
+    TRACE_SNAPSHOT_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Checked on every update; the only cost tracing has while it is off
+active = False
+
+_current = contextvars.ContextVar("trace", default=None)
+_monitor = None
+_writer = None
+
+
+class _Trace:
+    __slots__ = ("update_id", "chat_id", "received", "started", "spans")
+
+    def __init__(self, update_id, chat_id, received):
+        self.update_id = update_id
+        self.chat_id = chat_id
+        self.received = received
+        self.started = None
+        self.spans = []  # (name, detail, offset from start, duration)
+
+
+class _Span:
+    __slots__ = ("trace", "name", "detail", "start")
+
+    def __init__(self, trace, name, detail):
+        self.trace = trace
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        self.trace.spans.append((self.name, self.detail, self.start - self.trace.started, end - self.start))
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, detail=None):
+    """Context manager timing one step (handler, HTTP call, Bot API call) of the current update."""
+    trace = _current.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, detail)
+
+
+async def trace_update(update_id, chat_id, received, coroutine):
+    """Run an update's processing as a trace; received is when it reached the processor."""
+    trace = _Trace(update_id, chat_id, received)
+    token = _current.set(trace)
+    trace.started = time.perf_counter()
+    try:
+        await coroutine
+    finally:
+        _current.reset(token)
+        _finish(trace, time.perf_counter())
+
+
+def _finish(trace, ended):
+    total = ended - trace.started
+    record = {
+        "update_id": trace.update_id,
+        "chat_id": trace.chat_id,
+        "wait_ms": round((trace.started - trace.received) * 1000, 3),
+        "total_ms": round(total * 1000, 3),
+        "spans": [
+            {"name": name, "detail": detail, "at_ms": round(offset * 1000, 3), "ms": round(duration * 1000, 3)}
+            for name, detail, offset, duration in trace.spans
+        ],
+    }
+    if _writer is not None:
+        _writer.write(record)
+    if total >= TRACE_SLOW_UPDATE:
+        steps = ", ".join(
+            f"{s['name']}{'[' + str(s['detail']) + ']' if s['detail'] else ''} {s['ms']:.0f}ms"
+            for s in record["spans"]
+        )
+        logger.warning(
+            f"Slow update {trace.update_id} in chat {trace.chat_id}: {record['total_ms']:.0f}ms "
+            f"after {record['wait_ms']:.0f}ms waiting; {steps or 'no spans'}"
+        )
+
+
+class TraceWriter(threading.Thread):
+    """Append trace records to a JSONL file from a thread, so the loop never waits on the disk.
+
+    Records are handed over through a bounded queue; if the disk can't keep
+    up, records that don't fit are dropped and counted rather than held.
+    """
+
+    def __init__(self, path, max_pending=10000):
+        super().__init__(name="trace-writer", daemon=True)
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+
+    def write(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Write what is queued, then stop the thread."""
+        self._queue.put(None)
+        self.join()
+        if self.dropped:
+            logger.warning(f"Dropped {self.dropped} traces the writer couldn't keep up with")
+
+    def run(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while (record := self._queue.get()) is not None:
+                f.write(json.dumps(record) + "\n")
+                if self._queue.empty():
+                    f.flush()
+
+
+class LoopMonitor(threading.Thread):
+    """Watch the event loop from a thread: report stalls and sample its stack.
+
+    A callback on the loop stamps a heartbeat every tick. If the heartbeat is
+    older than ``stall_threshold``, the loop is blocked, and the loop thread's
+    stack is logged once for that stall. With ``sample_interval`` set, the
+    loop thread's stack is also sampled every tick and the collapsed stacks
+    are written to ``directory`` every ``snapshot_interval`` seconds, in the
+    folded format flame graph tools read.
+    """
+
+    def __init__(self, loop, stall_threshold=TRACE_STALL_THRESHOLD, sample_interval=TRACE_SAMPLE_INTERVAL,
+                 snapshot_interval=TRACE_SNAPSHOT_INTERVAL, directory=TRACE_DIR):
+        super().__init__(name="loop-monitor", daemon=True)
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.stall_threshold = stall_threshold
+        self.sample_interval = sample_interval if snapshot_interval else 0
+        self.snapshot_interval = snapshot_interval
+        self.directory = directory
+        self.tick = min(filter(None, (self.sample_interval, stall_threshold / 2)))
+        self.samples = collections.Counter()
+        self._beat = time.monotonic()
+        self._stalled = False
+        self._beat_handle = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        self._heartbeat()
+        super().start()
+
+    def _heartbeat(self):
+        self._beat = time.monotonic()
+        self._beat_handle = self.loop.call_later(self.tick, self._heartbeat)
+
+    def stop(self):
+        """Stop the thread and write the last profile snapshot (call from the loop thread)."""
+        if self._beat_handle is not None:
+            self._beat_handle.cancel()
+        self._stopping.set()
+        self.join()
+        if self.samples:
+            self.snapshot()
+
+    def run(self):
+        last_snapshot = time.monotonic()
+        while not self._stopping.wait(self.tick):
+            now = time.monotonic()
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            lag = now - self._beat
+            if lag > self.stall_threshold:
+                if not self._stalled:
+                    self._stalled = True
+                    metrics.LOOP_STALLS.labels().inc()
+                    stack = "".join(traceback.format_stack(frame))
+                    logger.warning(f"Event loop blocked for {lag * 1000:.0f}ms at:\n{stack}")
+            else:
+                self._stalled = False
+            if self.sample_interval:
+                self.samples[self._collapse(frame)] += 1
+                if now - last_snapshot >= self.snapshot_interval:
+                    last_snapshot = now
+                    self.snapshot()
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def snapshot(self):
+        """Write the samples collected since the last snapshot and start over."""
+        samples, self.samples = self.samples, collections.Counter()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"Wrote {sum(samples.values())} profile samples to {path}")
+        return path
+
+
+def enable(loop):
+    """Start tracing updates and monitoring the loop (call from the loop thread)."""
+    global active, _monitor, _writer
+    if active:
+        return
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    _writer = TraceWriter(os.path.join(TRACE_DIR, f"traces-{os.getpid()}.jsonl"))
+    _writer.start()
+    _monitor = LoopMonitor(loop, directory=TRACE_DIR)
+    _monitor.start()
+    active = True
+    logger.warning(f"Tracing enabled, writing to {TRACE_DIR}")
+
+
+def disable():
+    """Stop tracing; updates already in flight finish their traces."""
+    global active, _monitor, _writer
+    if not active:
+        return
+    active = False
+    _monitor.stop()
+    _monitor = None
+    _writer.close()
+    _writer = None
+    logger.warning("Tracing disabled")
+
+
+def toggle(loop):
+    if active:
+        disable()
+    else:
+        enable(loop)
+
+
+def install_toggle(loop):
+    """Toggle tracing on SIGUSR1, e.g. ``kill -USR1 <pid>``."""
+    try:
+        loop.add_signal_handler(signal.SIGUSR1, toggle, loop)
+    except (NotImplementedError, RuntimeError, AttributeError) as e:
+        # No signals on Windows or off the main thread
+        logger.info(f"Tracing can't be toggled by signal here: {e}")
@@ -0,0 +1,144 @@
+"""Webhook server mode: an ASGI endpoint that feeds Telegram updates to the bot"""
+import asyncio
+import hmac
+import json
+import logging
+
+from telegram import Update
+
+from config import WEBHOOK_MAX_BODY, WEBHOOK_PATH, WEBHOOK_SECRET
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = b"x-telegram-bot-api-secret-token"
+
+
+async def start_application(application):
+    """Initialize and start an application without an Updater, mirroring run_polling"""
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+
+async def stop_application(application):
+    """Stop and shut down an application started with start_application"""
+    if application.running:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+class WebhookApp:
+    """ASGI application that receives Telegram updates.
+
+    Each POST to the webhook path must carry the secret token and a body of
+    at most ``max_body`` bytes; it is decoded and put on the application's update queue; the response is sent
+    right away and the update is processed in the background. When the queue
+    is full the endpoint answers 503 and Telegram delivers the update again. The ASGI
+    lifespan starts and stops the bot. Run it in a single worker process:
+    separate workers would each hold their own conversations and per-chat
+    state, with deliveries landing on whichever worker is free.
+    """
+
+    def __init__(self, application_factory, secret=WEBHOOK_SECRET, path=WEBHOOK_PATH, max_body=WEBHOOK_MAX_BODY):
+        if not secret:
+            # Without it anyone who finds the URL can post forged updates
+            raise ValueError("The webhook needs a secret token (WEBHOOK_SECRET)")
+        self.application_factory = application_factory
+        self.secret = secret.encode()
+        self.path = path
+        self.max_body = max_body
+        self.application = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            status, body = await self._handle(scope, receive)
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"text/plain")],
+            })
+            await send({"type": "http.response.body", "body": body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    self.application = self.application_factory()
+                    await start_application(self.application)
+                except Exception as e:
+                    logger.critical(f"Webhook worker failed to start: {e}", exc_info=True)
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.application:
+                    await stop_application(self.application)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _handle(self, scope, receive):
+        """Queue one webhook delivery and return the (status, body) to answer with."""
+        if scope["path"] == "/healthz":
+            return 200, b""
+        if scope["path"] != self.path:
+            return 404, b""
+        if scope["method"] != "POST":
+            return 405, b""
+
+        headers = dict(scope["headers"])
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, b""), self.secret):
+            return 403, b""
+        length = headers.get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_body:
+            return 413, b""
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            if len(body) > self.max_body:
+                return 413, b""
+            more_body = message.get("more_body", False)
+
+        if self.application is None or not self.application.running:
+            return 503, b""
+
+        try:
+            payload = json.loads(body)
+            if not isinstance(payload, dict):
+                raise TypeError(f"expected an object, got {type(payload).__name__}")
+            update = Update.de_json(payload, self.application.bot)
+        except Exception as e:
+            logger.warning(f"Rejected malformed webhook payload: {e!r}")
+            return 400, b""
+
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Backpressure: Telegram redelivers updates that weren't acknowledged
+            return 503, b""
+        return 200, b""
+
+
+async def register_webhook(bot, url, secret=WEBHOOK_SECRET):
+    """Point Telegram at the webhook URL. Called once, not per worker."""
+    async with bot:
+        await bot.set_webhook(url=url, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+
+
+def create_app():
+    """ASGI factory for servers, e.g. ``uvicorn --factory bot.webhook:create_app``"""
+    from bot import create_bot
+    from bot.logger import setup_logging
+
+    setup_logging()
+    return WebhookApp(create_bot)
@@ -0,0 +1,178 @@
+"""Sharded polling: one process fetches updates, N worker processes each own a share of the chats"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import zlib
+
+from telegram import Bot, Update
+from telegram.error import NetworkError, TelegramError
+
+from bot.concurrency import ordering_key
+from bot.polls import poll_chat_key
+from bot.shared import open_shared_state
+from config import BOT_WORKERS, BOT_WORKER_INDEX, LOG_FILE, TELEGRAM_TOKEN, UPDATE_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Seconds Telegram holds a getUpdates call open when there is nothing to return
+LONG_POLL_TIMEOUT = 10
+# Seconds a hand-off waits on a full worker queue before checking the worker is still alive
+HAND_OFF_TIMEOUT = 1
+
+
+def shard_for(key, workers):
+    """The worker index for an ordering key; stable across processes and restarts."""
+    if workers <= 1 or key is None:
+        return 0
+    if isinstance(key, tuple):
+        key = key[-1]
+    return zlib.crc32(str(key).encode()) % workers
+
+
+def owns_chat(chat_id, workers=BOT_WORKERS, index=BOT_WORKER_INDEX):
+    """Whether this process handles the chat; always true without sharding."""
+    return shard_for(chat_id, workers) == index
+
+
+async def route(update, workers, state):
+    """Pick the worker for an update: by chat, and for poll answers by the poll's chat."""
+    key = ordering_key(update)
+    if update.poll_answer is not None:
+        # Answers carry no chat, but the tally lives with the chat the poll was sent to
+        chat_id = await state.get(poll_chat_key(update.poll_answer.poll_id))
+        if chat_id is not None:
+            key = chat_id
+    return shard_for(key, workers)
+
+
+def _serve_worker(index, updates):
+    """Worker process entry point: run the bot on the updates the parent hands this shard."""
+    # Ctrl+C reaches the whole process group; the parent stops workers with a sentinel instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from bot import create_bot
+    from bot.logger import setup_logging
+    from bot.webhook import start_application, stop_application
+
+    # Each worker writes its own log file so rotation doesn't race
+    setup_logging(path=f"{LOG_FILE}.{index}")
+
+    async def serve(application):
+        await start_application(application)
+        logger.info(f"Worker {index} (pid {os.getpid()}) started")
+        try:
+            while True:
+                data = await asyncio.to_thread(updates.get)
+                if data is None:
+                    break
+                await application.update_queue.put(Update.de_json(data, application.bot))
+        finally:
+            await stop_application(application)
+
+    asyncio.run(serve(create_bot()))
+
+
+class ShardedPoller:
+    """Fetch updates with getUpdates and hand each to the worker process that owns its chat.
+
+    Updates of one chat always go to the same worker (see shard_for), so its
+    conversations, drafts and per-chat state stay in one process and keep
+    their order. Worker queues are bounded: when a worker falls behind, the
+    poller stops fetching, which is the same backpressure the single-process
+    Updater gets from the update queue. A worker that dies is restarted on
+    the same queue.
+
+    user_data is keyed by user, not chat, so a user active in chats on two
+    workers has a copy in each. Persistence only writes a copy that changed,
+    so a worker that merely sees the user doesn't overwrite the other's, but
+    concurrent changes on both (a /poll draft started in each) keep only the
+    last one written.
+    """
+
+    def __init__(self, workers=BOT_WORKERS, bot=None, target=_serve_worker, queue_size=UPDATE_QUEUE_SIZE):
+        self.workers = workers
+        self.bot = bot or Bot(TELEGRAM_TOKEN)
+        self.target = target
+        self.state = open_shared_state()
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._processes = [None] * workers
+        if workers > 1 and not self.state.cross_process:
+            logger.warning("BOT_WORKERS > 1 with in-process shared state: workers won't share caches or quotas")
+
+    def _start_worker(self, index):
+        # The child reads its index from the environment when config is imported
+        os.environ["BOT_WORKER_INDEX"] = str(index)
+        process = self._context.Process(
+            target=self.target, args=(index, self._queues[index]), name=f"bot-worker-{index}", daemon=False
+        )
+        process.start()
+        self._processes[index] = process
+
+    def _check_workers(self):
+        for index, process in enumerate(self._processes):
+            if not process.is_alive():
+                logger.error(f"Worker {index} exited with code {process.exitcode}, restarting it")
+                self._start_worker(index)
+
+    async def _hand_off(self, index, data):
+        try:
+            self._queues[index].put_nowait(data)
+        except queue.Full:
+            # Wait for the worker to catch up, without blocking the event loop. A worker
+            # that died never will, so restart it between attempts rather than wait forever.
+            while True:
+                try:
+                    await asyncio.to_thread(self._queues[index].put, data, timeout=HAND_OFF_TIMEOUT)
+                    return
+                except queue.Full:
+                    self._check_workers()
+
+    async def run(self):
+        for index in range(self.workers):
+            self._start_worker(index)
+        offset = None
+        try:
+            async with self.bot:
+                # getUpdates and a webhook can't be used together
+                await self.bot.delete_webhook()
+                while True:
+                    try:
+                        updates = await self.bot.get_updates(
+                            offset=offset, timeout=LONG_POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES
+                        )
+                    except NetworkError as e:
+                        logger.warning(f"getUpdates failed ({e}), retrying")
+                        await asyncio.sleep(1)
+                        continue
+                    for update in updates:
+                        offset = update.update_id + 1
+                        index = await route(update, self.workers, self.state)
+                        await self._hand_off(index, update.to_dict())
+                    self._check_workers()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """Tell every worker to finish its updates and shut down, then wait for them."""
+        for index, process in enumerate(self._processes):
+            if process is not None and process.is_alive():
+                await self._hand_off(index, None)
+        for process in self._processes:
+            if process is not None:
+                await asyncio.to_thread(process.join)
+        await self.state.close()
+
+
+def run_sharded(workers=BOT_WORKERS):
+    """Run the bot as a polling process feeding ``workers`` worker processes"""
+    try:
+        asyncio.run(ShardedPoller(workers).run())
+    except KeyboardInterrupt:
+        logger.info("Sharded poller stopped")
+    except TelegramError as e:
+        logger.critical(f"Sharded poller failed: {e}")
+        raise
@@ -5,20 +5,162 @@ import os
 load_dotenv()
 
 # Bot Configuration
-TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")  # Changed to match .env variable
+# TELEGRAM_BOT_TOKEN is the older name, still accepted
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN") or os.getenv("TELEGRAM_BOT_TOKEN")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-GOOGLE_SEARCH_ENGINE_ID = os.getenv("GOOGLE_SEARCH_ENGINE_ID")
+GOOGLE_SEARCH_ENGINE_ID = os.getenv("GOOGLE_SEARCH_ENGINE_ID", "f67799191a4754602")
 WEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
 
-# Validate environment variables
-if not TELEGRAM_TOKEN:
-    raise ValueError("TELEGRAM_TOKEN environment variable is not set.")
-if not WEATHER_API_KEY:
-    raise ValueError("OPENWEATHER_API_KEY environment variable is not set.")
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY environment variable is not set.")
-if not GOOGLE_SEARCH_ENGINE_ID:
-    raise ValueError("GOOGLE_SEARCH_ENGINE_ID environment variable is not set.")
+# Logging
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN")  # e.g. "midnight" to rotate by time instead of size
+LOG_MESSAGE_SAMPLE_RATE = float(os.getenv("LOG_MESSAGE_SAMPLE_RATE", "0.1"))  # Fraction of messages logged
+
+# Update delivery: "polling" or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Public base URL Telegram posts to, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Required: 1-256 of A-Z, a-z, 0-9, _ and -
+WEBHOOK_MAX_BODY = int(os.getenv("WEBHOOK_MAX_BODY", str(1024 * 1024)))  # Bytes; larger deliveries get 413
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))  # Served by one process; scale out with sharded polling
+
+# Sharded polling: one process fetches updates and hands each chat to the same one of
+# BOT_WORKERS worker processes. Workers share counters and caches through SHARED_STATE_URL:
+# "local" (in-process, for one worker) or "sqlite:///path" (every process on the host).
+# Sharding is by chat, so per-user data (the /poll draft) isn't kept in sync between
+# workers: a user building polls in chats on two workers at once keeps the last one saved.
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+BOT_WORKER_INDEX = int(os.getenv("BOT_WORKER_INDEX", "0"))  # Set for each worker by the parent
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "local")
+SHARED_STATE_PURGE_INTERVAL = float(os.getenv("SHARED_STATE_PURGE_INTERVAL", "60"))  # Seconds between expiry sweeps
+
+# Update processing: chats run in parallel, each chat's updates in order
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))  # Handlers running at once
+UPDATE_MAX_IN_FLIGHT = int(os.getenv("UPDATE_MAX_IN_FLIGHT", "256"))  # Running or next in line in their chat
+UPDATE_MAX_PER_CHAT = int(os.getenv("UPDATE_MAX_PER_CHAT", "20"))  # Waiting in one chat before more are dropped
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1024"))  # Queued before producers are pushed back
+
+# Metrics endpoint, separate from the webhook listener; 0 disables it
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_READ_TIMEOUT = float(os.getenv("METRICS_READ_TIMEOUT", "5"))  # Seconds a scraper gets to send its request
+
+# Opt-in tracing (bot/tracing.py); toggle at runtime with SIGUSR1
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "").lower() in ("1", "true", "yes")
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")  # Update traces and profile snapshots
+TRACE_SLOW_UPDATE = float(os.getenv("TRACE_SLOW_UPDATE", "1"))  # Seconds; slower updates are logged with their spans
+TRACE_STALL_THRESHOLD = float(os.getenv("TRACE_STALL_THRESHOLD", "0.25"))  # Seconds the loop may block unreported
+TRACE_SAMPLE_INTERVAL = float(os.getenv("TRACE_SAMPLE_INTERVAL", "0.01"))  # Seconds between stack samples
+TRACE_SNAPSHOT_INTERVAL = float(os.getenv("TRACE_SNAPSHOT_INTERVAL", "60"))  # Seconds between profiles; 0 disables
+
+# Outbound HTTP client
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))  # Seconds per request
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "10"))  # Concurrent requests per host
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))  # Base retry delay in seconds
+HTTP_MAX_RETRY_AFTER = float(os.getenv("HTTP_MAX_RETRY_AFTER", "10"))  # Longer Retry-After fails the request
+
+# Per-upstream circuit breakers
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))  # Recent calls considered
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))  # Calls needed before the breaker can trip
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))  # Failed or slow share that trips it
+BREAKER_SLOW_CALL = float(os.getenv("BREAKER_SLOW_CALL", "3"))  # Seconds; slower calls count as failures
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))  # Fail fast this long before probing
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1"))  # Concurrent probe requests
+
+# Persistence
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///bot_data.sqlite3")
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "10"))  # Seconds between snapshots
+PERSISTENCE_WRITE_DELAY = float(os.getenv("PERSISTENCE_WRITE_DELAY", "0.5"))  # Seconds to batch writes
+PERSISTENCE_RETRY_DELAY = float(os.getenv("PERSISTENCE_RETRY_DELAY", "5"))  # Seconds before failed rows are retried
+PERSISTENCE_MAX_ATTEMPTS = int(os.getenv("PERSISTENCE_MAX_ATTEMPTS", "5"))  # Failed writes before a row is dropped
+PERSISTENCE_BUSY_TIMEOUT = float(os.getenv("PERSISTENCE_BUSY_TIMEOUT", "30"))  # Seconds SQLite waits for a lock
+
+# Outbound send limits (Telegram allows ~30 msg/s overall, 1/s per private chat, 20/min per group)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_PRIVATE_RATE = float(os.getenv("SEND_PRIVATE_RATE", "1"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))
+SEND_GROUP_BURST = int(os.getenv("SEND_GROUP_BURST", "3"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))  # Retries after a RetryAfter error
+
+# /alert broadcasts: comma-separated chat ids, falling back to the single GROUP_CHAT_ID
+ALERT_CHAT_IDS = [
+    int(chat_id) for chat_id in (os.getenv("ALERT_CHAT_IDS") or os.getenv("GROUP_CHAT_ID") or "").split(",")
+    if chat_id.strip()
+]
+FRIEND_USERNAME = os.getenv("FRIEND_USERNAME")
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+
+# Response cache
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+WEATHER_CACHE_TTL = int(os.getenv("WEATHER_CACHE_TTL", "600"))  # 10 minutes
+IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL", "21600"))  # 6 hours
+# Last good upstream responses, served while an upstream is failing
+STALE_MAX_ENTRIES = int(os.getenv("STALE_MAX_ENTRIES", "2000"))
+STALE_MAX_AGE = int(os.getenv("STALE_MAX_AGE", str(24 * 3600)))  # Older responses aren't served
+
+# /weather
+CITY_INDEX_PATH = os.getenv("CITY_INDEX_PATH", "data/city_index.tsv")  # Built by scripts/build_city_index.py
+WEATHER_MAX_CITIES = int(os.getenv("WEATHER_MAX_CITIES", "5"))  # Cities per /weather command
+WEATHER_SUBSCRIPTION_SPREAD = int(os.getenv("WEATHER_SUBSCRIPTION_SPREAD", "300"))  # Seconds to spread a slot over
+WEATHER_MAX_SUBSCRIPTIONS = int(os.getenv("WEATHER_MAX_SUBSCRIPTIONS", "10"))  # Per chat
+WEATHER_STALE_AFTER = int(os.getenv("WEATHER_STALE_AFTER", "3600"))  # Older observations show their time
+
+# Image/GIF result pools
+IMAGE_PAGE_SIZE = int(os.getenv("IMAGE_PAGE_SIZE", "10"))  # Results per Custom Search call (max 10)
+IMAGE_POOL_LOW_WATER = int(os.getenv("IMAGE_POOL_LOW_WATER", "2"))  # Prefetch when this few are left
+IMAGE_POOL_TTL = int(os.getenv("IMAGE_POOL_TTL", "3600"))
+IMAGE_POOL_MAX = int(os.getenv("IMAGE_POOL_MAX", "1000"))  # Queries kept
+
+# Telegram file_id cache for media already sent
+MEDIA_CACHE_MAX = int(os.getenv("MEDIA_CACHE_MAX", "10000"))
+MEDIA_SEND_ATTEMPTS = int(os.getenv("MEDIA_SEND_ATTEMPTS", "3"))  # Results tried when a URL fails
+
+# /poll drafts
+POLL_TIMEOUT = float(os.getenv("POLL_TIMEOUT", "900"))  # Seconds of silence before a /poll conversation ends
+POLL_DRAFT_TTL = float(os.getenv("POLL_DRAFT_TTL", "1800"))  # Drafts untouched this long are swept
+POLL_SWEEP_INTERVAL = float(os.getenv("POLL_SWEEP_INTERVAL", "300"))
+POLL_RESULTS_DEBOUNCE = float(os.getenv("POLL_RESULTS_DEBOUNCE", "3"))  # Seconds between live results edits
+POLL_TALLY_FLUSH_INTERVAL = float(os.getenv("POLL_TALLY_FLUSH_INTERVAL", "10"))  # Seconds between tally saves
+POLL_TALLY_TTL = float(os.getenv("POLL_TALLY_TTL", str(7 * 24 * 3600)))  # Polls stop counting after this
+
+# Karma
+KARMA_GIVE_LIMIT = int(os.getenv("KARMA_GIVE_LIMIT", "5"))  # Gives allowed per user per window
+KARMA_GIVE_WINDOW = float(os.getenv("KARMA_GIVE_WINDOW", "60"))  # Seconds
+
+# Admission control for commands that call paid or rate-limited upstreams.
+# Costs are "command=cost" pairs; each limit is total cost per window, 0 disables it.
+ADMISSION_COSTS = {
+    command.strip(): int(cost)
+    for command, _, cost in (
+        pair.partition("=") for pair in os.getenv("ADMISSION_COSTS", "image=3,gif=3,weather=1,alert=5").split(",")
+    )
+    if command.strip()
+}
+ADMISSION_WINDOW = float(os.getenv("ADMISSION_WINDOW", "60"))  # Seconds
+ADMISSION_USER_LIMIT = int(os.getenv("ADMISSION_USER_LIMIT", "10"))
+ADMISSION_CHAT_LIMIT = int(os.getenv("ADMISSION_CHAT_LIMIT", "30"))
+ADMISSION_COMMAND_LIMIT = int(os.getenv("ADMISSION_COMMAND_LIMIT", "300"))  # Across all users
+ADMISSION_NOTICE_INTERVAL = float(os.getenv("ADMISSION_NOTICE_INTERVAL", "30"))  # Seconds between "slow down" replies per user
+ADMISSION_COMPACT_INTERVAL = float(os.getenv("ADMISSION_COMPACT_INTERVAL", "60"))
+ADMISSION_REJECT_MESSAGE = "⏳ You're sending that too often. Please wait a bit and try again."
+
+# Chat response packs (bot/packs/*.json or .yaml), reloaded when they change
+PACKS_DIR = os.getenv("PACKS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot", "packs"))
+PACKS_RELOAD_INTERVAL = float(os.getenv("PACKS_RELOAD_INTERVAL", "5"))  # Seconds between checks; 0 disables
+
+# /calc limits
+CALC_MAX_LENGTH = int(os.getenv("CALC_MAX_LENGTH", "200"))  # Characters
+CALC_MAX_DIGITS = int(os.getenv("CALC_MAX_DIGITS", "1000"))  # Largest integer anywhere in an evaluation
+CALC_MAX_STEPS = int(os.getenv("CALC_MAX_STEPS", "1000"))  # Operations per evaluation
+CALC_TIMEOUT = float(os.getenv("CALC_TIMEOUT", "2"))  # Seconds, for expressions sent to the worker pool
+CALC_WORKERS = int(os.getenv("CALC_WORKERS", "2"))
+CALC_CACHE_SIZE = int(os.getenv("CALC_CACHE_SIZE", "1024"))  # Compiled expressions kept
 
 # Command descriptions
 COMMANDS = [
@@ -29,7 +171,7 @@ COMMANDS = [
     ('roll', 'Roll a dice (1-6)'),
     ('fact', 'Get a random interesting fact'),
     ('calc', 'Calculate a math expression (e.g., /calc 2+2)'),
-    ('weather', 'Get weather for a city (e.g., /weather London)'),
+    ('weather', 'Get weather for cities (e.g., /weather London, GB, Paris) or subscribe to its forecast (/weather subscribe London 08:00)'),
     ('poll', 'Create a poll (e.g., /poll Question Option1 Option2 [Option3...])'),
     ('gif', 'Search and send a GIF (e.g., /gif cat)'),
     ('image', 'Search and send an image (e.g., /image nature)'),
@@ -54,4 +196,34 @@ You can also send me any message and I'll chat with you!
 
 ERROR_MESSAGE = "Sorry, I encountered an error processing your request. Please try again."
 INVALID_EXPRESSION = "Sorry, I couldn't understand that expression. Please use simple math operations (e.g., /calc 2+2)"
-WEATHER_USAGE = "Please provide a city name (e.g., /weather London)"
\ No newline at end of file
+WEATHER_USAGE = "Please provide a city name (e.g., /weather London)"
+WEATHER_UNAVAILABLE = "Sorry, weather for {city} is unavailable right now. Please try again in a few minutes."
+SEARCH_UNAVAILABLE = "Sorry, search is unavailable right now. Please try again in a few minutes."
+
+
+def validate():
+    """Check that the required settings are present.
+
+    Called once when the bot starts rather than on import, so tools and
+    benchmarks can import the package without a full environment.
+    """
+    required = {
+        "TELEGRAM_TOKEN": TELEGRAM_TOKEN,
+        "OPENWEATHER_API_KEY": WEATHER_API_KEY,
+        "GOOGLE_API_KEY": GOOGLE_API_KEY,
+        "GOOGLE_SEARCH_ENGINE_ID": GOOGLE_SEARCH_ENGINE_ID,
+    }
+    if BOT_MODE == "webhook":
+        required["WEBHOOK_URL"] = WEBHOOK_URL
+        required["WEBHOOK_SECRET"] = WEBHOOK_SECRET
+    missing = [name for name, value in required.items() if not value]
+    if missing:
+        raise ValueError(f"Missing required environment variables: {', '.join(missing)}")
+    if BOT_WORKERS > 1 and BOT_MODE == "webhook":
+        raise ValueError("BOT_WORKERS applies to polling mode only")
+    if TRACE_STALL_THRESHOLD <= 0:
+        raise ValueError("TRACE_STALL_THRESHOLD must be positive")
+    if TRACE_SAMPLE_INTERVAL < 0 or TRACE_SNAPSHOT_INTERVAL < 0:
+        raise ValueError("TRACE_SAMPLE_INTERVAL and TRACE_SNAPSHOT_INTERVAL can't be negative")
+    if BOT_WORKERS > 1 and SHARED_STATE_URL in ("", "local"):
+        raise ValueError("BOT_WORKERS > 1 needs a SHARED_STATE_URL every worker can reach, e.g. sqlite:///path")
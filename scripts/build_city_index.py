@@ -0,0 +1,56 @@
+"""Build the /weather city index from OpenWeather's city list.
+
+Download http://bulk.openweathermap.org/sample/city.list.json.gz and run:
+
+    python scripts/build_city_index.py city.list.json.gz data/city_index.tsv --prefer GB,US
+
+The output has one line per city, sorted for binary search:
+``key<TAB>id<TAB>name<TAB>country``. Cities that share a name are all kept,
+ordered by the earliest country in --prefer, then by position in the list;
+the first is used when a user doesn't give a country code.
+"""
+import argparse
+import gzip
+import json
+
+
+def normalize(name):
+    # Must match bot.cache.normalize_query
+    return " ".join(name.lower().split())
+
+
+def build(cities, prefer=()):
+    rank = {country: i for i, country in enumerate(prefer)}
+    entries = {}
+    for position, city in enumerate(cities):
+        name = city["name"].replace("\t", " ").strip()
+        key = normalize(name)
+        if not key or city["id"] in entries:
+            continue
+        country = city.get("country", "")
+        entries[city["id"]] = ((key.encode(), rank.get(country, len(rank)), position), name, country)
+    ordered = sorted(entries.items(), key=lambda item: item[1][0])
+    return [f"{sort_key[0].decode()}\t{city_id}\t{name}\t{country}"
+            for city_id, (sort_key, name, country) in ordered]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="city.list.json or city.list.json.gz")
+    parser.add_argument("output", help="index file to write")
+    parser.add_argument("--prefer", default="", help="comma-separated country codes to list first for shared names")
+    args = parser.parse_args()
+
+    opener = gzip.open if args.source.endswith(".gz") else open
+    with opener(args.source, "rt", encoding="utf-8") as f:
+        cities = json.load(f)
+
+    prefer = [country.strip().upper() for country in args.prefer.split(",") if country.strip()]
+    lines = build(cities, prefer)
+    with open(args.output, "w", encoding="utf-8", newline="\n") as f:
+        f.write("\n".join(lines) + "\n")
+    print(f"Wrote {len(lines)} cities to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
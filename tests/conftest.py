@@ -0,0 +1,55 @@
+"""Shared fixtures: a bot wired to the in-memory Telegram from bot.testing"""
+import asyncio
+import os
+import tempfile
+
+# Placeholder settings so config imports without a real .env
+DATA_DIR = tempfile.mkdtemp(prefix="bot-tests-")
+DATABASE_PATH = os.path.join(DATA_DIR, "bot.sqlite3")
+os.environ.update({
+    "TELEGRAM_TOKEN": "123456:test",
+    "OPENWEATHER_API_KEY": "test",
+    "GOOGLE_API_KEY": "test",
+    "GOOGLE_SEARCH_ENGINE_ID": "test",
+    "DATABASE_URL": f"sqlite:///{DATABASE_PATH}",
+    "METRICS_PORT": "0",
+    "LOG_LEVEL": "WARNING",
+    "PERSISTENCE_WRITE_DELAY": "0",
+    "SEND_GLOBAL_RATE": "1000000",
+    "SEND_PRIVATE_RATE": "1000000",
+    "SEND_GROUP_RATE": "1000000",
+})
+
+import pytest  # noqa: E402
+
+from bot import create_bot  # noqa: E402
+from bot.testing import FakeBotRequest  # noqa: E402
+
+
+@pytest.fixture
+def bot_api():
+    return FakeBotRequest()
+
+
+@pytest.fixture
+def make_bot(bot_api):
+    """Build applications on a fresh database; call again to restart on the same one."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DATABASE_PATH + suffix):
+            os.remove(DATABASE_PATH + suffix)
+
+    def make():
+        return create_bot(request=bot_api)
+    return make
+
+
+@pytest.fixture
+def wait_for():
+    """Async helper: wait until condition() is true, failing the test after timeout seconds."""
+    async def wait(condition, timeout=2.0):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not condition():
+            if asyncio.get_running_loop().time() > deadline:
+                raise AssertionError("condition not met in time")
+            await asyncio.sleep(0.01)
+    return wait
@@ -0,0 +1,76 @@
+import asyncio
+
+from telegram import Update
+
+from bot.admission import AdmissionControl
+from bot.shared import LocalState, SQLiteState
+from bot.testing import make_text_update
+from bot.webhook import start_application, stop_application
+
+COSTS = {"image": 1}
+
+
+def test_quotas_are_approximated_over_a_sliding_window():
+    admission = AdmissionControl(LocalState(), COSTS, window=60, user_limit=2, chat_limit=0, command_limit=0)
+
+    async def main():
+        assert await admission.admit("image", 1, 1, now=60)
+        assert await admission.admit("image", 1, 1, now=61)
+        assert not await admission.admit("image", 1, 1, now=62)
+        assert await admission.admit("image", 2, 1, now=62)
+        assert await admission.admit("help", 1, 1, now=62)
+        # Most of the last window still overlaps
+        assert not await admission.admit("image", 1, 1, now=130)
+        assert await admission.admit("image", 1, 1, now=175)
+
+    asyncio.run(main())
+
+
+def test_a_rejected_call_is_not_charged():
+    state = LocalState()
+    admission = AdmissionControl(state, COSTS, window=60, user_limit=5, chat_limit=1, command_limit=0)
+
+    async def main():
+        assert await admission.admit("image", 1, 1, now=0)
+        assert not await admission.admit("image", 1, 1, now=1)
+        return await state.mget(["admission:user:1:0", "admission:chat:1:0"])
+
+    assert asyncio.run(main()) == [1, 1]
+
+
+def test_concurrent_calls_cannot_share_the_last_slot(tmp_path):
+    state = SQLiteState(str(tmp_path / "state.sqlite3"))
+    # Two workers' worth of AdmissionControl on the same backend
+    admissions = [AdmissionControl(state, COSTS, user_limit=2, chat_limit=0, command_limit=0) for _ in range(2)]
+
+    async def main():
+        return await asyncio.gather(*(admissions[i % 2].admit("image", 1, 1) for i in range(6)))
+
+    assert sum(asyncio.run(main())) == 2
+
+
+def test_edits_and_other_bots_commands_are_not_charged(make_bot, bot_api):
+    charged = []
+
+    async def main():
+        application = make_bot()
+
+        async def admit(command, user_id, chat_id):
+            charged.append(command)
+            return True
+
+        application.bot_data["admission"].admit = admit
+        await start_application(application)
+        try:
+            updates = [make_text_update("/image@other_bot cats", chat_id=-100), make_text_update("/image cats")]
+            updates[1]["edited_message"] = updates[1].pop("message")
+            updates[1]["edited_message"]["edit_date"] = updates[1]["edited_message"]["date"]
+            updates.append(make_text_update("/help@Leon_bot", chat_id=-100))
+            for update in updates:
+                await application.process_update(Update.de_json(update, application.bot))
+        finally:
+            await stop_application(application)
+
+    asyncio.run(main())
+    assert charged == ["help"]
+    assert [params["chat_id"] for params in bot_api.sent("sendMessage")] == [-100]
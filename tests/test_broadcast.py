@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+from telegram import Update
+from telegram.ext import ExtBot
+
+from bot import handlers
+from bot.broadcast import broadcast
+from bot.sender import PRIORITY_BROADCAST, SendScheduler
+from bot.testing import FakeBotRequest, make_text_update
+from bot.webhook import start_application, stop_application
+
+
+def make_bot_for(bot_api):
+    # No flood-wait retries, so a 429 shows up as a failed chat
+    return ExtBot("123456:test", request=bot_api, get_updates_request=bot_api, rate_limiter=SendScheduler(max_retries=0))
+
+
+def test_broadcast_reports_each_chat():
+    bot_api = FakeBotRequest()
+    bot_api.flood(-2)
+
+    async def main():
+        async with make_bot_for(bot_api) as bot:
+            return await broadcast(bot, [-1, -2, -3], "Heads up")
+
+    results = asyncio.run(main())
+    assert results[-1] is None and results[-3] is None
+    assert results[-2].startswith("Flood control exceeded")
+    sent = bot_api.sent("sendMessage")
+    assert {params["chat_id"] for params in sent} == {-1, -2, -3}
+    assert all(params["text"] == "Heads up" for params in sent)
+
+
+def test_broadcast_bounds_parallel_sends():
+    bot_api = FakeBotRequest(latency=0.05)
+
+    async def main():
+        async with make_bot_for(bot_api) as bot:
+            start = time.monotonic()
+            await broadcast(bot, list(range(-1, -7, -1)), "Heads up", concurrency=2)
+            return time.monotonic() - start
+
+    # Six sends two at a time take three round trips
+    assert asyncio.run(main()) >= 0.15
+
+
+def test_alert_is_broadcast_in_the_background(make_bot, bot_api, wait_for, monkeypatch):
+    monkeypatch.setattr(handlers, "ALERT_CHAT_IDS", [-1, -2])
+    sends = []
+
+    async def main():
+        application = make_bot()
+        process_request = application.bot.rate_limiter.process_request
+
+        async def record_priority(callback, args, kwargs, endpoint, data, rate_limit_args):
+            sends.append((data.get("chat_id"), (rate_limit_args or {}).get("priority")))
+            return await process_request(callback, args, kwargs, endpoint, data, rate_limit_args)
+
+        application.bot.rate_limiter.process_request = record_priority
+        await start_application(application)
+        try:
+            update = Update.de_json(make_text_update("/alert", chat_id=7), application.bot)
+            await application.process_update(update)
+            assert bot_api.sent("sendMessage")[0]["text"] == "Alert queued!"
+            await wait_for(lambda: len(bot_api.sent("sendMessage")) == 4)
+        finally:
+            await stop_application(application)
+
+    asyncio.run(main())
+    report = bot_api.sent("sendMessage")[-1]
+    assert report["chat_id"] == 7
+    assert report["text"] == "Alert delivered to 2/2 chats."
+    assert (-1, PRIORITY_BROADCAST) in sends and (-2, PRIORITY_BROADCAST) in sends
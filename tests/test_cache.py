@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from bot.cache import ResponseCache, normalize_query
+
+
+def test_normalize_query():
+    assert normalize_query("  New   YORK ") == "new york"
+
+
+def test_concurrent_misses_share_one_fetch():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"temp": 18}
+
+    async def main():
+        cache = ResponseCache()
+        results = await asyncio.gather(*(cache.get_or_fetch("london", 60, fetch) for _ in range(10)))
+        again = await cache.get_or_fetch("london", 60, fetch)
+        return results, again, cache.stats()
+
+    results, again, stats = asyncio.run(main())
+    assert len(calls) == 1
+    assert results == [{"temp": 18}] * 10 and again == {"temp": 18}
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 9, 1)
+
+
+def test_failures_reach_every_waiter_and_are_not_cached():
+    attempts = []
+
+    async def fetch():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        if len(attempts) == 1:
+            raise RuntimeError("upstream down")
+        return "ok"
+
+    async def main():
+        cache = ResponseCache()
+        results = await asyncio.gather(
+            *(cache.get_or_fetch("k", 60, fetch) for _ in range(3)), return_exceptions=True
+        )
+        return results, await cache.get_or_fetch("k", 60, fetch)
+
+    results, retried = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert retried == "ok" and len(attempts) == 2
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("bot.cache.time.monotonic", lambda: now[0])
+    cache = ResponseCache()
+    cache.set("k", "v", ttl=10)
+    assert cache.get("k") == "v"
+    now[0] += 10
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.parametrize("limits", [{"max_entries": 2}, {"max_bytes": 2 * len(repr("x" * 10))}])
+def test_least_recently_used_entries_are_evicted(limits):
+    cache = ResponseCache(**{"max_entries": 100, "max_bytes": 10_000, **limits})
+    cache.set("a", "x" * 10, 60)
+    cache.set("b", "x" * 10, 60)
+    cache.get("a")
+    cache.set("c", "x" * 10, 60)
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from bot.calc import CalcError, calculate, evaluate, shutdown_executor
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("2+2", 4),
+    ("2 × 3 ÷ 4", 1.5),
+    ("-(7 // 2) % 5", 2),
+    ("2**10", 1024),
+    ("sqrt(16) + factorial(5)", 124.0),
+])
+def test_evaluate(text, expected):
+    assert evaluate(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "__import__('os').system('true')",
+    "(1).__class__",
+    "open('x')",
+    "[1, 2]",
+    "lambda: 1",
+    "x + 1",
+    "2 +",
+])
+def test_rejects_anything_but_arithmetic(text):
+    with pytest.raises(CalcError):
+        evaluate(text)
+
+
+@pytest.mark.parametrize("text", [
+    "9**9**9",
+    "10**2000",
+    "factorial(100000)",
+    "1" + "*99999999999" * 200,
+    "1/0",
+    "1" * 300,
+])
+def test_rejects_oversized_work(text):
+    with pytest.raises(CalcError):
+        evaluate(text)
+
+
+def test_calculate_formats_and_offloads_heavy_expressions():
+    async def main():
+        try:
+            return await calculate("1+1"), await calculate("2**0.5"), await calculate("factorial(20)")
+        finally:
+            shutdown_executor()
+
+    assert asyncio.run(main()) == ("2", "1.41421356237", "2432902008176640000")
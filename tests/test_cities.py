@@ -0,0 +1,73 @@
+import asyncio
+import importlib.util
+import pathlib
+from types import SimpleNamespace
+
+from bot.cities import City, CityIndex, split_cities, split_country
+from bot.handlers import resolve_city
+
+SCRIPT = pathlib.Path(__file__).parent.parent / "scripts" / "build_city_index.py"
+spec = importlib.util.spec_from_file_location("build_city_index", SCRIPT)
+build_city_index = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(build_city_index)
+
+CITIES = [
+    {"id": 6058560, "name": "London", "country": "CA"},
+    {"id": 2643743, "name": "London", "country": "GB"},
+    {"id": 4517009, "name": "London", "country": "US"},
+    {"id": 4298960, "name": "London", "country": "US"},
+    {"id": 2988507, "name": "Paris", "country": "FR"},
+    {"id": 2643123, "name": "Londonderry", "country": "GB"},
+    {"id": 1850147, "name": "Tokyo", "country": "JP"},
+]
+
+
+def make_index(tmp_path, cities=CITIES, prefer=("GB",)):
+    path = tmp_path / "city_index.tsv"
+    path.write_text("\n".join(build_city_index.build(cities, prefer)) + "\n", encoding="utf-8")
+    return CityIndex(str(path))
+
+
+def test_country_codes_are_split_off():
+    assert split_country("London, GB") == ("London", "GB")
+    assert split_country("London gb") == ("London", "GB")
+    assert split_country("Rio de Janeiro") == ("Rio de Janeiro", None)
+    assert split_cities("London,GB") == ["London, GB"]
+    assert split_cities("London, gb, Paris, Tokyo JP") == ["London, GB", "Paris", "Tokyo JP"]
+
+
+def test_every_city_with_a_name_is_kept(tmp_path):
+    index = make_index(tmp_path)
+    londons = index.lookup("london")
+    # --prefer orders them, then their position in the source list
+    assert [city.country for city in londons] == ["GB", "CA", "US", "US"]
+    assert index.lookup("London", "us") == [City(4517009, "London", "US"), City(4298960, "London", "US")]
+    assert index.lookup("London", "FR") == []
+    assert index.lookup("Londonderry") == [City(2643123, "Londonderry", "GB")]
+    assert index.lookup("Lond") == []
+    index.close()
+
+
+def resolve(index, text):
+    context = SimpleNamespace(bot_data={"cities": index})
+    return asyncio.run(resolve_city(context, text))
+
+
+def test_qualified_names_pick_the_country(tmp_path):
+    index = make_index(tmp_path)
+    assert resolve(index, "London, CA") == ("London, CA", 6058560, None, None)
+    assert resolve(index, "london us")[:2] == ("London, US", 4517009)
+
+    city, city_id, error, note = resolve(index, "London")
+    assert (city, city_id, error) == ("London, GB", 2643743, None)
+    assert "London in CA, US" in note
+
+    assert resolve(index, "London, FR")[2] == "I don't know a city called London in FR."
+    assert "Did you mean Paris?" in resolve(index, "Pariss")[2]
+    index.close()
+
+
+def test_without_an_index_the_qualifier_goes_to_openweather(tmp_path):
+    index = CityIndex(str(tmp_path / "missing.tsv"))
+    assert resolve(index, "London, GB") == ("London,GB", None, None, None)
+    assert resolve(index, "Paris") == ("Paris", None, None, None)
@@ -0,0 +1,122 @@
+import asyncio
+import random
+
+from telegram import Update
+
+from bot.concurrency import BackpressureQueue, ChatOrderedUpdateProcessor, slot_released
+from bot.testing import make_text_update
+from bot.webhook import start_application, stop_application
+from config import UPDATE_MAX_PER_CHAT
+
+
+def text_update(chat_id):
+    return Update.de_json(make_text_update("hi", chat_id=chat_id), None)
+
+
+def test_updates_in_a_chat_run_in_order():
+    processor = ChatOrderedUpdateProcessor(concurrency=8)
+    seen = []
+
+    async def handle(chat_id, i):
+        await asyncio.sleep(random.random() / 100)
+        seen.append((chat_id, i))
+
+    async def main():
+        await asyncio.gather(*(
+            processor.process_update(text_update(chat_id), handle(chat_id, i))
+            for i in range(10) for chat_id in (1, 2, 3)
+        ))
+
+    asyncio.run(main())
+    for chat_id in (1, 2, 3):
+        assert [i for chat, i in seen if chat == chat_id] == list(range(10))
+    assert not processor.waiting_chats
+
+
+def test_waiting_to_send_frees_the_handler_slot():
+    processor = ChatOrderedUpdateProcessor(concurrency=1)
+    finished = []
+
+    async def rate_limited(chat_id):
+        async with slot_released():
+            await asyncio.sleep(0.2)
+        finished.append(chat_id)
+
+    async def quick(chat_id):
+        finished.append(chat_id)
+
+    async def main():
+        slow = asyncio.ensure_future(processor.process_update(text_update(-42), rate_limited(-42)))
+        await asyncio.sleep(0)
+        await asyncio.wait_for(processor.process_update(text_update(5), quick(5)), 0.1)
+        await slow
+
+    asyncio.run(main())
+    assert finished == [5, -42]
+
+
+def test_overflow_in_one_chat_is_dropped():
+    processor = ChatOrderedUpdateProcessor(concurrency=4, max_per_chat=3)
+    handled = []
+
+    async def handle(chat_id):
+        await asyncio.sleep(0.01)
+        handled.append(chat_id)
+
+    async def main():
+        await asyncio.gather(*(processor.process_update(text_update(-42), handle(-42)) for _ in range(10)))
+        await processor.process_update(text_update(-42), handle(-42))
+
+    asyncio.run(main())
+    # Three waited their turn, the rest were dropped; once it caught up the chat was served again
+    assert handled == [-42] * 4
+
+
+def test_updates_waiting_on_their_chat_are_not_in_flight():
+    queue = BackpressureQueue(max_in_flight=2)
+    processor = ChatOrderedUpdateProcessor(queue, concurrency=4)
+
+    async def main():
+        blocker = asyncio.Event()
+
+        async def handle():
+            await blocker.wait()
+
+        for _ in range(3):
+            queue.put_nowait(text_update(-42))
+        queue.put_nowait(text_update(5))
+        tasks = []
+        for _ in range(3):
+            tasks.append(asyncio.ensure_future(processor.process_update(await queue.get(), handle())))
+            await asyncio.sleep(0)
+        # Only the first -42 update is in flight; the two behind it don't block chat 5
+        assert queue.in_flight == 1
+        update = await asyncio.wait_for(queue.get(), 0.1)
+        assert update.effective_chat.id == 5
+        blocker.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+
+def test_busy_group_does_not_stall_other_chats(make_bot, bot_api, wait_for):
+    async def main():
+        application = make_bot()
+        # Telegram's real group limit, scaled up so the test stays quick
+        application.bot.rate_limiter.group_rate = 20
+        application.bot.rate_limiter.group_burst = 1
+        await start_application(application)
+        try:
+            for _ in range(300):
+                application.update_queue.put_nowait(
+                    Update.de_json(make_text_update("/help", chat_id=-42), application.bot)
+                )
+            application.update_queue.put_nowait(Update.de_json(make_text_update("/help", chat_id=5), application.bot))
+            await wait_for(lambda: any(params["chat_id"] == 5 for params in bot_api.sent("sendMessage")), 1)
+        finally:
+            await stop_application(application)
+
+    asyncio.run(main())
+    group_replies = [params for params in bot_api.sent("sendMessage") if params["chat_id"] == -42]
+    # The rest of the burst was dropped rather than queued behind the rate limit
+    assert len(group_replies) <= UPDATE_MAX_PER_CHAT
@@ -0,0 +1,65 @@
+import asyncio
+
+import httpx
+import pytest
+
+from bot.breaker import CircuitOpenError
+from bot.http_client import HttpClient
+
+
+def client_for(handler, **kwargs):
+    return HttpClient(transport=httpx.MockTransport(handler), backoff=0, **kwargs)
+
+
+def test_retries_transient_failures():
+    statuses = iter([503, 502, 200])
+
+    async def main():
+        client = client_for(lambda request: httpx.Response(next(statuses), json={"ok": True}), max_retries=2)
+        try:
+            return await client.get_json("https://api.example/x")
+        finally:
+            await client.close()
+
+    assert asyncio.run(main()) == {"ok": True}
+
+
+def test_long_retry_after_fails_fast():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(429, headers={"Retry-After": "3600"})
+
+    async def main():
+        client = client_for(handler, max_retries=3, max_retry_after=5)
+        try:
+            with pytest.raises(httpx.HTTPStatusError):
+                await asyncio.wait_for(client.request("GET", "https://api.example/x"), 1)
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+    assert len(calls) == 1
+
+
+def test_open_breaker_fails_fast():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(500)
+
+    async def main():
+        client = client_for(handler, max_retries=0)
+        try:
+            for _ in range(5):
+                with pytest.raises(httpx.HTTPStatusError):
+                    await client.request("GET", "https://flaky.example/x")
+            with pytest.raises(CircuitOpenError):
+                await client.request("GET", "https://flaky.example/x")
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+    assert len(calls) == 5
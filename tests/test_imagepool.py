@@ -0,0 +1,98 @@
+import asyncio
+
+import httpx
+import pytest
+from telegram import Update
+
+from bot.http_client import HttpClient
+from bot.imagepool import ImagePool
+from bot.testing import make_text_update
+from bot.webhook import start_application, stop_application
+from config import SEARCH_UNAVAILABLE
+
+
+class Search:
+    """fetch_page stand-in: `pages` results in total, failing while `down` is set."""
+
+    def __init__(self, pages=3, page_size=2):
+        self.pages = pages
+        self.page_size = page_size
+        self.down = False
+        self.calls = []
+
+    async def __call__(self, query, search_type, start, num):
+        self.calls.append(start)
+        if self.down:
+            raise httpx.HTTPStatusError("503", request=None, response=None)
+        total = self.pages * self.page_size
+        return [f"https://img.example/{query}/{i}" for i in range(start, min(start + num, total + 1))]
+
+
+def test_pages_through_results_then_cycles():
+    search = Search(pages=2)
+
+    async def main():
+        pool = ImagePool(search, page_size=2, low_water=0)
+        return [await pool.next_url("cat") for _ in range(6)]
+
+    urls = asyncio.run(main())
+    assert urls[:4] == [f"https://img.example/cat/{i}" for i in (1, 2, 3, 4)]
+    assert urls[4:] == urls[:2]
+
+
+def test_failed_search_is_not_cached_as_no_results():
+    search = Search()
+
+    async def main():
+        pool = ImagePool(search, page_size=2, low_water=0)
+        search.down = True
+        with pytest.raises(httpx.HTTPError):
+            await pool.next_url("cat")
+        assert pool.stats()["pools"] == 0
+        search.down = False
+        return await pool.next_url("cat")
+
+    assert asyncio.run(main()) == "https://img.example/cat/1"
+
+
+def test_failed_refill_retries_the_same_page():
+    search = Search(pages=3)
+
+    async def main():
+        pool = ImagePool(search, page_size=2, low_water=0)
+        first = [await pool.next_url("cat") for _ in range(2)]
+        search.down = True
+        # The second page fails: cycle what was served rather than stop paging
+        during = [await pool.next_url("cat") for _ in range(2)]
+        search.down = False
+        after = [await pool.next_url("cat") for _ in range(4)]
+        return first, during, after
+
+    first, during, after = asyncio.run(main())
+    assert during == first
+    assert "https://img.example/cat/3" in after
+    assert "https://img.example/cat/5" in after
+
+
+def test_no_results_returns_none():
+    async def main():
+        pool = ImagePool(Search(pages=0), page_size=2)
+        return await pool.next_url("nothing"), pool.stats()["pools"]
+
+    assert asyncio.run(main()) == (None, 0)
+
+
+def test_image_command_reports_outage(make_bot, bot_api):
+    async def main():
+        application = make_bot()
+        application.bot_data["http"] = HttpClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(503)), max_retries=0
+        )
+        await start_application(application)
+        try:
+            await application.process_update(Update.de_json(make_text_update("/image outage"), application.bot))
+        finally:
+            await stop_application(application)
+
+    asyncio.run(main())
+    assert bot_api.sent("sendMessage")[-1]["text"] == SEARCH_UNAVAILABLE
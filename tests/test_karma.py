@@ -0,0 +1,43 @@
+import asyncio
+
+from bot.karma import KarmaStore
+from bot.shared import SQLiteState
+
+
+def test_leaderboard_follows_scores():
+    store = KarmaStore()
+    store.add(1, 10, name="a")
+    store.add(1, 20, 3, name="b")
+    store.add(1, 10, 4)
+    store.add(2, 30)
+    assert store.top(1) == [(10, "a", 5), (20, "b", 3)]
+    assert store.get(1, 20) == 3
+    assert store.get(2, 10) == 0
+
+
+def test_give_limit_slides_with_the_window():
+    store = KarmaStore(give_limit=2, give_window=60)
+
+    async def main():
+        assert await store.allow_give(1, now=0)
+        assert await store.allow_give(1, now=1)
+        assert not await store.allow_give(1, now=2)
+        assert await store.allow_give(2, now=30)
+        # Most of the first window still overlaps, then it has slid past
+        assert not await store.allow_give(1, now=61)
+        assert await store.allow_give(1, now=115)
+
+    asyncio.run(main())
+
+
+def test_give_limit_is_shared_between_workers(tmp_path):
+    state = SQLiteState(str(tmp_path / "state.sqlite3"))
+    stores = [KarmaStore(state=state, give_limit=3, give_window=60) for _ in range(2)]
+
+    async def main():
+        try:
+            return await asyncio.gather(*(stores[i % 2].allow_give(1) for i in range(8)))
+        finally:
+            await state.close()
+
+    assert sum(asyncio.run(main())) == 3
@@ -0,0 +1,32 @@
+import asyncio
+import logging
+
+from telegram import Update
+
+from bot.logger import StructuredFormatter
+from bot.metrics import instrument
+from bot.testing import make_poll_answer_update, make_text_update
+
+
+async def handle(update, context):
+    await asyncio.sleep(0.01)
+
+
+def test_instrumented_handlers_log_command_latency(caplog):
+    caplog.set_level(logging.INFO, logger="bot")
+    update = Update.de_json(make_text_update("/help", chat_id=-42, user_id=5), None)
+    asyncio.run(instrument(handle, "help_command")(update, None))
+
+    [record] = [record for record in caplog.records if record.getMessage() == "command"]
+    assert (record.command, record.chat_id, record.user_id) == ("help_command", -42, 5)
+    assert record.latency_ms >= 10
+    line = StructuredFormatter("%(message)s").format(record)
+    assert "command='help_command'" in line and "latency_ms=" in line
+
+
+def test_updates_without_a_chat_are_not_logged(caplog):
+    caplog.set_level(logging.INFO, logger="bot")
+    update = Update.de_json(make_poll_answer_update("poll", user_id=5), None)
+    asyncio.run(instrument(handle, "receive_poll_answer")(update, None))
+
+    assert not caplog.records
@@ -0,0 +1,41 @@
+import pytest
+
+from bot.messages import PatternMatcher, tokenize
+
+MATCHER = PatternMatcher([
+    ("greeting", ["hello", "hi", "good morning"]),
+    ("thanks", ["thanks", "thank you"]),
+    ("question", ["what's up", "how are you", "you"]),
+])
+
+
+def test_tokenize_keeps_apostrophes_and_lowercases():
+    assert tokenize("What's UP, doc?") == ("what's", "up", "doc")
+
+
+@pytest.mark.parametrize("text, category", [
+    ("Hello there", "greeting"),
+    ("well, GOOD MORNING!", "greeting"),
+    ("thank you so much", "thanks"),
+    ("what's up", "question"),
+    # Several categories match: the first listed wins wherever it appears
+    ("how are you, thanks", "thanks"),
+    ("you said hi", "greeting"),
+    ("nothing to see", None),
+    ("", None),
+])
+def test_match(text, category):
+    assert MATCHER.match(text) == category
+
+
+def test_patterns_match_whole_words_only():
+    assert MATCHER.match("this is high noon") is None
+    assert MATCHER.match("good mornings") is None
+    assert MATCHER.match("yours truly") is None
+
+
+def test_duplicate_patterns_keep_the_higher_priority():
+    matcher = PatternMatcher([("a", ["hey"]), ("b", ["hey", "yo"])])
+    assert len(matcher) == 2
+    assert matcher.match("hey") == "a"
+    assert matcher.match("yo") == "b"
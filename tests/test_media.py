@@ -0,0 +1,108 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+from bot.media import NAMESPACE, MediaCache, reply_media
+from bot.persistence import SQLPersistence
+
+LONG_URL = "https://img.example/" + "a" * 400 + ".jpg"
+
+
+def test_file_ids_survive_a_restart_under_short_keys(tmp_path):
+    url = f"sqlite:///{tmp_path}/data.sqlite3"
+
+    async def main():
+        persistence = SQLPersistence(url, write_delay=0)
+        media = MediaCache(persistence, max_entries=2)
+        media.put(LONG_URL, "file-1")
+        media.put("https://img.example/b.jpg", "file-2")
+        media.put("https://img.example/c.jpg", "file-3")
+        await persistence.flush()
+
+        persistence = SQLPersistence(url, write_delay=0)
+        saved = await persistence.load_namespace(NAMESPACE)
+        media = MediaCache(persistence)
+        await media.load()
+        await persistence.flush()
+        return saved, media
+
+    saved, media = asyncio.run(main())
+    assert all(len(key) <= 64 for key in saved)
+    assert sorted(saved.values()) == ["file-2", "file-3"]
+    assert media.get(LONG_URL) is None
+    assert media.get("https://img.example/c.jpg") == "file-3"
+
+
+def test_entries_saved_by_url_are_moved_to_digests(tmp_path):
+    url = f"sqlite:///{tmp_path}/data.sqlite3"
+
+    async def main():
+        persistence = SQLPersistence(url, write_delay=0)
+        persistence.stage_kv(NAMESPACE, "https://img.example/old.jpg", "file-old")
+        await persistence.flush()
+
+        persistence = SQLPersistence(url, write_delay=0)
+        media = MediaCache(persistence)
+        await media.load()
+        await persistence.flush()
+        found = media.get("https://img.example/old.jpg")
+
+        persistence = SQLPersistence(url, write_delay=0)
+        saved = await persistence.load_namespace(NAMESPACE)
+        await persistence.flush()
+        return found, saved
+
+    found, saved = asyncio.run(main())
+    assert found == "file-old"
+    assert list(saved.values()) == ["file-old"]
+    assert "://" not in next(iter(saved))
+
+
+class FakePool:
+    def __init__(self, urls):
+        self.urls = list(urls)
+        self.forgotten = []
+
+    async def next_url(self, query, search_type):
+        return self.urls.pop(0) if self.urls else None
+
+    def forget(self, query, search_type, url):
+        self.forgotten.append(url)
+
+
+class FakeMessage:
+    """Accepts URLs and file_ids except those listed as rejected."""
+
+    def __init__(self, rejected=()):
+        self.rejected = set(rejected)
+        self.sent = []
+
+    async def reply_photo(self, photo):
+        self.sent.append(photo)
+        if photo in self.rejected:
+            raise BadRequest("Wrong file identifier/http url specified")
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"fresh:{photo}")])
+
+
+def test_stale_file_id_falls_back_to_its_url():
+    media = MediaCache()
+    media.put("https://img.example/a.jpg", "stale")
+    pool = FakePool(["https://img.example/a.jpg"])
+    message = FakeMessage(rejected={"stale"})
+
+    assert asyncio.run(reply_media(message, media, pool, "cats", "image"))
+    assert message.sent == ["stale", "https://img.example/a.jpg"]
+    assert media.get("https://img.example/a.jpg") == "fresh:https://img.example/a.jpg"
+    assert pool.forgotten == []
+
+
+def test_unfetchable_url_moves_on_to_the_next_result():
+    media = MediaCache()
+    pool = FakePool(["https://img.example/broken.jpg", "https://img.example/b.jpg"])
+    message = FakeMessage(rejected={"https://img.example/broken.jpg"})
+
+    assert asyncio.run(reply_media(message, media, pool, "cats", "image"))
+    assert message.sent == ["https://img.example/broken.jpg", "https://img.example/b.jpg"]
+    assert pool.forgotten == ["https://img.example/broken.jpg"]
+    assert media.get("https://img.example/broken.jpg") is None
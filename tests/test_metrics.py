@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from bot import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Start from no metrics or collectors, and restore the real ones afterwards."""
+    monkeypatch.setattr(metrics, "_metrics", [])
+    monkeypatch.setattr(metrics, "_collectors", {})
+
+
+def test_counters_and_gauges_render_with_labels(registry):
+    sent = metrics.Counter("test_sent_total", "Messages sent", ("chat",))
+    sent.labels("group").inc()
+    sent.labels("group").inc(2)
+    sent.labels("private").inc()
+    queued = metrics.Gauge("test_queued", "Messages waiting")
+    queued.labels().set(4)
+
+    assert metrics.render().splitlines() == [
+        "# HELP test_sent_total Messages sent",
+        "# TYPE test_sent_total counter",
+        'test_sent_total{chat="group"} 3',
+        'test_sent_total{chat="private"} 1',
+        "# HELP test_queued Messages waiting",
+        "# TYPE test_queued gauge",
+        "test_queued 4",
+    ]
+
+
+def test_histograms_render_cumulative_buckets(registry):
+    latency = metrics.Histogram("test_latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3):
+        latency.labels().observe(value)
+
+    lines = metrics.render().splitlines()
+    assert lines[1] == "# TYPE test_latency_seconds histogram"
+    assert lines[2:6] == [
+        'test_latency_seconds_bucket{le="0.1"} 1',
+        'test_latency_seconds_bucket{le="1.0"} 3',
+        'test_latency_seconds_bucket{le="+Inf"} 4',
+        f"test_latency_seconds_sum {0.05 + 0.5 + 0.7 + 3}",
+    ]
+    assert lines[6] == "test_latency_seconds_count 4"
+
+
+def test_collector_values_are_typed(registry):
+    metrics.add_collector("cache", lambda: {"test_cache_entries": 12})
+
+    assert metrics.render().splitlines() == [
+        "# HELP test_cache_entries Read from the cache collector",
+        "# TYPE test_cache_entries untyped",
+        "test_cache_entries 12",
+    ]
+
+
+def test_server_answers_scrapes_and_drops_silent_clients(registry, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_READ_TIMEOUT", 0.05)
+    metrics.add_collector("cache", lambda: {"test_cache_entries": 12})
+
+    async def main():
+        server = await metrics.start_metrics_server("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+
+            # Connects but never sends a request: closed once the read times out
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            silent = await asyncio.wait_for(reader.read(), 1)
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+        return response, silent
+
+    response, silent = asyncio.run(main())
+    assert response.startswith(b"HTTP/1.1 200 OK")
+    assert response.endswith(b"test_cache_entries 12\n")
+    assert silent == b""
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from bot.messages import ResponsePacks
+from config import PACKS_DIR
+
+DEFAULT = {
+    "categories": [{"name": "greeting", "patterns": ["hello"], "responses": ["Hi!"]}],
+    "unknown": ["Pardon?"],
+}
+PIRATE = {
+    "chats": [-100],
+    "categories": [{"name": "greeting", "patterns": ["ahoy"], "responses": ["Arr!"]}],
+    "unknown": ["Shiver me timbers?"],
+}
+
+
+def write(directory, name, data, mtime=None):
+    path = directory / name
+    path.write_text(data if isinstance(data, str) else json.dumps(data), encoding="utf-8")
+    if mtime is not None:
+        # Coarse filesystem clocks can't tell a quick rewrite apart
+        os.utime(path, ns=(mtime, mtime))
+    return path
+
+
+def test_bundled_packs_load():
+    packs = ResponsePacks(PACKS_DIR)
+    packs.load()
+    assert packs.stats()["packs"] >= 1
+    assert packs.respond("zzz unmatched zzz")
+
+
+def test_chat_packs_fall_back_to_the_default(tmp_path):
+    write(tmp_path, "default.json", DEFAULT)
+    write(tmp_path, "pirate.json", PIRATE)
+    packs = ResponsePacks(str(tmp_path))
+    packs.load()
+
+    assert packs.respond("ahoy", chat_id=-100) == "Arr!"
+    assert packs.respond("hello", chat_id=-100) == "Hi!"
+    assert packs.respond("what", chat_id=-100) == "Shiver me timbers?"
+    assert packs.respond("ahoy", chat_id=7) == "Pardon?"
+    assert packs.stats() == {"packs": 2, "chats": 1, "patterns": 2}
+
+
+def test_a_default_pack_is_required(tmp_path):
+    write(tmp_path, "pirate.json", PIRATE)
+    with pytest.raises(RuntimeError):
+        ResponsePacks(str(tmp_path)).load()
+
+
+def test_reload_picks_up_changes_and_keeps_packs_when_a_file_breaks(tmp_path):
+    write(tmp_path, "default.json", DEFAULT, mtime=1)
+    packs = ResponsePacks(str(tmp_path))
+    packs.load()
+
+    async def main():
+        assert not await packs.reload()
+
+        write(tmp_path, "pirate.json", PIRATE, mtime=2)
+        assert await packs.reload()
+        assert packs.respond("ahoy", chat_id=-100) == "Arr!"
+
+        write(tmp_path, "pirate.json", "{not json", mtime=3)
+        assert await packs.reload()
+        # Still answering from the last good set, and not re-parsing the broken file
+        assert packs.respond("ahoy", chat_id=-100) == "Arr!"
+        assert not await packs.reload()
+
+        (tmp_path / "pirate.json").unlink()
+        assert await packs.reload()
+        assert packs.respond("ahoy", chat_id=-100) == "Pardon?"
+
+    asyncio.run(main())
@@ -0,0 +1,215 @@
+import asyncio
+import time
+
+from sqlalchemy import select
+
+from bot.karma import KarmaStore
+from bot.persistence import SQLPersistence, user_data_table
+
+
+def test_round_trip(tmp_path):
+    url = f"sqlite:///{tmp_path}/data.sqlite3"
+
+    async def write():
+        persistence = SQLPersistence(url, write_delay=0)
+        await persistence.update_user_data(5, {"lang": "en"})
+        await persistence.update_chat_data(-100, {"topic": "lunch"})
+        await persistence.update_conversation("poll", (-100, 5), 1)
+        persistence.stage_kv("karma", "-100:5", 3)
+        await persistence.flush()
+
+    async def read():
+        persistence = SQLPersistence(url, write_delay=0)
+        conversations = await persistence.get_conversations("poll")
+        user_data, chat_data = {}, {}
+        await persistence.refresh_user_data(5, user_data)
+        await persistence.refresh_chat_data(-100, chat_data)
+        karma = await persistence.load_namespace("karma")
+        await persistence.flush()
+        return conversations, user_data, chat_data, karma
+
+    asyncio.run(write())
+    conversations, user_data, chat_data, karma = asyncio.run(read())
+    assert conversations == {(-100, 5): 1}
+    assert user_data == {"lang": "en"}
+    assert chat_data == {"topic": "lunch"}
+    assert karma == {"-100:5": 3}
+
+
+def test_staged_rows_are_read_before_they_are_written(tmp_path):
+    async def main():
+        persistence = SQLPersistence(f"sqlite:///{tmp_path}/data.sqlite3", write_delay=60)
+        await persistence.update_user_data(5, {"lang": "en"})
+        # A fresh view of the user, e.g. after drop_user_data, sees the staged row
+        persistence._loaded_users.clear()
+        user_data = {}
+        await persistence.refresh_user_data(5, user_data)
+        await persistence.flush()
+        return user_data
+
+    assert asyncio.run(main()) == {"lang": "en"}
+
+
+def test_deleted_rows_stay_deleted(tmp_path):
+    url = f"sqlite:///{tmp_path}/data.sqlite3"
+
+    async def main():
+        persistence = SQLPersistence(url, write_delay=0)
+        await persistence.update_conversation("poll", (1, 1), 2)
+        await persistence.update_user_data(1, {"a": 1})
+        await persistence.update_conversation("poll", (1, 1), None)
+        await persistence.drop_user_data(1)
+        await persistence.flush()
+
+        persistence = SQLPersistence(url, write_delay=0)
+        conversations = await persistence.get_conversations("poll")
+        user_data = {}
+        await persistence.refresh_user_data(1, user_data)
+        await persistence.flush()
+        return conversations, user_data
+
+    assert asyncio.run(main()) == ({}, {})
+
+
+def bad_row(persistence):
+    # value is NOT NULL, so this row can never be written
+    persistence._stage("kv", ("broken", "k"), {"namespace": "broken", "key": "k", "value": None})
+
+
+def test_bad_row_does_not_block_other_writes(tmp_path, wait_for):
+    url = f"sqlite:///{tmp_path}/data.sqlite3"
+
+    async def main():
+        persistence = SQLPersistence(url, write_delay=0, retry_delay=0.01, max_attempts=3)
+        bad_row(persistence)
+        await persistence.update_user_data(5, {"lang": "en"})
+        # The good row is written right away, and the bad one is retried and dropped on its own
+        await wait_for(lambda: not persistence._pending and not persistence._attempts)
+        await persistence.update_conversation("poll", (1, 5), 1)
+        await persistence.flush()
+
+        persistence = SQLPersistence(url, write_delay=0)
+        user_data = {}
+        await persistence.refresh_user_data(5, user_data)
+        conversations = await persistence.get_conversations("poll")
+        await persistence.flush()
+        return user_data, conversations
+
+    assert asyncio.run(main()) == ({"lang": "en"}, {(1, 5): 1})
+
+
+def test_failed_rows_are_retried_without_new_writes(tmp_path, monkeypatch, wait_for):
+    persistence = SQLPersistence(f"sqlite:///{tmp_path}/data.sqlite3", write_delay=0, retry_delay=0.01)
+    write_batch = persistence._write_batch
+    failures = iter([True, True])
+
+    def flaky(batch):
+        if next(failures, False):
+            raise OSError("database is locked")
+        write_batch(batch)
+
+    monkeypatch.setattr(persistence, "_write_batch", flaky)
+
+    async def main():
+        await persistence.update_user_data(5, {"lang": "en"})
+        query = select(user_data_table).where(user_data_table.c.user_id == 5)
+        await wait_for(lambda: persistence._select(query))
+        await persistence.flush()
+
+    asyncio.run(main())
+
+
+
+def test_unchanged_data_is_not_written_back(tmp_path):
+    url = f"sqlite:///{tmp_path}/data.sqlite3"
+
+    async def main():
+        # Two sharded workers that both see user 5
+        first = SQLPersistence(url, write_delay=0)
+        second = SQLPersistence(url, write_delay=0)
+        first_data, second_data = {}, {}
+        await first.refresh_user_data(5, first_data)
+        await second.refresh_user_data(5, second_data)
+
+        first_data["poll"] = "draft"
+        await first.update_user_data(5, first_data)
+        await first.flush()
+        # The second worker only handled an update from the user; its copy is unchanged
+        await second.update_user_data(5, second_data)
+        await second.flush()
+
+        reader = SQLPersistence(url, write_delay=0)
+        user_data = {}
+        await reader.refresh_user_data(5, user_data)
+        await reader.flush()
+        return user_data
+
+    assert asyncio.run(main()) == {"poll": "draft"}
+
+
+def test_concurrent_updates_wait_for_the_first_read(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path}/data.sqlite3"
+
+    async def write():
+        persistence = SQLPersistence(url, write_delay=0)
+        await persistence.update_user_data(5, {"lang": "en"})
+        await persistence.update_chat_data(-100, {"topic": "lunch"})
+        await persistence.flush()
+
+    asyncio.run(write())
+    select_rows = SQLPersistence._select
+
+    def slow_select(self, statement):
+        time.sleep(0.05)
+        return select_rows(self, statement)
+
+    monkeypatch.setattr(SQLPersistence, "_select", slow_select)
+
+    async def main():
+        persistence = SQLPersistence(url, write_delay=0)
+        user_data, chat_data = {}, {}
+
+        # Like two updates from the same user and chat handled at once
+        async def update():
+            await persistence.refresh_user_data(5, user_data)
+            await persistence.refresh_chat_data(-100, chat_data)
+            return dict(user_data), dict(chat_data)
+
+        results = await asyncio.gather(update(), update(), update())
+        await persistence.flush()
+        return results
+
+    for user_data, chat_data in asyncio.run(main()):
+        assert user_data == {"lang": "en"}
+        assert chat_data == {"topic": "lunch"}
+
+
+def test_sqlite_runs_in_wal_mode(tmp_path):
+    persistence = SQLPersistence(f"sqlite:///{tmp_path}/data.sqlite3")
+    with persistence.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+    persistence.engine.dispose()
+
+
+def test_a_worker_resumes_only_its_own_chats(tmp_path):
+    url = f"sqlite:///{tmp_path}/data.sqlite3"
+
+    async def main():
+        persistence = SQLPersistence(url, write_delay=0)
+        for chat_id, user_id in ((-100, 5), (-101, 6)):
+            await persistence.update_user_data(user_id, {"draft": chat_id})
+            await persistence.update_conversation("poll", (chat_id, user_id), 1)
+            persistence.stage_kv("karma", f"{chat_id}:{user_id}", (3, None))
+        await persistence.flush()
+
+        worker = SQLPersistence(url, write_delay=0, owns_chat=lambda chat_id: chat_id == -100)
+        karma = KarmaStore(worker)
+        await karma.load(worker.owns_chat)
+        conversations = await worker.get_conversations("poll")
+        await worker.flush()
+        return conversations, worker._preloaded_users, karma
+
+    conversations, preloaded, karma = asyncio.run(main())
+    assert conversations == {(-100, 5): 1}
+    assert list(preloaded) == [5]
+    assert karma.get(-100, 5) == 3 and karma.get(-101, 6) == 0
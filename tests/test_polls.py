@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+from telegram import Update
+
+from bot.persistence import SQLPersistence
+from bot.polls import PollVotes
+from bot.testing import make_callback_update, make_text_update
+from bot.webhook import start_application, stop_application
+from config import POLL_DRAFT_TTL
+
+
+async def process(application, payload):
+    await application.process_update(Update.de_json(payload, application.bot))
+
+
+def test_restored_drafts_survive_the_first_sweep_after_a_restart(make_bot, bot_api):
+    async def main():
+        application = make_bot()
+        await start_application(application)
+        await process(application, make_text_update("/poll", chat_id=-100, user_id=5))
+        await process(application, make_text_update("Lunch?", chat_id=-100, user_id=5))
+        await stop_application(application)
+
+        application = make_bot()
+        await start_application(application)
+        try:
+            sweeper = application.bot_data["poll_sweeper"]
+            assert sweeper.sweep()["conversations"] == 0
+            assert (-100, 5) in sweeper.conversation._conversations
+
+            # The user picks up where they left off
+            await process(application, make_callback_update("add_option", chat_id=-100, user_id=5))
+            await process(application, make_text_update("Pizza", chat_id=-100, user_id=5))
+            assert "1. Pizza" in bot_api.sent()[-1]["text"]
+
+            # Abandoned drafts still go once they are old enough
+            evicted = sweeper.sweep(now=time.time() + POLL_DRAFT_TTL + 1)
+            assert evicted["conversations"] == 1 and evicted["drafts"] == 1
+        finally:
+            await stop_application(application)
+
+    asyncio.run(main())
+
+
+def test_sweep_after_restart_evicts_expired_restored_conversations(make_bot):
+    async def main():
+        application = make_bot()
+        await start_application(application)
+        await process(application, make_text_update("/poll", chat_id=-100, user_id=5))
+        await stop_application(application)
+
+        application = make_bot()
+        await start_application(application)
+        try:
+            sweeper = application.bot_data["poll_sweeper"]
+            return sweeper.sweep(now=time.time() + POLL_DRAFT_TTL + 1)
+        finally:
+            await stop_application(application)
+
+    assert asyncio.run(main())["conversations"] == 1
+
+
+def test_tally_follows_the_message_finish_poll_leaves(make_bot, bot_api):
+    async def main():
+        application = make_bot()
+        await start_application(application)
+        try:
+            for payload in (
+                make_text_update("/poll", chat_id=-100, user_id=5),
+                make_text_update("Lunch?", chat_id=-100, user_id=5),
+                make_callback_update("add_option", chat_id=-100, user_id=5),
+                make_text_update("Pizza", chat_id=-100, user_id=5),
+                make_callback_update("add_option", chat_id=-100, user_id=5),
+                make_text_update("Salad", chat_id=-100, user_id=5),
+            ):
+                await process(application, payload)
+            # The builder message was deleted, so the results go into a new message
+            bot_api.deleted_messages.add(bot_api.messages[0]["message_id"])
+            await process(application, make_callback_update("finish_poll", chat_id=-100, user_id=5))
+            results = bot_api.messages[-1]
+            assert results["text"].startswith("📊 Lunch?")
+
+            await process(
+                application, make_callback_update("vote_0", chat_id=-100, user_id=6, message_id=results["message_id"])
+            )
+            return bot_api.sent("answerCallbackQuery")[-1]["text"]
+        finally:
+            await stop_application(application)
+
+    assert asyncio.run(main()) == "Vote registered!"
+
+
+def test_malformed_saved_tallies_are_dropped(tmp_path):
+    url = f"sqlite:///{tmp_path}/data.sqlite3"
+
+    async def main():
+        persistence = SQLPersistence(url, write_delay=0)
+        persistence.stage_kv(PollVotes.NAMESPACE, "-100:None", ("Lunch?", ("a", "b"), None, [0, 0], {}, time.time()))
+        persistence.stage_kv(PollVotes.NAMESPACE, "-100:7", ("Lunch?", ("a", "b"), "p1", [1, 0], {5: (0,)}, time.time()))
+        await persistence.flush()
+
+        persistence = SQLPersistence(url, write_delay=0)
+        votes = PollVotes(persistence)
+        await votes.load(None)
+        await persistence.flush()
+
+        persistence = SQLPersistence(url, write_delay=0)
+        remaining = await persistence.load_namespace(PollVotes.NAMESPACE)
+        await persistence.flush()
+        return votes.stats(), list(remaining)
+
+    assert asyncio.run(main()) == ({"tallies": 1, "votes": 1, "pending_refreshes": 0}, ["-100:7"])
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+from bot.sender import PRIORITY_BROADCAST, SendScheduler, TokenBucket
+from bot.testing import FakeBotRequest
+
+
+def make_scheduled_bot(bot_api, **rates):
+    rates = {"global_rate": 1000, "private_rate": 1000, "group_rate": 1000, "group_burst": 1, **rates}
+    return ExtBot("123456:test", request=bot_api, get_updates_request=bot_api, rate_limiter=SendScheduler(**rates))
+
+
+def test_token_bucket_reservations_queue_up():
+    bucket = TokenBucket(rate=2, capacity=1)
+    now = bucket.updated
+    assert bucket.reserve(now) == 0
+    assert bucket.reserve(now) == 0.5
+    assert bucket.reserve(now) == 1.0
+    # Refilled at the bucket's rate, never past its capacity
+    assert bucket.reserve(now + 10) == 0
+
+
+def test_flood_wait_is_retried():
+    bot_api = FakeBotRequest()
+    bot_api.flood(5, retry_after=1)
+
+    async def main():
+        async with make_scheduled_bot(bot_api) as bot:
+            start = time.monotonic()
+            message = await bot.send_message(5, "hello")
+            return message, time.monotonic() - start
+
+    message, elapsed = asyncio.run(main())
+    assert message.text == "hello"
+    assert len(bot_api.sent("sendMessage")) == 2
+    assert elapsed >= 1
+
+
+def test_flood_wait_gives_up_after_max_retries():
+    bot_api = FakeBotRequest()
+
+    async def main():
+        async with make_scheduled_bot(bot_api, max_retries=0) as bot:
+            bot_api.flood(5, retry_after=1)
+            await bot.send_message(5, "hello")
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(main())
+
+
+def test_each_chat_is_paced_separately():
+    bot_api = FakeBotRequest()
+
+    async def main():
+        async with make_scheduled_bot(bot_api, private_rate=10) as bot:
+            start = time.monotonic()
+            busy = asyncio.gather(*(bot.send_message(5, str(i)) for i in range(4)))
+            await bot.send_message(6, "other chat")
+            other_chat = time.monotonic() - start
+            await busy
+            return other_chat, time.monotonic() - start
+
+    other_chat, busy_chat = asyncio.run(main())
+    # One message per 0.1s for chat 5; chat 6 isn't held up behind it
+    assert busy_chat >= 0.3
+    assert other_chat < 0.1
+
+
+def test_interactive_replies_go_ahead_of_broadcasts():
+    bot_api = FakeBotRequest()
+
+    async def main():
+        async with make_scheduled_bot(bot_api, global_rate=20) as bot:
+            # Use up the global burst so the sends below have to queue
+            await asyncio.gather(*(bot.send_message(100 + i, "warm up") for i in range(20)))
+            bot_api.calls.clear()
+            broadcasts = [
+                bot.send_message(200 + i, "news", rate_limit_args={"priority": PRIORITY_BROADCAST})
+                for i in range(5)
+            ]
+            await asyncio.gather(*broadcasts, bot.send_message(5, "reply"))
+
+    asyncio.run(main())
+    assert bot_api.sent("sendMessage")[0]["chat_id"] == 5
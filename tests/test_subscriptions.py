@@ -0,0 +1,114 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram import Update
+from telegram.ext import ExtBot
+
+from bot.handlers import format_forecast
+from bot.persistence import SQLPersistence
+from bot.sender import SendScheduler
+from bot.subscriptions import DAILY_FORECAST_HOURS, HOURLY, HOURLY_FORECAST_HOURS, WeatherSubscriptions, parse_slot
+from bot.testing import FakeBotRequest, make_text_update
+from bot.webhook import start_application, stop_application
+
+FORECAST = {
+    "list": [
+        {"dt": 1767258000 + i * 10800, "main": {"temp": 5 + i}, "weather": [{"description": "light rain"}]}
+        for i in range(10)
+    ],
+}
+
+
+def test_slots_are_parsed():
+    assert parse_slot("8:05") == "08:05"
+    assert parse_slot("HOURLY") == HOURLY
+    assert parse_slot("24:00") is None
+    assert parse_slot("noon") is None
+
+
+def test_forecast_lists_the_hours_ahead():
+    lines = format_forecast("London, GB", FORECAST, hours=6).splitlines()
+    assert lines == [
+        "Forecast for London, GB:",
+        "Thu 09:00 UTC: 5°C, light rain",
+        "Thu 12:00 UTC: 6°C, light rain",
+    ]
+    assert len(format_forecast("London, GB", FORECAST).splitlines()) == 1 + 24 // 3
+
+
+def test_a_city_is_fetched_once_per_slot_for_all_its_chats():
+    bot_api = FakeBotRequest()
+    fetches = []
+
+    async def fetch_report(city, city_id, hours):
+        fetches.append((city, city_id, hours))
+        return f"Forecast for {city}"
+
+    subscriptions = WeatherSubscriptions(fetch_report, spread=0)
+    for chat_id in (1, 2, 3):
+        assert subscriptions.subscribe(chat_id, "08:00", "London, GB", 2643743)
+    subscriptions.subscribe(4, HOURLY, "London, GB", 2643743)
+
+    async def main():
+        async with ExtBot("123456:test", request=bot_api, rate_limiter=SendScheduler()) as bot:
+            for slot in ("08:00", HOURLY):
+                job = SimpleNamespace(data=(slot, "2643743"))
+                await subscriptions._deliver_job(SimpleNamespace(job=job, bot=bot))
+
+    asyncio.run(main())
+    assert fetches == [
+        ("London, GB", 2643743, DAILY_FORECAST_HOURS),
+        ("London, GB", 2643743, HOURLY_FORECAST_HOURS),
+    ]
+    assert sorted(params["chat_id"] for params in bot_api.sent("sendMessage")) == [1, 2, 3, 4]
+
+
+def test_chats_are_capped_and_can_unsubscribe():
+    subscriptions = WeatherSubscriptions(None, max_per_chat=2)
+    assert subscriptions.subscribe(1, "08:00", "Paris")
+    assert subscriptions.subscribe(1, HOURLY, "paris")
+    assert not subscriptions.subscribe(1, "09:00", "Tokyo")
+
+    assert subscriptions.unsubscribe(1, "PARIS") == 2
+    assert subscriptions.for_chat(1) == []
+    assert subscriptions.stats() == {"slots": 0, "cities": 0, "subscriptions": 0}
+
+
+def test_subscriptions_survive_a_restart(tmp_path):
+    url = f"sqlite:///{tmp_path}/data.sqlite3"
+
+    async def main():
+        persistence = SQLPersistence(url, write_delay=0)
+        subscriptions = WeatherSubscriptions(None, persistence)
+        subscriptions.subscribe(1, "08:00", "London, GB", 2643743)
+        subscriptions.subscribe(2, HOURLY, "Paris")
+        subscriptions.subscribe(3, "08:00", "Paris")
+        subscriptions.unsubscribe(3, "Paris")
+        await persistence.flush()
+
+        persistence = SQLPersistence(url, write_delay=0)
+        restored = WeatherSubscriptions(None, persistence)
+        # A sharded worker that owns only odd chats
+        await restored.load(None, owns_chat=lambda chat_id: chat_id % 2)
+        await persistence.flush()
+        return restored
+
+    restored = asyncio.run(main())
+    assert restored.for_chat(1) == [("08:00", "London, GB")]
+    assert restored.for_chat(2) == [] and restored.for_chat(3) == []
+
+
+def test_subscribe_command_schedules_the_slot(make_bot, bot_api):
+    async def main():
+        application = make_bot()
+        await start_application(application)
+        try:
+            update = make_text_update("/weather subscribe Paris 07:30", chat_id=-100)
+            await application.process_update(Update.de_json(update, application.bot))
+            return application.job_queue.get_jobs_by_name("weather_slot:07:30")
+        finally:
+            await stop_application(application)
+
+    jobs = asyncio.run(main())
+    assert len(jobs) == 1
+    assert bot_api.sent("sendMessage")[-1]["text"] == "Subscribed to the forecast for Paris every day at 07:30 UTC."
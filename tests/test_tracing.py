@@ -0,0 +1,88 @@
+import asyncio
+import json
+import logging
+import time
+
+import pytest
+from telegram import Update
+
+import config
+from bot import tracing
+from bot.concurrency import ChatOrderedUpdateProcessor
+from bot.testing import make_text_update
+
+
+@pytest.fixture
+def trace_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_spans_are_free_while_tracing_is_off():
+    assert not tracing.active
+    assert tracing.span("http", "example.com") is tracing._NO_SPAN
+
+
+def test_updates_are_traced_to_jsonl(trace_dir, monkeypatch, caplog):
+    monkeypatch.setattr(tracing, "TRACE_SLOW_UPDATE", 0.05)
+    processor = ChatOrderedUpdateProcessor(concurrency=4)
+
+    async def handle(delay):
+        with tracing.span("handler", "help"):
+            with tracing.span("http", "api.example.com"):
+                await asyncio.sleep(delay)
+
+    async def main():
+        tracing.enable(asyncio.get_running_loop())
+        try:
+            for chat_id, delay in ((1, 0), (2, 0.06)):
+                update = Update.de_json(make_text_update("/help", chat_id=chat_id), None)
+                await processor.process_update(update, handle(delay))
+        finally:
+            tracing.disable()
+
+    with caplog.at_level(logging.WARNING, logger="bot.tracing"):
+        asyncio.run(main())
+    [path] = trace_dir.glob("traces-*.jsonl")
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["chat_id"] for record in records] == [1, 2]
+    # Spans are recorded as they close, innermost first
+    assert [(s["name"], s["detail"]) for s in records[1]["spans"]] == [("http", "api.example.com"), ("handler", "help")]
+    assert records[1]["total_ms"] >= 60
+    slow = [r.message for r in caplog.records if r.message.startswith("Slow update")]
+    assert len(slow) == 1 and "in chat 2" in slow[0] and "http[api.example.com]" in slow[0]
+
+
+def test_writer_drops_rather_than_queues_without_bound(tmp_path):
+    writer = tracing.TraceWriter(str(tmp_path / "traces.jsonl"), max_pending=2)
+    for i in range(5):
+        writer.write({"update_id": i})
+    writer.start()
+    writer.close()
+    assert writer.dropped == 3
+    assert (tmp_path / "traces.jsonl").read_text().splitlines() == ['{"update_id": 0}', '{"update_id": 1}']
+
+
+def test_monitor_reports_stalls_and_writes_profiles(tmp_path, caplog):
+    async def main():
+        monitor = tracing.LoopMonitor(
+            asyncio.get_running_loop(), stall_threshold=0.05, sample_interval=0.01, directory=str(tmp_path)
+        )
+        monitor.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.3)  # Blocks the loop
+        await asyncio.sleep(0.05)
+        monitor.stop()
+
+    with caplog.at_level(logging.WARNING, logger="bot.tracing"):
+        asyncio.run(main())
+    stalls = [r.message for r in caplog.records if r.message.startswith("Event loop blocked")]
+    assert len(stalls) == 1 and "test_tracing.py" in stalls[0]
+    [profile] = tmp_path.glob("profile-*.folded")
+    assert any("test_tracing.py:main" in line for line in profile.read_text().splitlines())
+
+
+def test_monitor_settings_are_validated(monkeypatch):
+    monkeypatch.setattr(config, "TRACE_STALL_THRESHOLD", 0)
+    with pytest.raises(ValueError, match="TRACE_STALL_THRESHOLD"):
+        config.validate()
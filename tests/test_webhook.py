@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from bot.testing import FakeTelegram, make_text_update
+from bot.webhook import SECRET_HEADER, WebhookApp
+
+SECRET = "s3cret"
+
+
+async def request(app, path, method="GET", body=b"", headers=()):
+    """Send one HTTP request to an ASGI app and return the status code."""
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app({"type": "http", "method": method, "path": path, "headers": list(headers)}, receive, send)
+    return sent[0]["status"]
+
+
+def test_update_is_processed(make_bot, bot_api, wait_for):
+    async def main():
+        app = WebhookApp(make_bot, secret=SECRET)
+        async with FakeTelegram(app, secret=SECRET) as telegram:
+            assert await telegram.post_update(make_text_update("/help", chat_id=7)) == 200
+            await wait_for(lambda: bot_api.sent("sendMessage"))
+        assert bot_api.sent("sendMessage")[0]["chat_id"] == 7
+        assert "/weather" in bot_api.sent("sendMessage")[0]["text"]
+
+    asyncio.run(main())
+
+
+def test_secret_is_checked(make_bot):
+    async def main():
+        app = WebhookApp(make_bot, secret=SECRET)
+        async with FakeTelegram(app, secret="wrong") as telegram:
+            assert await telegram.post_update(make_text_update("/help")) == 403
+        async with FakeTelegram(app) as telegram:
+            assert await telegram.post_update(make_text_update("/help")) == 403
+        async with FakeTelegram(app, secret=SECRET) as telegram:
+            assert await telegram.post_update(make_text_update("/help")) == 200
+
+    asyncio.run(main())
+
+
+def test_malformed_payloads_are_rejected(make_bot):
+    async def main():
+        app = WebhookApp(make_bot, secret=SECRET)
+        async with FakeTelegram(app, secret=SECRET) as telegram:
+            for payload in ([], 1, "update", None, {"message": "not a message"}):
+                assert await telegram.post_update(payload) == 400
+            assert await request(app, telegram.path, "POST", b"{not json", [(SECRET_HEADER, SECRET.encode())]) == 400
+
+    asyncio.run(main())
+
+
+def test_only_webhook_routes_are_served(make_bot):
+    async def main():
+        app = WebhookApp(make_bot, secret=SECRET)
+        async with FakeTelegram(app, secret=SECRET) as telegram:
+            assert await request(app, "/healthz") == 200
+            assert await request(app, "/metrics") == 404
+            assert await request(app, telegram.path, "GET") == 405
+
+    asyncio.run(main())
+
+
+def test_secret_is_required(make_bot):
+    for secret in (None, ""):
+        with pytest.raises(ValueError):
+            WebhookApp(make_bot, secret=secret)
+
+
+def test_oversized_bodies_are_rejected(make_bot):
+    async def main():
+        app = WebhookApp(make_bot, secret=SECRET, max_body=64)
+        async with FakeTelegram(app, secret=SECRET) as telegram:
+            headers = [(SECRET_HEADER, SECRET.encode())]
+            assert await request(app, telegram.path, "POST", b"x" * 65, headers) == 413
+            declared = headers + [(b"content-length", b"65")]
+            assert await request(app, telegram.path, "POST", b"", declared) == 413
+
+    asyncio.run(main())
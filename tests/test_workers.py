@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from telegram import Bot, Update
+
+import config
+from bot import workers
+from bot.polls import poll_chat_key
+from bot.shared import LocalState, SQLiteState
+from bot.testing import make_poll_answer_update, make_text_update
+from bot.workers import ShardedPoller, owns_chat, route, shard_for
+
+
+def test_shard_for_is_stable_and_spread():
+    shards = [shard_for(chat_id, 4) for chat_id in range(-500, 500)]
+    assert shards == [shard_for(chat_id, 4) for chat_id in range(-500, 500)]
+    assert set(shards) == {0, 1, 2, 3}
+    assert shard_for(42, 1) == 0
+    assert shard_for(None, 4) == 0
+
+
+def test_each_chat_has_one_owner():
+    for chat_id in range(-50, 50):
+        assert sum(owns_chat(chat_id, 3, index) for index in range(3)) == 1
+
+
+def test_route_by_chat_and_poll_answers_by_the_poll_chat():
+    bot = Bot("123456:test")
+
+    async def main():
+        state = LocalState()
+        message = Update.de_json(make_text_update("/help", chat_id=-1001), bot)
+        assert await route(message, 4, state) == shard_for(-1001, 4)
+
+        await state.set(poll_chat_key("p1"), -1001)
+        answer = Update.de_json(make_poll_answer_update("p1", user_id=7), bot)
+        return await route(answer, 4, state)
+
+    assert asyncio.run(main()) == shard_for(-1001, 4)
+
+
+def test_sqlite_state_is_shared_between_instances(tmp_path):
+    async def main():
+        first = SQLiteState(str(tmp_path / "shared.sqlite3"))
+        second = SQLiteState(str(tmp_path / "shared.sqlite3"))
+        try:
+            await first.incrby("hits", 2, ex=60)
+            await second.incrby("hits", 3, ex=60)
+            await first.set("city", {"temp": 18}, ex=60)
+            await first.set("gone", 1, ex=-1)
+            values = await second.mget(["hits", "city", "gone", "missing"])
+            return values, await second.purge_expired(), second.stats()
+        finally:
+            await first.close()
+            await second.close()
+
+    assert asyncio.run(main()) == ([5, {"temp": 18}, None, None], 1, {"keys": 2})
+
+
+class FakeProcess:
+    def __init__(self, alive):
+        self.alive = alive
+        self.exitcode = None if alive else -9
+
+    def is_alive(self):
+        return self.alive
+
+
+def test_hand_off_restarts_a_dead_worker_instead_of_blocking(monkeypatch):
+    monkeypatch.setattr(workers, "HAND_OFF_TIMEOUT", 0.05)
+    poller = ShardedPoller(workers=1, bot=Bot("123456:test"), queue_size=1)
+    poller._processes = [FakeProcess(alive=False)]
+    poller._queues[0].put("stuck")
+
+    def restart(index):
+        # The new worker drains what the dead one left behind
+        assert poller._queues[index].get(timeout=1) == "stuck"
+        poller._processes[index] = FakeProcess(alive=True)
+
+    monkeypatch.setattr(poller, "_start_worker", restart)
+    asyncio.run(asyncio.wait_for(poller._hand_off(0, "next"), 2))
+    assert poller._queues[0].get(timeout=1) == "next"
+
+
+def test_workers_need_a_cross_process_shared_state(monkeypatch):
+    monkeypatch.setattr(config, "BOT_MODE", "polling")
+    monkeypatch.setattr(config, "BOT_WORKERS", 2)
+    for name in ("TELEGRAM_TOKEN", "WEATHER_API_KEY", "GOOGLE_API_KEY", "GOOGLE_SEARCH_ENGINE_ID"):
+        monkeypatch.setattr(config, name, "set")
+    monkeypatch.setattr(config, "SHARED_STATE_URL", "local")
+    with pytest.raises(ValueError, match="SHARED_STATE_URL"):
+        config.validate()
+    monkeypatch.setattr(config, "SHARED_STATE_URL", "sqlite:///shared.sqlite3")
+    config.validate()